@@ -2,6 +2,7 @@ from django.conf import settings
 from django.contrib.auth import authenticate, get_user_model, login, logout
 from django.core import signing
 from django.contrib.sites.shortcuts import get_current_site
+from django.db import transaction
 from django.template.loader import render_to_string
 from django.utils.translation import gettext_lazy as _
 
@@ -11,6 +12,7 @@ from rest_framework.response import Response
 from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST, HTTP_404_NOT_FOUND
 from rest_framework.views import APIView
 
+from general.outbox import queue_email
 from .exceptions import ActivationError
 from .serializers import LoginSerializer, PasswordResetSerializer, PasswordSetSerializer, RegistrationSerializer
 
@@ -159,12 +161,7 @@ class PasswordResetView(UpdateAPIView):
         )
         # Force subject to a single line to avoid header-injection issues.
         subject = "".join(subject.splitlines())
-        message = render_to_string(
-            template_name="registration/password_reset_email_body.txt",
-            context=context,
-            request=request,
-        )
-        user.email_user(subject, message, settings.DEFAULT_FROM_EMAIL)
+        queue_email([user.email], subject, "registration/password_reset_email_body.txt", context)
 
 
 class PasswordSetView(UpdateAPIView):
@@ -229,9 +226,10 @@ class RegistrationView(CreateAPIView):
 
         serializer = self.serializer_class(data=data, context={'request': self.request})
         if serializer.is_valid(raise_exception=True):
-            new_user = serializer.create(validated_data=serializer.validated_data)
+            with transaction.atomic():
+                new_user = serializer.create(validated_data=serializer.validated_data)
 
-            self.send_activation_email(new_user)
+                self.send_activation_email(new_user)
 
             return Response(status=HTTP_200_OK)
 
@@ -272,9 +270,4 @@ class RegistrationView(CreateAPIView):
         # Force subject to a single line to avoid header-injection
         # issues.
         subject = "".join(subject.splitlines())
-        message = render_to_string(
-            template_name="registration/activation_email_body.txt",
-            context=context,
-            request=self.request,
-        )
-        user.email_user(subject, message, settings.DEFAULT_FROM_EMAIL)
+        queue_email([user.email], subject, "registration/activation_email_body.txt", context)
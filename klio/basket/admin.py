@@ -5,7 +5,8 @@ from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
 from django.template.response import TemplateResponse
 
-from .models import Basket, BasketProduct, Order, OrderPrivateInfo, OrderDeliveryInfo, OrderPaymentInfo, PromoCode, OrderPaymentB2PInfo
+from .models import (Basket, BasketProduct, DeliveryTariff, Order, OrderItem, OrderPrivateInfo, OrderDeliveryInfo,
+                     OrderPaymentInfo, PromoCode, OrderPaymentB2PInfo)
 from .utils import export_orders_csv
 
 
@@ -20,6 +21,17 @@ class BasketProductInline(admin.TabularInline):
     raw_id_fields = ('product',)
 
 
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    fields = ['art', 'name', 'price', 'promo_price', 'quantity', 'total']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 class BasketAdmin(admin.ModelAdmin):
     list_display = ['__str__', 'created', 'get_user', 'is_active']
     list_per_page = 50
@@ -39,6 +51,9 @@ class OrderAdmin(admin.ModelAdmin):
     list_filter = ['status', 'is_paid', 'promo', 'received']
     search_fields = ['user__first_name', 'user__last_name', 'user__middle_name', 'user__username', 'user__email']
     actions = [export_orders_csv]
+    inlines = [
+        OrderItemInline,
+    ]
 
     def get_user(self, obj):
         if obj.user:
@@ -68,12 +83,16 @@ class OrderAdmin(admin.ModelAdmin):
         return None
     get_delivery_price.short_description = _('Delivery price')
 
+    def get_queryset(self, request):
+        return super(OrderAdmin, self).get_queryset(request).select_related(
+            'user', 'private_info', 'delivery_info__to_city'
+        ).prefetch_related('items')
+
     def get_products(self, obj):
         result = ''
-        for bp in obj.basket.inside.all():
-            price = bp.promo_price if bp.promo_price else bp.price if bp.price else 0
+        for item in obj.get_items():
             line = linebreaks('<strong>{0}</strong> {1}, цена: {2}, кол-во: {3}, сумма: {4}<br />'.format(
-                bp.product.art, bp.product.name, price, bp.quantity, price * bp.quantity
+                item.art, item.name, item.promo_price or item.price or 0, item.quantity, item.total
             ))
             result += line
         return mark_safe(result)
@@ -117,6 +136,12 @@ class OrderAdmin(admin.ModelAdmin):
         )
 
 
+class DeliveryTariffAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'delivery_type', 'city', 'region', 'price', 'free_threshold', 'activity']
+    list_filter = ['delivery_type', 'activity']
+    autocomplete_fields = ['city', 'region']
+
+
 class PromoCodeAdmin(admin.ModelAdmin):
     list_display = ['__str__', 'start_date', 'deadline', 'activity']
     autocomplete_fields = ['products', 'categories', 'tags']
@@ -124,6 +149,7 @@ class PromoCodeAdmin(admin.ModelAdmin):
 
 admin.site.register(Basket, BasketAdmin)
 admin.site.register(Order, OrderAdmin)
+admin.site.register(DeliveryTariff, DeliveryTariffAdmin)
 admin.site.register(OrderPrivateInfo)
 admin.site.register(OrderDeliveryInfo, HiddenAdmin)
 admin.site.register(OrderPaymentInfo, HiddenAdmin)
@@ -5,3 +5,6 @@ from django.utils.translation import ugettext_lazy as _
 class BasketConfig(AppConfig):
     name = 'basket'
     verbose_name = _('Basket App')
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Basket, Order
+
+CHUNK_SIZE = 1000
+
+
+def clear_expired_sessions(chunk_size=CHUNK_SIZE):
+    """
+    Deletes expired sessions from the database by chunks, so the table is never locked for long.
+    Returns the number of deleted sessions.
+    """
+    count = 0
+    while True:
+        expired = Session.objects.filter(expire_date__lt=timezone.now())
+        keys = list(expired.values_list('session_key', flat=True)[:chunk_size])
+        if not keys:
+            return count
+        Session.objects.filter(session_key__in=keys).delete()
+        count += len(keys)
+
+
+def get_abandoned_baskets():
+    """
+    Returns anonymous baskets which can not be reached anymore: created before the session cookie age
+    and not belonging to a live session stored in the database. Ordered baskets are kept, baskets with
+    the order not placed yet are abandoned together with the order.
+    """
+    expired = timezone.now() - timezone.timedelta(seconds=settings.SESSION_COOKIE_AGE)
+    live_sessions = Session.objects.filter(expire_date__gte=timezone.now()).values('session_key')
+    return Basket.objects.filter(user__isnull=True, created__lt=expired).exclude(
+        session_key__in=live_sessions
+    ).filter(
+        Q(order__isnull=True) | Q(order__status=Order.ACTIVE)
+    )
+
+
+def clear_abandoned_baskets(chunk_size=CHUNK_SIZE):
+    """
+    Deletes abandoned baskets (see `get_abandoned_baskets`) with their products and orders by chunks.
+    Returns the number of deleted baskets.
+    """
+    count = 0
+    while True:
+        baskets_ids = list(get_abandoned_baskets().values_list('id', flat=True)[:chunk_size])
+        if not baskets_ids:
+            return count
+        Basket.objects.filter(id__in=baskets_ids).delete()
+        count += len(baskets_ids)
@@ -0,0 +1,75 @@
+from django.http import Http404
+
+from .models import Basket, Order
+
+
+def get_owner(request):
+    """
+    Returns the user id and the session key the basket and the order of the request belong to.
+    Anonymous visitors are identified by the session key, so any session engine works.
+    """
+    if not request.user.is_anonymous:
+        return {'user_id': request.user.id}
+    return {'session_key': request.session.session_key}
+
+
+def _get_current(model, queryset, request):
+    """
+    Returns the instance of the owner of the request found by one query, or a new unsaved one.
+    The instance is not kept between the requests, so it is never older than the request.
+    """
+    owner = get_owner(request)
+    if not any(owner.values()):
+        return model(**owner)
+    instance = queryset.filter(**owner).first()
+    return model(**owner) if instance is None else instance
+
+
+def get_current_basket(request):
+    """
+    Returns the active basket of the request or a new unsaved one (with no pk) if there is no basket.
+    """
+    return _get_current(Basket, Basket.objects.filter(is_active=True), request)
+
+
+def get_active_order(request):
+    """
+    Returns the active order of the request or a new unsaved one (with no pk) if there is no order.
+    """
+    return _get_current(Order, Order.objects.filter(status=Order.ACTIVE), request)
+
+
+def get_current_basket_or_404(request):
+    if request.basket.pk is None:
+        raise Http404
+    return request.basket
+
+
+def get_active_order_or_404(request):
+    if request.active_order.pk is None:
+        raise Http404
+    return request.active_order
+
+
+def get_or_create_current_basket(request):
+    """
+    Returns the active basket of the request, creates the basket (and the session for anonymous visitors) if needed.
+    """
+    basket = request.basket
+    if basket.pk is None:
+        if request.user.is_anonymous and not request.session.session_key:
+            request.session.create()
+            basket.session_key = request.session.session_key
+        basket.save()
+    return basket
+
+
+def get_or_create_active_order(request, basket):
+    """
+    Returns the active order of the basket, creates the order if needed.
+    """
+    order = request.active_order
+    if order.pk is None or order.basket_id != basket.pk:
+        order = Order.objects.create(basket=basket, status=Order.ACTIVE, **get_owner(request))
+        request.active_order = order
+    return order
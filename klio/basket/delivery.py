@@ -0,0 +1,58 @@
+from django.core.cache import cache
+
+from cities_light.models import City
+
+from .models import DeliveryTariff
+
+TARIFFS_VERSION_CACHE_KEY = 'delivery_tariffs_version'
+
+# Tariffs of this process: the version they are compiled for and the tariffs by the delivery type and the city id
+# (None for the tariff of the other cities)
+_tariffs = {'version': None, 'tariffs': {}}
+
+
+def invalidate_delivery_tariffs():
+    """
+    Makes every process sharing the cache compile the tariffs again (see `MEMCACHED_LOCATION`),
+    called after the commit so they are not compiled again from the old data.
+    """
+    try:
+        cache.incr(TARIFFS_VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(TARIFFS_VERSION_CACHE_KEY, 1, None)
+
+
+def compile_delivery_tariffs():
+    """
+    Returns active tariffs by the delivery type and the city id, tariffs of the regions are given to all their cities.
+    """
+    tariffs = {}
+    region_tariffs = {}
+    for tariff in DeliveryTariff.objects.filter(activity=True).order_by('id'):
+        if tariff.region_id and not tariff.city_id:
+            region_tariffs.setdefault(tariff.region_id, []).append(tariff)
+        else:
+            tariffs[(tariff.delivery_type, tariff.city_id)] = tariff
+
+    if region_tariffs:
+        for city_id, region_id in City.objects.filter(region_id__in=list(region_tariffs)).values_list('id', 'region_id'):
+            for tariff in region_tariffs[region_id]:
+                tariffs.setdefault((tariff.delivery_type, city_id), tariff)
+    return tariffs
+
+
+def get_delivery_tariffs():
+    version = cache.get(TARIFFS_VERSION_CACHE_KEY, 0)
+    if _tariffs['version'] != version:
+        _tariffs['tariffs'] = compile_delivery_tariffs()
+        _tariffs['version'] = version
+    return _tariffs['tariffs']
+
+
+def get_delivery_price(delivery_type, city_id, order_price):
+    """
+    Returns the price of the delivery of the order, 0 if there is no tariff.
+    """
+    tariffs = get_delivery_tariffs()
+    tariff = tariffs.get((delivery_type, city_id)) or tariffs.get((delivery_type, None))
+    return tariff.get_price(order_price) if tariff else 0
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from config.b2p_stub import B2PStubServer
+
+
+class Command(BaseCommand):
+    help = 'Runs a local Best 2 Pay API stub, set B2P_BASE_URL to the printed address to use it.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Host to listen on.')
+        parser.add_argument('--port', type=int, default=8001, help='Port to listen on.')
+        parser.add_argument('--delay', type=float, default=0, help='Seconds every response is delayed.')
+        parser.add_argument('--fail', type=int, default=0, help='Number of the first requests answered with 503.')
+
+    def handle(self, *args, **options):
+        server = B2PStubServer(host=options['host'], port=options['port'], statuses=[503] * options['fail'],
+                               delay=options['delay'], verbose=True)
+        self.stdout.write('Best 2 Pay stub is running at {0}'.format(server.base_url))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from basket.cleanup import CHUNK_SIZE, clear_abandoned_baskets, clear_expired_sessions
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired sessions and abandoned baskets of anonymous visitors.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Number of rows per transaction.')
+
+    def handle(self, *args, **options):
+        sessions_count = clear_expired_sessions(chunk_size=options['chunk_size'])
+        baskets_count = clear_abandoned_baskets(chunk_size=options['chunk_size'])
+        self.stdout.write('Deleted {0} sessions and {1} baskets.'.format(sessions_count, baskets_count))
@@ -0,0 +1,19 @@
+from django.utils.functional import SimpleLazyObject
+
+from .current import get_active_order, get_current_basket
+
+
+class CurrentBasketMiddleware(object):
+    """
+    Sets `request.basket` and `request.active_order`, both are resolved lazily at most once per request
+    (see `current.get_current_basket` and `current.get_active_order`). Should be placed after
+    the session and the authentication middlewares.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.basket = SimpleLazyObject(lambda: get_current_basket(request))
+        request.active_order = SimpleLazyObject(lambda: get_active_order(request))
+        return self.get_response(request)
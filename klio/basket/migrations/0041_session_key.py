@@ -0,0 +1,39 @@
+# Generated by Django 2.2.7 on 2026-10-18 12:46
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_session_keys(apps, schema_editor):
+    for model_name in ('Basket', 'Order'):
+        model = apps.get_model('basket', model_name)
+        model.objects.filter(session__isnull=False).update(session_key=F('session_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basket', '0040_auto_20200925_0214'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basket',
+            name='session_key',
+            field=models.CharField(blank=True, db_index=True, max_length=40, verbose_name='session key'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='session_key',
+            field=models.CharField(blank=True, db_index=True, max_length=40, verbose_name='session key'),
+        ),
+        migrations.RunPython(copy_session_keys, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='basket',
+            name='session',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='session',
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 2.2.7 on 2026-10-18 09:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_order_items(apps, schema_editor):
+    Order = apps.get_model('basket', 'Order')
+    BasketProduct = apps.get_model('basket', 'BasketProduct')
+    OrderItem = apps.get_model('basket', 'OrderItem')
+
+    orders = dict(Order.objects.exclude(status='active').values_list('basket_id', 'id'))
+    items = []
+    basket_products = BasketProduct.objects.filter(basket_id__in=list(orders)).select_related('product__parent')
+    for basket_product in basket_products.order_by('id').iterator():
+        product = basket_product.product
+        name = '{0}:{1}'.format(product.parent.name, product.name) if product.parent else product.name
+        unit_price = basket_product.promo_price or basket_product.price or 0
+        items.append(OrderItem(order_id=orders[basket_product.basket_id], product=product, art=product.art, name=name,
+                               price=basket_product.price, promo_price=basket_product.promo_price,
+                               quantity=basket_product.quantity, total=unit_price * basket_product.quantity))
+    OrderItem.objects.bulk_create(items, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0057_productchange'),
+        ('basket', '0041_session_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('art', models.IntegerField(blank=True, null=True, verbose_name='vendor code')),
+                ('name', models.CharField(max_length=257, verbose_name='name')),
+                ('price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='price')),
+                ('promo_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='promo_price')),
+                ('quantity', models.PositiveIntegerField(default=1, verbose_name='quantity')),
+                ('total', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='total')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='basket.Order', verbose_name='order')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.Product', verbose_name='product')),
+            ],
+            options={
+                'verbose_name': 'Order item',
+                'verbose_name_plural': 'Order items',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.RunPython(fill_order_items, migrations.RunPython.noop),
+    ]
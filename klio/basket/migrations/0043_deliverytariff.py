@@ -0,0 +1,47 @@
+# Generated by Django 2.2.7 on 2026-10-18 09:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Tariffs of the courier delivery which were hard coded before: city name, price, free threshold
+COURIER_TARIFFS = [
+    ('Moscow', 650, 3000),
+    ('Saint Petersburg', 650, 5000),
+]
+
+
+def create_courier_tariffs(apps, schema_editor):
+    City = apps.get_model('cities_light', 'City')
+    DeliveryTariff = apps.get_model('basket', 'DeliveryTariff')
+
+    for name, price, free_threshold in COURIER_TARIFFS:
+        for city in City.objects.filter(name=name):
+            DeliveryTariff.objects.create(delivery_type='courier', city=city, price=price, free_threshold=free_threshold)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cities_light', '0008_city_timezone'),
+        ('basket', '0042_orderitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryTariff',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delivery_type', models.CharField(choices=[('pickup', 'Pickup'), ('courier', 'Courier'), ('company', 'Transport company')], default='courier', max_length=20, verbose_name='delivery type')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='price')),
+                ('free_threshold', models.DecimalField(blank=True, decimal_places=2, help_text='Orders starting from this price are delivered for free.', max_digits=10, null=True, verbose_name='free threshold')),
+                ('activity', models.BooleanField(default=True, verbose_name='activity')),
+                ('city', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cities_light.City', verbose_name='city')),
+                ('region', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cities_light.Region', verbose_name='region')),
+            ],
+            options={
+                'verbose_name': 'Delivery tariff',
+                'verbose_name_plural': 'Delivery tariffs',
+            },
+        ),
+        migrations.RunPython(create_courier_tariffs, migrations.RunPython.noop),
+    ]
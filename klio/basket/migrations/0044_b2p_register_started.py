@@ -0,0 +1,18 @@
+# Generated by Django 2.2.7 on 2026-10-18 11:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('basket', '0043_deliverytariff'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderpaymentb2pinfo',
+            name='b2p_register_started',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='best2pay registration started'),
+        ),
+    ]
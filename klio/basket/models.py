@@ -1,23 +1,25 @@
-import requests
+import logging
 from num2words import num2words
-from xml.etree import ElementTree
 from django.contrib.auth import get_user_model
-from django.contrib.sessions.models import Session
 from django.core.exceptions import ValidationError
-from django.core.mail import EmailMessage
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.translation import gettext, gettext_lazy as _
-from django.template.loader import render_to_string
-from cities_light.models import City, Country
+from cities_light.models import City, Country, Region
 from django.conf import settings
 
+from config import b2p_client
 from config.b2p_utils import get_sector, generate_signature, get_authorize_url, get_register_url, get_fail_url, get_success_url
 from contacts.models import Contact
+from general.outbox import queue_email
 from products.models import Category, Product
 from tags.models import Tag
 
 User = get_user_model()
 
+logger = logging.getLogger(__name__)
+
 
 class Basket(models.Model):
     created = models.DateTimeField(auto_now_add=True, verbose_name=_('created'))
@@ -25,7 +27,7 @@ class Basket(models.Model):
     products = models.ManyToManyField(Product, through='BasketProduct', verbose_name=_('products'),
                                       related_name='baskets')
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, verbose_name=_('user'))
-    session = models.ForeignKey(Session, on_delete=models.CASCADE, null=True, blank=True, verbose_name=_('session'))
+    session_key = models.CharField(max_length=40, blank=True, db_index=True, verbose_name=_('session key'))
     is_active = models.BooleanField(default=True, verbose_name=_('active'))
 
     class Meta:
@@ -35,19 +37,30 @@ class Basket(models.Model):
     def __str__(self):
         if self.user:
             return gettext('Basket') + ' #{0} ({1})'.format(self.id, self.user)
-        if self.session:
+        if self.session_key:
             return gettext('Basket') + ' #{0} ('.format(self.id) + \
-                gettext('Anonymous') + ' {0})'.format(self.session.session_key)
+                gettext('Anonymous') + ' {0})'.format(self.session_key)
         else:
             return gettext('Basket') + ' #{0}'.format(self.id)
 
+    def get_totals(self):
+        """
+        Returns the total price of the basket products with promo prices (`price`)
+        and without them (`full_price`), both calculated by a single aggregate query.
+        """
+        line_price = models.ExpressionWrapper(models.F('quantity') * Coalesce('promo_price', 'price'),
+                                              output_field=models.DecimalField())
+        line_full_price = models.ExpressionWrapper(models.F('quantity') * models.F('price'),
+                                                   output_field=models.DecimalField())
+        totals = self.inside.aggregate(price=models.Sum(line_price), full_price=models.Sum(line_full_price))
+        return {key: value or 0 for key, value in totals.items()}
+
     def clean(self):
         if self.user:
             if Basket.objects.filter(user=self.user, user__isnull=False, is_active=True).exclude(pk=self.pk).exists():
                 raise ValidationError(_('Active basket for current user already exists.'))
-        if self.session:
-            if Basket.objects.filter(session=self.session, session__isnull=False,
-                                     is_active=True).exclude(pk=self.pk).exists():
+        if self.session_key:
+            if Basket.objects.filter(session_key=self.session_key, is_active=True).exclude(pk=self.pk).exists():
                 raise ValidationError(_('Active basket already exists.'))
 
 
@@ -88,7 +101,7 @@ class Order(models.Model):
     modified = models.DateTimeField(auto_now=True, verbose_name=_('modified'))
     received = models.DateTimeField(blank=True, null=True, verbose_name=_('received'))
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, verbose_name=_('user'))
-    session = models.ForeignKey(Session, on_delete=models.CASCADE, null=True, blank=True, verbose_name=_('session'))
+    session_key = models.CharField(max_length=40, blank=True, db_index=True, verbose_name=_('session key'))
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=ACTIVE, verbose_name=_('status'))
     is_paid = models.BooleanField(default=False, verbose_name=_('is paid'))
     step = models.PositiveSmallIntegerField(default=1, verbose_name=_('step'))
@@ -115,29 +128,69 @@ class Order(models.Model):
     def price_2_words(self):
         return f"{num2words(int(self.price), lang='ru')} руб. {int((self.price - int(self.price)) * 100)} коп."
 
+    def get_notification_subject(self):
+        return f'Заказ {self.id} от {self.created.strftime("%d.%m.%Y")} на сайте kliogem.ru'
+
     def send_notification_to_customer(self):
-        html_content = render_to_string('messages/user_order_notif.html', {'order': self})
-        from_email, to = settings.DEFAULT_FROM_EMAIL, [self.private_info.email]
-        msg = EmailMessage(
-            f'Заказ {self.id} от {self.created.strftime("%d.%m.%Y")} на сайте kliogem.ru',
-            html_content,
-            from_email,
-            to
-        )
-        msg.content_subtype = "html"
-        msg.send()
+        queue_email([self.private_info.email], self.get_notification_subject(), 'messages/user_order_notif.html',
+                    {'order': self}, html=True)
 
     def send_notification_to_admins(self):
-        html_content = render_to_string('admin/basket/print_form.html', {'order': self})
-        from_email, to = settings.DEFAULT_FROM_EMAIL, settings.NOTIFIABLE_ADMIN_EMAIL_WHEN_ORDER_CREATED
-        msg = EmailMessage(
-            f'Заказ {self.id} от {self.created.strftime("%d.%m.%Y")} на сайте kliogem.ru',
-            html_content,
-            from_email,
-            to
-        )
-        msg.content_subtype = "html"
-        msg.send()
+        queue_email(settings.NOTIFIABLE_ADMIN_EMAIL_WHEN_ORDER_CREATED, self.get_notification_subject(),
+                    'admin/basket/print_form.html', {'order': self}, html=True)
+
+    def get_items(self):
+        """
+        Returns the saved items of the order, or the items of the basket products if the order is not placed yet.
+        """
+        items = list(self.items.all())
+        return items if items else self.build_items()
+
+    def build_items(self):
+        """
+        Returns the unsaved items of the current basket products.
+        """
+        items = []
+        for basket_product in self.basket.inside.select_related('product__parent'):
+            product = basket_product.product
+            name = '{0}:{1}'.format(product.parent.name, product.name) if product.parent else product.name
+            unit_price = basket_product.promo_price or basket_product.price or 0
+            items.append(OrderItem(order=self, product=product, art=product.art, name=name,
+                                   price=basket_product.price, promo_price=basket_product.promo_price,
+                                   quantity=basket_product.quantity, total=unit_price * basket_product.quantity))
+        return items
+
+    def save_items(self):
+        """
+        Saves the snapshot of the basket products, the order is shown and exported from it since then.
+        """
+        self.items.all().delete()
+        OrderItem.objects.bulk_create(self.build_items())
+
+
+class OrderItem(models.Model):
+    """
+    Product of the order as it was when the order was placed.
+    """
+    order = models.ForeignKey('Order', on_delete=models.CASCADE, related_name='items', verbose_name=_('order'))
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+                                verbose_name=_('product'))
+    art = models.IntegerField(blank=True, null=True, verbose_name=_('vendor code'))
+    name = models.CharField(max_length=257, verbose_name=_('name'))
+    price = models.DecimalField(blank=True, null=True, max_digits=10, decimal_places=2, verbose_name=_('price'))
+    promo_price = models.DecimalField(blank=True, null=True, max_digits=10, decimal_places=2,
+                                      verbose_name=_('promo_price'))
+    quantity = models.PositiveIntegerField(default=1, verbose_name=_('quantity'))
+    total = models.DecimalField(max_digits=12, decimal_places=2, verbose_name=_('total'))
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = _('Order item')
+        verbose_name_plural = _('Order items')
+
+    def __str__(self):
+        return self.name
+
 
 class OrderDeliveryInfo(models.Model):
     PICKUP, COURIER, COMPANY = 'pickup', 'courier', 'company'
@@ -175,6 +228,41 @@ class OrderDeliveryInfo(models.Model):
             raise ValidationError(_('There is a delivery info for this order already.'))
 
 
+class DeliveryTariff(models.Model):
+    """
+    Price of the delivery of the type to the city or to any city of the region, the delivery is free
+    for orders starting from the threshold. The tariff without city and region is used for the other cities.
+    The tariff of the city goes before the tariff of its region.
+    """
+    delivery_type = models.CharField(max_length=20, choices=OrderDeliveryInfo.DELIVERY_TYPES,
+                                     default=OrderDeliveryInfo.COURIER, verbose_name=_('delivery type'))
+    city = models.ForeignKey(City, on_delete=models.CASCADE, null=True, blank=True, related_name='+',
+                             verbose_name=_('city'))
+    region = models.ForeignKey(Region, on_delete=models.CASCADE, null=True, blank=True, related_name='+',
+                               verbose_name=_('region'))
+    price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name=_('price'))
+    free_threshold = models.DecimalField(blank=True, null=True, max_digits=10, decimal_places=2,
+                                         verbose_name=_('free threshold'),
+                                         help_text=_('Orders starting from this price are delivered for free.'))
+    activity = models.BooleanField(default=True, verbose_name=_('activity'))
+
+    class Meta:
+        verbose_name = _('Delivery tariff')
+        verbose_name_plural = _('Delivery tariffs')
+
+    def __str__(self):
+        return '{0} - {1}'.format(self.get_delivery_type_display(), self.city or self.region or gettext('Other cities'))
+
+    def clean(self):
+        if self.city and self.region:
+            raise ValidationError(_('Choose either a city or a region.'))
+
+    def get_price(self, order_price):
+        if self.free_threshold is not None and order_price >= self.free_threshold:
+            return 0
+        return self.price
+
+
 class OrderPaymentInfo(models.Model):
     CASH, CARD, TRANSFER = 'cash', 'card', 'transfer'
     PAYMENT_CHOICES = [
@@ -217,6 +305,8 @@ class OrderPaymentB2PInfo(models.Model):
                                         verbose_name=_('best2pay order status'))
     b2p_last_operation_number = models.IntegerField(verbose_name=_('best2pay last ended operation number'), default=-1)
     b2p_last_operation_code = models.IntegerField(verbose_name=_('best2pay last ended operation result code'), default=-1)
+    b2p_register_started = models.DateTimeField(blank=True, null=True,
+                                                verbose_name=_('best2pay registration started'))
 
     class Meta:
         verbose_name = _('Order B2P Registered Payment Info')
@@ -257,42 +347,71 @@ class OrderPaymentB2PInfo(models.Model):
 
     @classmethod
     def make_register_request(cls, payment_info: OrderPaymentInfo):
-        # if created.type == OrderPaymentInfo.CARD:
+        """
+        Registers the order in Best 2 Pay. The registration fails if Best 2 Pay doesn't respond in time
+        or is unavailable (see `config.b2p_client`).
+        """
         if not hasattr(payment_info, 'order'):
             raise AttributeError('Can make processing registration request to non ordered payment info')
-        resp = requests.post(
-            url=cls.get_order_b2p_register_url(),
-            data=cls.get_order_b2p_register_data(payment_info)
-        )
-        if hasattr(payment_info, 'b2p'):
-            self = payment_info.b2p
-        else:
-            self = None
-        if resp.status_code == 200:
-            data = ElementTree.fromstring(resp.content)
-            if self is None:
-                self = cls.objects.create(
-                    payment_info=payment_info,
-                    b2p_order_register_status=cls.B2P_SUCCESS,
-                    b2p_order_number=data.findall('id')[0].text
-                )
-            else:
-                self.b2p_order_register_status = cls.B2P_SUCCESS
-                self.b2p_order_number = data.findall('id')[0].text
-                self.save()
+        try:
+            number = b2p_client.get_client().register_order(cls.get_order_b2p_register_data(payment_info))
+        except b2p_client.B2PError:
+            logger.warning('Best 2 Pay registration of order #%s failed', payment_info.order.id, exc_info=True)
+            status, number = cls.B2P_FAIL, 'None'
         else:
-            if self is None:
-                self = cls.objects.create(
-                    payment_info=payment_info,
-                    b2p_order_register_status=cls.B2P_FAIL,
-                    b2p_order_number='None'
-                )
-            else:
-                self.b2p_order_register_status = cls.B2P_FAIL
-                self.b2p_order_number = 'None'
-                self.save()
+            status = cls.B2P_SUCCESS
+        self, created = cls.objects.update_or_create(
+            payment_info=payment_info,
+            defaults={'b2p_order_register_status': status, 'b2p_order_number': number}
+        )
         return self
 
+    @classmethod
+    def register_in_background(cls, payment_info: OrderPaymentInfo):
+        """
+        Marks the registration in progress and registers the order in a background thread once the current
+        transaction is committed. The frontend polls the redirect endpoint until the registration is finished.
+        """
+        cls.objects.update_or_create(
+            payment_info=payment_info,
+            defaults={'b2p_order_register_status': cls.B2P_PROGRESS, 'b2p_order_number': '',
+                      'b2p_register_started': timezone.now()}
+        )
+        transaction.on_commit(lambda: b2p_client.get_executor().submit(cls._register, payment_info.pk))
+
+    @classmethod
+    def _register(cls, payment_info_id):
+        try:
+            # The registration is started again, unless it was failed as abandoned while queued
+            if not cls.objects.filter(
+                    payment_info_id=payment_info_id, b2p_order_register_status=cls.B2P_PROGRESS
+            ).update(b2p_register_started=timezone.now()):
+                return
+            cls.make_register_request(OrderPaymentInfo.objects.select_related(
+                'order__private_info'
+            ).get(pk=payment_info_id))
+        except Exception:
+            logger.exception('Best 2 Pay registration of payment info #%s failed', payment_info_id)
+            cls.objects.filter(payment_info_id=payment_info_id).update(
+                b2p_order_register_status=cls.B2P_FAIL, b2p_order_number='None'
+            )
+        finally:
+            connection.close()
+
+    def fail_abandoned_registration(self):
+        """
+        Fails the registration in progress for longer than a registration may take, as its worker
+        was stopped (restarted or killed) before the registration was finished.
+        """
+        if self.b2p_order_register_status != self.B2P_PROGRESS or self.b2p_register_started is None:
+            return
+        deadline = timezone.now() - timezone.timedelta(seconds=b2p_client.REGISTRATION_TIMEOUT)
+        if OrderPaymentB2PInfo.objects.filter(
+                pk=self.pk, b2p_order_register_status=self.B2P_PROGRESS, b2p_register_started__lt=deadline
+        ).update(b2p_order_register_status=self.B2P_FAIL, b2p_order_number='None'):
+            logger.warning('Best 2 Pay registration of payment info #%s was abandoned', self.payment_info_id)
+            self.refresh_from_db()
+
 
 class OrderPrivateInfo(models.Model):
     INDIVIDUAL, COMPANY = 'individual', 'company'
@@ -0,0 +1,121 @@
+import hashlib
+from decimal import Decimal
+
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from products.models import CategoryClosure, Product
+from .models import BasketProduct, PromoCode
+
+# Compiled promo codes are cached for this number of seconds, any committed change of the promo codes
+# or the categories drops them for all the workers sharing the cache (see `signals` and `MEMCACHED_LOCATION`)
+PROMO_CACHE_TIMEOUT = 60 * 60
+
+PROMO_VERSION_CACHE_KEY = 'promo_rules_version'
+
+# Cached when there is no active promo code
+MISSING = 'missing'
+
+
+class PromoRule(object):
+    """
+    Active promo code compiled to the sets of the products, categories (with all their subcategories)
+    and tags it is given for, so a basket line is matched without queries.
+    """
+
+    def __init__(self, promo):
+        self.code = promo.code
+        self.start_date = promo.start_date
+        self.deadline = promo.deadline
+        self.for_all_products = promo.for_all_products
+        self.discount_type = promo.discount_type
+        self.discount_amount = promo.discount_amount or Decimal(0)
+        self.products_ids = set(promo.products.values_list('id', flat=True))
+        self.categories_ids = set(CategoryClosure.objects.filter(
+            ancestor__in=promo.categories.all()
+        ).values_list('descendant_id', flat=True))
+        self.tags_ids = set(promo.tags.values_list('id', flat=True))
+
+    def is_valid(self, date=None):
+        date = date or timezone.localdate()
+        return (self.start_date is None or self.start_date <= date) and (self.deadline is None or date <= self.deadline)
+
+    def matches(self, product_id, categories_ids, tags_ids):
+        return (product_id in self.products_ids or not self.categories_ids.isdisjoint(categories_ids) or
+                not self.tags_ids.isdisjoint(tags_ids))
+
+    def get_promo_price(self, price):
+        if self.discount_type == PromoCode.PERCENT:
+            return round(price * (1 - self.discount_amount / 100), 2)
+        return round(price - self.discount_amount, 2)
+
+
+def get_promo_cache_key(code):
+    # Codes are typed by the users, memcached keys can't have spaces
+    digest = hashlib.md5(code.encode('utf-8')).hexdigest()
+    return 'promo_rule_%s_%s' % (cache.get(PROMO_VERSION_CACHE_KEY, 0), digest)
+
+
+def invalidate_promo_rules():
+    """
+    Drops the compiled promo codes, called after the commit so they are not compiled again from the old data.
+    """
+    try:
+        cache.incr(PROMO_VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(PROMO_VERSION_CACHE_KEY, 1, None)
+
+
+def get_promo_rule(code):
+    """
+    Returns the compiled promo code if it is active and valid today, None otherwise.
+    """
+    key = get_promo_cache_key(code)
+    rule = cache.get(key)
+    if rule is None:
+        promo = PromoCode.objects.filter(activity=True, code=code).first()
+        rule = PromoRule(promo) if promo else MISSING
+        cache.set(key, rule, PROMO_CACHE_TIMEOUT)
+    if rule == MISSING or not rule.is_valid():
+        return None
+    return rule
+
+
+def calculate_promo_prices(basket_id, rule=None):
+    """
+    Evaluates the promo code for every line of the basket in one query. Lines of the active unique
+    and child products matching the rule get the promo price, the other lines lose it (all the lines
+    lose it if there is no rule). Categories of the child products are their own and their parent's ones,
+    tags are inherited from the parent if the child product has none.
+    Returns the lines with the calculated `promo_price` and the list of the changed ones.
+    """
+    lines = list(BasketProduct.objects.filter(basket_id=basket_id).annotate(
+        product_activity=F('product__activity'),
+        product_kind=F('product__kind'),
+        categories_ids=ArrayAgg('product__categories', distinct=True),
+        parent_categories_ids=ArrayAgg('product__parent__categories', distinct=True),
+        tags_ids=ArrayAgg('product__tags', distinct=True),
+        parent_tags_ids=ArrayAgg('product__parent__tags', distinct=True),
+    ).only('id', 'product_id', 'price', 'promo_price'))
+
+    changed = []
+    for line in lines:
+        promo_price = None
+        if rule is not None and line.price is not None:
+            tags_ids = {tag_id for tag_id in line.tags_ids if tag_id} or set(line.parent_tags_ids)
+            matches = rule.for_all_products or (
+                line.product_activity and line.product_kind in (Product.UNIQUE, Product.CHILD) and
+                rule.matches(line.product_id, set(line.categories_ids + line.parent_categories_ids), tags_ids)
+            )
+            if matches:
+                promo_price = rule.get_promo_price(line.price)
+        if promo_price != line.promo_price:
+            line.promo_price = promo_price
+            changed.append(line)
+    return lines, changed
+
+
+def save_promo_prices(lines):
+    BasketProduct.objects.bulk_update(lines, ['promo_price'])
@@ -2,9 +2,30 @@ from django.utils.translation import gettext_lazy as _
 
 from rest_framework import serializers
 
+from products.listing import LISTING_RELATED
 from products.models import Product
 from products.serializers import BasketProductListSerializer
-from .models import Basket, Order, OrderDeliveryInfo, OrderPaymentInfo, OrderPrivateInfo, OrderPaymentB2PInfo
+from .models import (Basket, BasketProduct, Order, OrderDeliveryInfo, OrderItem, OrderPaymentInfo, OrderPrivateInfo,
+                     OrderPaymentB2PInfo)
+from .utils import ADD, REMOVE, SET
+
+
+def get_basket_products(basket):
+    """
+    Returns active products of the basket in one query over the basket lines,
+    each product is given its line as `basket_product` (see `BasketProductListSerializer`).
+    """
+    basket_products = BasketProduct.objects.filter(
+        basket=basket, product__activity=True, product__kind__in=[Product.UNIQUE, Product.CHILD]
+    ).select_related(
+        'product', *('product__' + field for field in LISTING_RELATED)
+    ).order_by('product__product_type', 'product__order', 'product_id')
+
+    products = []
+    for basket_product in basket_products:
+        basket_product.product.basket_product = basket_product
+        products.append(basket_product.product)
+    return products
 
 
 class BasketDetailSerializer(serializers.ModelSerializer):
@@ -17,11 +38,31 @@ class BasketDetailSerializer(serializers.ModelSerializer):
         fields = ('id', 'created', 'modified', 'products')
 
     def get_products(self, obj):
-        self.context['basket_id'] = obj.id
-        return BasketProductListSerializer(
-            obj.products.filter(activity=True, kind__in=[Product.UNIQUE, Product.CHILD]),
-            many=True, read_only=True, context=self.context
-        ).data
+        return BasketProductListSerializer(get_basket_products(obj), many=True, read_only=True,
+                                           context=self.context).data
+
+
+class BasketProductChangeSerializer(serializers.Serializer):
+    amount = serializers.IntegerField(min_value=0)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, allow_null=True, required=False, default=None)
+
+
+class BasketOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=(ADD, SET, REMOVE))
+    id = serializers.IntegerField()
+    amount = serializers.IntegerField(min_value=0, required=False)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, allow_null=True, required=False)
+
+    def validate(self, attrs):
+        if attrs['op'] == ADD:
+            attrs.setdefault('amount', 1)
+        elif attrs['op'] == SET and 'amount' not in attrs:
+            raise serializers.ValidationError({'amount': _('This field is required.')})
+        return attrs
+
+
+class BasketBatchSerializer(serializers.Serializer):
+    operations = BasketOperationSerializer(many=True, allow_empty=False)
 
 
 class OrderDeliveryInfoSerializer(serializers.ModelSerializer):
@@ -56,10 +97,11 @@ class OrderPaymentInfoB2PSerializer(serializers.ModelSerializer):
     status = serializers.ChoiceField(choices=OrderPaymentB2PInfo.B2P_ORDER_STATUS_CHOICES, source='b2p_order_status')
     operation = serializers.IntegerField(source='b2p_last_operation_number')
     result_code = serializers.IntegerField(source='b2p_last_operation_code')
+    register_status = serializers.CharField(source='b2p_order_register_status', read_only=True)
 
     class Meta:
         model = OrderPaymentB2PInfo
-        fields = ('order', 'status', 'operation', 'result_code')
+        fields = ('order', 'status', 'operation', 'result_code', 'register_status')
         read_only_fields = ('order',)
 
     def validate_status(self, value):
@@ -110,10 +152,17 @@ class OrderDetailShortSerializer(serializers.ModelSerializer):
         fields = ('id', 'created', 'modified', 'status')
 
 
+class OrderItemSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = OrderItem
+        fields = ('product', 'art', 'name', 'price', 'promo_price', 'quantity', 'total')
+
+
 class OrderListSerializer(serializers.ModelSerializer):
-    basket = BasketDetailSerializer()
     created = serializers.DateTimeField(format="%Y-%m-%d")
+    items = OrderItemSerializer(many=True, read_only=True)
 
     class Meta:
         model = Order
-        fields = ('id', 'created', 'status', 'promo', 'price', 'basket')
+        fields = ('id', 'created', 'status', 'promo', 'price', 'items')
@@ -0,0 +1,25 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from products.models import Category
+from products.utils import schedule_update
+from .delivery import invalidate_delivery_tariffs
+from .models import DeliveryTariff, PromoCode
+from .promo import invalidate_promo_rules
+
+
+@receiver(post_save, sender=PromoCode)
+@receiver(post_delete, sender=PromoCode)
+@receiver(m2m_changed, sender=PromoCode.categories.through)
+@receiver(m2m_changed, sender=PromoCode.products.through)
+@receiver(m2m_changed, sender=PromoCode.tags.through)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_promo(sender, **kwargs):
+    schedule_update(invalidate_promo_rules)
+
+
+@receiver(post_save, sender=DeliveryTariff)
+@receiver(post_delete, sender=DeliveryTariff)
+def invalidate_tariffs(sender, **kwargs):
+    schedule_update(invalidate_delivery_tariffs)
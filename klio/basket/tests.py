@@ -0,0 +1,391 @@
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from cities_light.models import City, Country, Region
+from rest_framework.test import APITestCase
+
+from config.b2p_client import REGISTRATION_TIMEOUT, B2PClient, B2PError, CircuitBreaker, CircuitOpenError
+from config.b2p_stub import B2PStubServer
+from products.listing import rebuild_products_listings
+from products.models import Category, Product, ProductImage, Unit
+from tags.models import Tag
+from .cleanup import clear_abandoned_baskets, clear_expired_sessions
+from .delivery import get_delivery_price
+from .models import (Basket, BasketProduct, DeliveryTariff, Order, OrderDeliveryInfo, OrderPaymentB2PInfo, OrderPaymentInfo,
+                     OrderPrivateInfo, PromoCode)
+from .promo import calculate_promo_prices, get_promo_rule
+
+
+# Sessions are cached when the workers share the cache (see `MEMCACHED_LOCATION`)
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+class BasketQueriesTestCase(APITestCase):
+    url = '/api/v1/basket/'
+
+    # Queries of the write endpoints, whatever the number of products in the basket
+    budget = {'add': 4, 'update': 4, 'delete': 4}
+
+    @classmethod
+    def setUpTestData(cls):
+        units = Unit.objects.create(name='pcs')
+        cls.products = []
+        for i in range(6):
+            product = Product.objects.create(name='Product %s' % i, slug='product-%s' % i, art=i, price=100,
+                                             units=units)
+            ProductImage.objects.create(product=product, img='products/product-%s.jpg' % i)
+            cls.products.append(product)
+        rebuild_products_listings()
+
+    def setUp(self):
+        cache.clear()
+
+    def count_queries(self, method, url, data):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(self.url + url, data, format='json')
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), len(response.data['products'])
+
+    def test_budget(self):
+        for product in self.products[:-1]:
+            self.client.post(self.url + 'products/%s/add' % product.id, {'amount': 2, 'price': 100}, format='json')
+        self.client.get(self.url + 'current')
+
+        product_id = self.products[-1].id
+        self.assertEqual(self.count_queries('post', 'products/%s/add' % product_id, {'amount': 1, 'price': 100}),
+                         (self.budget['add'], 6))
+        self.assertEqual(self.count_queries('put', 'products/%s/update' % product_id, {'amount': 3, 'price': 90}),
+                         (self.budget['update'], 6))
+        self.assertEqual(self.count_queries('delete', 'products/%s/delete' % product_id, None),
+                         (self.budget['delete'], 5))
+
+    def test_batch(self):
+        ids = [product.id for product in self.products]
+        self.client.post(self.url + 'products/%s/add' % ids[0], {'amount': 2, 'price': 100}, format='json')
+        self.client.post(self.url + 'products/%s/add' % ids[1], {'amount': 2, 'price': 100}, format='json')
+
+        operations = [
+            {'op': 'add', 'id': ids[0], 'price': 90},
+            {'op': 'remove', 'id': ids[1]},
+            {'op': 'add', 'id': ids[2], 'amount': 2, 'price': 100},
+            {'op': 'add', 'id': ids[2]},
+            {'op': 'set', 'id': ids[3], 'amount': 4, 'price': 80},
+            {'op': 'add', 'id': ids[3], 'amount': 1},
+            {'op': 'add', 'id': 0},
+        ]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(self.url + 'products/batch', {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(product['id'], product['quantity']) for product in response.data['products']],
+                         [(ids[0], 3), (ids[2], 3), (ids[3], 5)])
+        self.assertEqual(len(context.captured_queries), 8)
+
+        response = self.client.post(self.url + 'products/batch', {'operations': [{'op': 'set', 'id': ids[0]}]},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class CurrentBasketTestCase(APITestCase):
+    url = '/api/v1/basket/'
+
+    @classmethod
+    def setUpTestData(cls):
+        units = Unit.objects.create(name='pcs')
+        cls.product = Product.objects.create(name='Product', slug='product', art=1, price=100, units=units)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_basket(self):
+        self.assertEqual(self.client.get(self.url + 'current').status_code, 404)
+
+        response = self.client.post(self.url + 'products/%s/add' % self.product.id, {'amount': 1, 'price': 100},
+                                    format='json')
+        self.assertEqual(response.status_code, 200)
+        basket = Basket.objects.get()
+        self.assertEqual(basket.session_key, self.client.session.session_key)
+
+        # The basket is found by one query of the owner per request
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(self.url + 'current').status_code, 200)
+        queries = [query['sql'] for query in context.captured_queries if 'FROM "basket_basket"' in query['sql']]
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"basket_basket"."session_key" = ', queries[0])
+
+        # Nothing is kept between the requests
+        Basket.objects.filter(id=basket.id).update(is_active=False)
+        self.assertEqual(self.client.get(self.url + 'current').status_code, 404)
+        Basket.objects.filter(id=basket.id).update(is_active=True)
+
+        response = self.client.post(self.url + 'order/create')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(self.url + 'order/active').data['id'], response.data['id'])
+
+        self.assertEqual(self.client.put(self.url + 'current/inactivate').status_code, 200)
+        self.assertEqual(self.client.get(self.url + 'current').status_code, 404)
+
+    def test_add_product(self):
+        url = self.url + 'products/%s/add' % self.product.id
+        self.client.post(url, {'amount': 1, 'price': 100}, format='json')
+        self.client.post(url, {'amount': 1, 'price': 90}, format='json')
+        self.assertEqual(BasketProduct.objects.values_list('quantity', 'price').get(), (2, 90))
+
+        self.client.post(url, {'amount': 5, 'price': 90}, format='json')
+        self.assertEqual(BasketProduct.objects.get().quantity, 5)
+
+        self.assertEqual(self.client.post(url, {'price': 90}, format='json').status_code, 400)
+        self.assertEqual(self.client.post(self.url + 'products/0/add', {'amount': 1}, format='json').status_code, 404)
+        self.assertEqual(self.client.put(self.url + 'products/0/update', {'amount': 1}, format='json').status_code,
+                         404)
+
+
+class ClearBasketsTestCase(TestCase):
+
+    def test_clear(self):
+        expired = timezone.now() - timezone.timedelta(days=30)
+        Session.objects.create(session_key='expired', session_data='', expire_date=expired)
+        Session.objects.create(session_key='live', session_data='', expire_date=timezone.now() + timezone.timedelta(1))
+        abandoned = Basket.objects.create(session_key='expired')
+        ordered = Basket.objects.create(session_key='expired', is_active=False)
+        Order.objects.create(session_key='expired', basket=ordered, status=Order.PENDING)
+        live = Basket.objects.create(session_key='live')
+        Basket.objects.update(created=expired)
+        recent = Basket.objects.create(session_key='recent')
+
+        self.assertEqual(clear_expired_sessions(chunk_size=1), 1)
+        self.assertEqual(clear_abandoned_baskets(chunk_size=1), 1)
+        self.assertFalse(Basket.objects.filter(id=abandoned.id).exists())
+        self.assertEqual(set(Basket.objects.values_list('id', flat=True)), {ordered.id, live.id, recent.id})
+
+
+class PromoRuleTestCase(TransactionTestCase):
+    """
+    Promo codes are dropped from the cache when the changes are committed.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_calculate_promo_prices(self):
+        root = Category.objects.create(name='Root', slug='root')
+        child = Category.objects.create(name='Child', slug='child', parent=root)
+        tag = Tag.objects.create(name='Tag')
+        in_category = Product.objects.create(name='In category', slug='in-category', art=1)
+        in_category.categories.add(child)
+        parent = Product.objects.create(name='Parent', slug='parent', kind=Product.PARENT)
+        parent.tags.add(tag)
+        tagged = Product.objects.create(name='Tagged', slug='tagged', art=2, kind=Product.CHILD, parent=parent)
+        other = Product.objects.create(name='Other', slug='other', art=3)
+
+        basket = Basket.objects.create(session_key='promo')
+        for product in (in_category, tagged, other):
+            BasketProduct.objects.create(basket=basket, product=product, price=200, promo_price=1)
+
+        today = timezone.localdate()
+        promo = PromoCode.objects.create(code='PROMO', start_date=today, deadline=today, activity=True,
+                                         discount_amount=10)
+        promo.categories.add(root)
+        promo.tags.add(tag)
+
+        rule = get_promo_rule('PROMO')
+        with self.assertNumQueries(1):
+            lines, changed = calculate_promo_prices(basket.id, rule)
+        self.assertEqual({line.product_id: line.promo_price for line in lines},
+                         {in_category.id: 180, tagged.id: 180, other.id: None})
+        self.assertEqual(len(changed), 3)
+
+        promo.deadline = today - timezone.timedelta(days=1)
+        promo.save()
+        self.assertIsNone(get_promo_rule('PROMO'))
+
+
+class OrderItemsTestCase(TestCase):
+
+    def test_totals_and_items(self):
+        parent = Product.objects.create(name='Ring', slug='ring', kind=Product.PARENT)
+        child = Product.objects.create(name='17', slug='ring-17', art=1, kind=Product.CHILD, parent=parent)
+        product = Product.objects.create(name='Brooch', slug='brooch', art=2)
+        basket = Basket.objects.create(session_key='items')
+        BasketProduct.objects.create(basket=basket, product=child, quantity=2, price=100, promo_price=90)
+        BasketProduct.objects.create(basket=basket, product=product, quantity=3, price=50)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(basket.get_totals(), {'price': 330, 'full_price': 350})
+
+        order = Order.objects.create(session_key='items', basket=basket, status=Order.PENDING, price=330)
+        # Orders not placed yet are shown from their baskets
+        self.assertEqual([(item.name, item.total) for item in order.get_items()], [('Ring:17', 180), ('Brooch', 150)])
+        self.assertFalse(order.items.exists())
+        order.save_items()
+        product.name = 'Renamed'
+        product.save()
+        self.assertEqual(list(order.items.values_list('art', 'name', 'price', 'promo_price', 'quantity', 'total')),
+                         [(1, 'Ring:17', 100, 90, 2, 180), (2, 'Brooch', 50, None, 3, 150)])
+
+
+class OrderListTestCase(APITestCase):
+    url = '/api/v1/basket/order/list'
+
+    def test_queries(self):
+        user = get_user_model().objects.create(email='user@example.com')
+        product = Product.objects.create(name='Brooch', slug='brooch', art=1, price=50)
+        self.client.force_authenticate(user)
+
+        queries = []
+        for i in range(2):
+            for j in range(2):
+                basket = Basket.objects.create(user=user, is_active=False)
+                BasketProduct.objects.create(basket=basket, product=product, quantity=2, price=50)
+                Order.objects.create(user=user, basket=basket, status=Order.PENDING, price=100).save_items()
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            queries.append(len(context.captured_queries))
+
+        orders = response.data
+        self.assertEqual(len(orders), 4)
+        self.assertNotIn('basket', orders[0])
+        self.assertEqual([(item['name'], item['quantity']) for item in orders[0]['items']], [('Brooch', 2)])
+        self.assertEqual(queries[0], queries[1])
+
+
+class DeliveryTariffTestCase(TransactionTestCase):
+    """
+    Tariffs are compiled again when the changes are committed.
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_get_delivery_price(self):
+        country = Country.objects.create(name='Russia', code2='RU')
+        region = Region.objects.create(name='Moscow Oblast', country=country)
+        moscow = City.objects.create(name='Moscow', country=country, region=region)
+        khimki = City.objects.create(name='Khimki', country=country, region=region)
+        kostroma = City.objects.create(name='Kostroma', country=country)
+
+        DeliveryTariff.objects.create(city=moscow, price=650, free_threshold=3000)
+        DeliveryTariff.objects.create(region=region, price=800)
+        DeliveryTariff.objects.create(price=1000, free_threshold=10000)
+
+        self.assertEqual(get_delivery_price(OrderDeliveryInfo.COURIER, moscow.id, 2000), 650)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_delivery_price(OrderDeliveryInfo.COURIER, moscow.id, 3000), 0)
+            self.assertEqual(get_delivery_price(OrderDeliveryInfo.COURIER, khimki.id, 3000), 800)
+            self.assertEqual(get_delivery_price(OrderDeliveryInfo.COURIER, kostroma.id, 3000), 1000)
+            self.assertEqual(get_delivery_price(OrderDeliveryInfo.PICKUP, moscow.id, 3000), 0)
+
+        DeliveryTariff.objects.create(city=kostroma, price=500)
+        self.assertEqual(get_delivery_price(OrderDeliveryInfo.COURIER, kostroma.id, 3000), 500)
+
+
+class B2PClientTestCase(APITestCase):
+
+    def setUp(self):
+        self.server = B2PStubServer()
+        self.server.start()
+        self.settings = override_settings(
+            B2P_BASE_URL=self.server.base_url, B2P_SECTOR='1', B2P_SECRET='secret',
+            B2P_SUCCESS_REDIRECT='http://testserver/success/{orderId}', B2P_FAIL_REDIRECT='http://testserver/fail/{orderId}'
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.server.stop()
+
+    def register(self, client):
+        return client.register_order({'amount': 100, 'currency': 643, 'reference': 1, 'signature': 'signature'})
+
+    def test_retries(self):
+        client = B2PClient(retry_delay=0)
+        self.server.statuses = [503, 502]
+        self.assertEqual(self.register(client), '1000')
+        self.assertEqual(len(self.server.requests), 3)
+
+        self.server.statuses = [503] * 3
+        with self.assertRaises(B2PError):
+            self.register(client)
+        self.assertEqual(len(self.server.requests), 6)
+
+        with self.assertRaisesRegex(B2PError, '109'):
+            client.register_order({'amount': 100})
+
+    def test_timeout_is_not_retried(self):
+        self.server.delay = 0.5
+        with self.assertRaises(B2PError):
+            self.register(B2PClient(read_timeout=0.1, retry_delay=0))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_circuit_breaker(self):
+        client = B2PClient(max_retries=0, breaker=CircuitBreaker(failure_threshold=2, recovery_timeout=60))
+        self.server.statuses = [503] * 2
+        for i in range(2):
+            with self.assertRaises(B2PError):
+                self.register(client)
+        with self.assertRaises(CircuitOpenError):
+            self.register(client)
+        self.assertEqual(len(self.server.requests), 2)
+
+        client.breaker.opened -= 60
+        self.assertEqual(self.register(client), '1000')
+        self.assertIsNone(client.breaker.opened)
+
+    def test_register_order(self):
+        private_info = OrderPrivateInfo.objects.create(client_type=OrderPrivateInfo.INDIVIDUAL, last_name='Ivanov',
+                                                       first_name='Ivan', phone='+7', email='ivan@example.com')
+        payment_info = OrderPaymentInfo.objects.create(type=OrderPaymentInfo.CARD)
+        order = Order.objects.create(basket=Basket.objects.create(session_key='b2p'), status=Order.PENDING,
+                                     price=100, private_info=private_info, payment_info=payment_info)
+        url = '/api/v1/basket/order/payment/%s/processing/redirect' % order.id
+
+        OrderPaymentB2PInfo.register_in_background(payment_info)
+        response = self.client.get(url)
+        self.assertEqual(response.data['register_status'], OrderPaymentB2PInfo.B2P_PROGRESS)
+        self.assertIsNone(response.data['redirect'])
+
+        b2p = OrderPaymentB2PInfo.make_register_request(payment_info)
+        self.assertEqual((b2p.b2p_order_register_status, b2p.b2p_order_number), (OrderPaymentB2PInfo.B2P_SUCCESS, '1000'))
+        self.assertEqual(self.server.requests[0][1]['reference'], str(order.id))
+        response = self.client.get(url)
+        self.assertTrue(response.data['redirect'].startswith(self.server.base_url + '/Authorize?sector=1&id=1000'))
+
+
+class B2PRegistrationTestCase(TransactionTestCase):
+    """
+    Registrations are run after the commit by the background workers, which close their connections.
+    """
+
+    def setUp(self):
+        self.server = B2PStubServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.settings = override_settings(B2P_BASE_URL=self.server.base_url, B2P_SECTOR='1', B2P_SECRET='secret')
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def test_abandoned_registration(self):
+        payment_info = OrderPaymentInfo.objects.create(type=OrderPaymentInfo.CARD)
+        order = Order.objects.create(basket=Basket.objects.create(session_key='b2p'), status=Order.PENDING,
+                                     price=100, payment_info=payment_info)
+        url = '/api/v1/basket/order/payment/%s/processing/redirect' % order.id
+
+        # Marked by `register_in_background`, the registration of the worker is still running
+        b2p = OrderPaymentB2PInfo.objects.create(payment_info=payment_info, b2p_order_number='',
+                                                 b2p_register_started=timezone.now())
+        self.assertEqual(self.client.get(url).data['register_status'], OrderPaymentB2PInfo.B2P_PROGRESS)
+
+        # The worker was stopped before the registration was finished
+        b2p.b2p_register_started -= timezone.timedelta(seconds=REGISTRATION_TIMEOUT + 1)
+        b2p.save()
+        response = self.client.get(url)
+        self.assertEqual(response.data['register_status'], OrderPaymentB2PInfo.B2P_FAIL)
+        self.assertIsNone(response.data['redirect'])
+
+        # The registration failed while queued is not started
+        OrderPaymentB2PInfo._register(payment_info.pk)
+        self.assertEqual(self.server.requests, [])
+        self.assertEqual(OrderPaymentB2PInfo.objects.get().b2p_order_register_status, OrderPaymentB2PInfo.B2P_FAIL)
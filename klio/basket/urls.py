@@ -1,10 +1,10 @@
 from django.urls import path
 
-from .views import (BasketAddProductView, BasketDeleteProductView, BasketUpdateProductView, CurrentBasketView,
-                    CurrentBasketInactivateView, OrderCreateView, OrderActiveRetrieveView, OrderActiveToPendingView,
-                    OrderActiveUpdateView, OrderDeliveryInfoCreateView, OrderDeliveryInfoUpdateView, OrderListView,
-                    OrderPaymentInfoCreateView, OrderPaymentInfoUpdateView, OrderPrivateInfoCreateView,
-                    OrderPrivateInfoUpdateView, OrderPaymentB2PInfoGetRedirectToPayView,
+from .views import (BasketAddProductView, BasketBatchView, BasketDeleteProductView, BasketUpdateProductView,
+                    CurrentBasketView, CurrentBasketInactivateView, OrderCreateView, OrderActiveRetrieveView,
+                    OrderActiveToPendingView, OrderActiveUpdateView, OrderDeliveryInfoCreateView,
+                    OrderDeliveryInfoUpdateView, OrderListView, OrderPaymentInfoCreateView, OrderPaymentInfoUpdateView,
+                    OrderPrivateInfoCreateView, OrderPrivateInfoUpdateView, OrderPaymentB2PInfoGetRedirectToPayView,
                     OrderPaymentB2PInfoChangeStatusUpdateView)
 
 
@@ -25,6 +25,7 @@ urlpatterns = [
     path('order/private/update', OrderPrivateInfoUpdateView.as_view(), name='order_private_update'),
     path('current', CurrentBasketView.as_view(), name='current_basket'),
     path('current/inactivate', CurrentBasketInactivateView.as_view(), name='current_basket_inactivate'),
+    path('products/batch', BasketBatchView.as_view(), name='basket_products_batch'),
     path('products/<int:id>/add', BasketAddProductView.as_view(), name='basket_product_add'),
     path('products/<int:id>/delete', BasketDeleteProductView.as_view(), name='basket_product_delete'),
     path('products/<int:id>/update', BasketUpdateProductView.as_view(), name='basket_product_update'),
@@ -1,6 +1,106 @@
+from django.db import connection, transaction
 from django.http import HttpResponse
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from products.models import Product
+from .models import BasketProduct
+
+# Inserts the lines of existing products or changes the lines of products already in the basket
+UPSERT_BASKET_PRODUCTS_SQL = """
+    INSERT INTO {table} (basket_id, product_id, quantity, price, added)
+    SELECT %s, product.id, line.quantity, line.price, %s
+    FROM (VALUES {values}) AS line (product_id, quantity, price)
+    JOIN {product_table} AS product ON product.id = line.product_id
+    ON CONFLICT (basket_id, product_id) DO UPDATE SET quantity = {quantity}, price = EXCLUDED.price
+    RETURNING product_id
+"""
+
+# Operations of `apply_basket_operations`
+(ADD, SET, REMOVE) = ('add', 'set', 'remove')
+
+
+def upsert_basket_products(basket_id, lines, increment=False):
+    """
+    Puts the products into the basket in one statement, safe for concurrent requests.
+    `lines` are tuples of the product id, the quantity and the price, each product is given once.
+    The quantity of the line already in the basket is increased by the quantity if `increment`, replaced otherwise.
+    Returns ids of the products put into the basket, unknown products are skipped.
+    """
+    if not lines:
+        return set()
+
+    table = BasketProduct._meta.db_table
+    sql = UPSERT_BASKET_PRODUCTS_SQL.format(
+        table=table,
+        product_table=Product._meta.db_table,
+        values=', '.join(['(%s::integer, %s::integer, %s::numeric)'] * len(lines)),
+        quantity='{0}.quantity + EXCLUDED.quantity'.format(table) if increment else 'EXCLUDED.quantity'
+    )
+    params = [basket_id, timezone.now()] + [value for line in lines for value in line]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return {row[0] for row in cursor.fetchall()}
+
+
+def add_basket_product(basket_id, product_id, quantity, price, increment=False):
+    """
+    Puts the product into the basket (see `upsert_basket_products`). Returns False if there is no such product.
+    """
+    return bool(upsert_basket_products(basket_id, [(product_id, quantity, price)], increment))
+
+
+def merge_basket_operations(operations):
+    """
+    Reduces the operations (dicts with `op`, `id`, `amount` and `price`) to one change per product:
+    `{product_id: (op, amount, price)}`, the amount of `add` is added to the current quantity.
+    """
+    changes = {}
+    for operation in operations:
+        product_id, op, amount = operation['id'], operation['op'], operation.get('amount')
+        previous_op, previous_amount, price = changes.get(product_id, (None, None, None))
+        if 'price' in operation:
+            price = operation['price']
+        if op == ADD and previous_op == ADD:
+            amount += previous_amount
+        elif op == ADD and previous_op == SET:
+            op, amount = SET, previous_amount + amount
+        elif op == ADD and previous_op == REMOVE:
+            op = SET
+        changes[product_id] = (op, amount, price)
+    return changes
+
+
+@transaction.atomic
+def apply_basket_operations(basket_id, operations):
+    """
+    Applies add, set and remove operations to the basket in one transaction:
+    one statement for the added products, one for the set ones and one for the removed ones.
+    """
+    changes = merge_basket_operations(operations)
+    removed = [product_id for product_id, change in changes.items() if change[0] == REMOVE]
+    if removed:
+        BasketProduct.objects.filter(basket_id=basket_id, product_id__in=removed).delete()
+    for op, increment in ((ADD, True), (SET, False)):
+        lines = [(product_id, amount, price) for product_id, (change, amount, price) in changes.items() if change == op]
+        upsert_basket_products(basket_id, lines, increment)
+
+
+def update_basket_product(basket_id, product_id, quantity, price):
+    """
+    Changes the line of the product in the basket in one statement. Returns False if the product is not in the basket.
+    """
+    return bool(BasketProduct.objects.filter(basket_id=basket_id, product_id=product_id).update(
+        quantity=quantity, price=price
+    ))
+
+
+def delete_basket_product(basket_id, product_id):
+    """
+    Removes the product from the basket in one statement. Returns False if the product is not in the basket.
+    """
+    return bool(BasketProduct.objects.filter(basket_id=basket_id, product_id=product_id).delete()[0])
+
 
 def export_orders_csv(modeladmin, request, queryset):
     import csv
@@ -24,14 +124,13 @@ def export_orders_csv(modeladmin, request, queryset):
         smart_str(u"Город"),
         smart_str(u"Товары"),
     ])
+    queryset = queryset.select_related('user', 'private_info', 'delivery_info__to_city').prefetch_related('items')
     for obj in queryset:
 
         result = ''
-        basket_products = obj.basket.inside.all()
-        for bp in basket_products:
-            price = bp.promo_price if bp.promo_price else bp.price if bp.price else 0
+        for item in obj.get_items():
             line = '{0} {1}, цена: {2}, кол-во: {3}, сумма: {4};'.format(
-                bp.product.art, bp.product.name, price, bp.quantity, price * bp.quantity
+                item.art, item.name, item.promo_price or item.price or 0, item.quantity, item.total
             )
             result += line
 
@@ -1,6 +1,7 @@
 import json
-from django.contrib.sessions.models import Session
-from django.db.models import Q
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -11,11 +12,22 @@ from rest_framework.response import Response
 from rest_framework.status import HTTP_200_OK, HTTP_400_BAD_REQUEST
 from rest_framework.exceptions import ValidationError
 
-from products.models import Product
-from .models import Basket, BasketProduct, Order, OrderDeliveryInfo, OrderPaymentInfo, OrderPaymentB2PInfo, OrderPrivateInfo, PromoCode
-from .serializers import (BasketDetailSerializer, OrderDeliveryInfoSerializer, OrderDetailSerializer,
-                          OrderDetailShortSerializer, OrderListSerializer, OrderPaymentInfoSerializer,
-                          OrderPrivateInfoSerializer, OrderPaymentInfoB2PSerializer)
+from .current import (get_active_order_or_404, get_current_basket_or_404, get_or_create_active_order,
+                      get_or_create_current_basket)
+from .delivery import get_delivery_price
+from .models import Order, OrderDeliveryInfo, OrderPaymentInfo, OrderPaymentB2PInfo, OrderPrivateInfo
+from .promo import calculate_promo_prices, get_promo_rule, save_promo_prices
+from .serializers import (BasketBatchSerializer, BasketDetailSerializer, BasketProductChangeSerializer,
+                          OrderDeliveryInfoSerializer, OrderDetailSerializer, OrderDetailShortSerializer,
+                          OrderListSerializer, OrderPaymentInfoSerializer, OrderPrivateInfoSerializer,
+                          OrderPaymentInfoB2PSerializer)
+from .utils import REMOVE, add_basket_product, apply_basket_operations, delete_basket_product, update_basket_product
+
+
+def get_basket_product_data(request):
+    serializer = BasketProductChangeSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data
 
 
 class BasketAddProductView(CreateAPIView):
@@ -24,26 +36,13 @@ class BasketAddProductView(CreateAPIView):
 
     def create(self, request, *args, **kwargs):
         product_id = kwargs.get('id')
-        amount = request.data.get('amount')
-        price = request.data.get('price')
-
-        if not self.request.user.is_anonymous:
-            basket, _ = Basket.objects.get_or_create(user=self.request.user, is_active=True)
-        else:
-            if not self.request.session.session_key:
-                self.request.session.create()
-            current_session = Session.objects.get(session_key=self.request.session.session_key)
-            basket, _ = Basket.objects.get_or_create(session=current_session, is_active=True)
+        data = get_basket_product_data(request)
 
-        product_in_basket, created = BasketProduct.objects.get_or_create(basket=basket, product_id=product_id)
+        basket = get_or_create_current_basket(self.request)
 
-        if amount == 1:
-            if not created:
-                product_in_basket.quantity += 1
-        else:
-            product_in_basket.quantity = amount
-        product_in_basket.price = price
-        product_in_basket.save()
+        # A single item is added to the quantity already in the basket, other amounts replace it
+        if not add_basket_product(basket.id, product_id, data['amount'], data['price'], increment=data['amount'] == 1):
+            raise Http404
         serializer = self.serializer_class(basket, context={'request': self.request})
         return Response(serializer.data)
 
@@ -55,14 +54,10 @@ class BasketDeleteProductView(DestroyAPIView):
     def destroy(self, request, *args, **kwargs):
         product_id = self.kwargs.get('id')
 
-        if not self.request.user.is_anonymous:
-            basket = get_object_or_404(Basket, user=self.request.user, is_active=True)
-        else:
-            current_session = Session.objects.get(session_key=self.request.session.session_key)
-            basket = get_object_or_404(Basket, session=current_session, is_active=True)
+        basket = get_current_basket_or_404(self.request)
 
-        instance = get_object_or_404(BasketProduct, basket=basket, product_id=product_id)
-        self.perform_destroy(instance)
+        if not delete_basket_product(basket.id, product_id):
+            raise Http404
         serializer = self.serializer_class(basket, context={'request': self.request})
         return Response(serializer.data)
 
@@ -73,19 +68,37 @@ class BasketUpdateProductView(UpdateAPIView):
 
     def update(self, request, *args, **kwargs):
         product_id = kwargs.get('id')
-        amount = request.data.get('amount')
-        price = request.data.get('price')
+        data = get_basket_product_data(request)
+
+        basket = get_current_basket_or_404(self.request)
+
+        if not update_basket_product(basket.id, product_id, data['amount'], data['price']):
+            raise Http404
+        serializer = self.serializer_class(basket, context={'request': self.request})
+        return Response(serializer.data)
+
 
-        if not self.request.user.is_anonymous:
-            basket = get_object_or_404(Basket, user=self.request.user, is_active=True)
+class BasketBatchView(CreateAPIView):
+    """
+    Applies a list of operations to the basket in one transaction:
+    `{"operations": [{"op": "add" | "set" | "remove", "id": <product id>, "amount": ..., "price": ...}, ...]}`.
+    `add` increases the quantity by the amount (1 by default), `set` replaces the quantity.
+    Unknown products are skipped.
+    """
+    permission_classes = [AllowAny]
+    serializer_class = BasketDetailSerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = BasketBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.validated_data['operations']
+
+        if all(operation['op'] == REMOVE for operation in operations):
+            basket = get_current_basket_or_404(self.request)
         else:
-            current_session = Session.objects.get(session_key=self.request.session.session_key)
-            basket = get_object_or_404(Basket, session=current_session, is_active=True)
+            basket = get_or_create_current_basket(self.request)
 
-        product_in_basket = get_object_or_404(BasketProduct, basket=basket, product_id=product_id)
-        product_in_basket.quantity = amount
-        product_in_basket.price = price
-        product_in_basket.save()
+        apply_basket_operations(basket.id, operations)
         serializer = self.serializer_class(basket, context={'request': self.request})
         return Response(serializer.data)
 
@@ -94,11 +107,7 @@ class CurrentBasketView(RetrieveAPIView):
     serializer_class = BasketDetailSerializer
 
     def get_object(self):
-        if not self.request.user.is_anonymous:
-            return get_object_or_404(Basket, user=self.request.user, is_active=True)
-        else:
-            current_session = Session.objects.get(session_key=self.request.session.session_key)
-            return get_object_or_404(Basket, session=current_session, is_active=True)
+        return get_current_basket_or_404(self.request)
 
 
 class CurrentBasketInactivateView(UpdateAPIView):
@@ -106,11 +115,7 @@ class CurrentBasketInactivateView(UpdateAPIView):
     serializer_class = BasketDetailSerializer
 
     def update(self, request, *args, **kwargs):
-        if not self.request.user.is_anonymous:
-            basket = get_object_or_404(Basket, user=self.request.user, is_active=True)
-        else:
-            current_session = Session.objects.get(session_key=self.request.session.session_key)
-            basket = get_object_or_404(Basket, session=current_session, is_active=True)
+        basket = get_current_basket_or_404(self.request)
 
         basket.is_active = False
         basket.save()
@@ -126,18 +131,10 @@ class OrderCreateView(CreateAPIView):
     def create(self, request, *args, **kwargs):
 
         # Check active basket first
-        if not self.request.user.is_anonymous:
-            basket = get_object_or_404(Basket, user=self.request.user, is_active=True)
-        else:
-            current_session = Session.objects.get(session_key=self.request.session.session_key)
-            basket = get_object_or_404(Basket, session=current_session, is_active=True)
+        basket = get_current_basket_or_404(self.request)
 
         # Check and create order
-        if not self.request.user.is_anonymous:
-            order, _ = Order.objects.get_or_create(user=self.request.user, basket=basket, status=Order.ACTIVE)
-        else:
-            current_session = Session.objects.get(session_key=self.request.session.session_key)
-            order, _ = Order.objects.get_or_create(session=current_session, basket=basket, status=Order.ACTIVE)
+        order = get_or_create_active_order(self.request, basket)
 
         serializer = self.serializer_class(order, context={'request': self.request})
         return Response(serializer.data)
@@ -147,11 +144,7 @@ class OrderActiveRetrieveView(RetrieveAPIView):
     serializer_class = OrderDetailSerializer
 
     def get_object(self):
-        if not self.request.user.is_anonymous:
-            return get_object_or_404(Order, user=self.request.user, status=Order.ACTIVE)
-        else:
-            current_session = Session.objects.get(session_key=self.request.session.session_key)
-            return get_object_or_404(Order, session=current_session, status=Order.ACTIVE)
+        return get_active_order_or_404(self.request)
 
 
 class OrderActiveToPendingView(UpdateAPIView):
@@ -159,25 +152,22 @@ class OrderActiveToPendingView(UpdateAPIView):
     serializer_class = OrderDetailShortSerializer
 
     def update(self, request, *args, **kwargs):
-        if not self.request.user.is_anonymous:
-            order = get_object_or_404(Order, user=self.request.user, status=Order.ACTIVE)
-        else:
-            current_session = Session.objects.get(session_key=self.request.session.session_key)
-            order = get_object_or_404(Order, session=current_session, status=Order.ACTIVE)
+        order = get_active_order_or_404(self.request)
 
         if not order.price:
-            sum_price = 0
-            for basket_product in order.basket.inside.all():
-                sum_price += (basket_product.quantity * basket_product.price)
-            order.price = sum_price
+            order.price = order.basket.get_totals()['full_price']
 
         order.status = Order.PENDING
         order.received = timezone.localtime()
-        order.save()
-        if order.payment_info.type == order.payment_info.CARD:
+        with transaction.atomic():
+            order.save()
+            order.save_items()
+            order.send_notification_to_admins()
+            order.send_notification_to_customer()
+            if order.payment_info.type == order.payment_info.CARD and settings.B2P_REGISTER_IN_BACKGROUND:
+                OrderPaymentB2PInfo.register_in_background(payment_info=order.payment_info)
+        if order.payment_info.type == order.payment_info.CARD and not settings.B2P_REGISTER_IN_BACKGROUND:
             OrderPaymentB2PInfo.make_register_request(payment_info=order.payment_info)
-        order.send_notification_to_admins()
-        order.send_notification_to_customer()
         serializer = self.serializer_class(order, context={'request': self.request})
         return Response(serializer.data)
 
@@ -196,119 +186,37 @@ class OrderActiveUpdateView(UpdateAPIView):
         if not new_step:
             return Response(_('Order step is not provided'), status=HTTP_400_BAD_REQUEST)
 
-        def check_promo_code(code):
-            promo = PromoCode.objects.filter(activity=True, code=code) \
-                .exclude(start_date__isnull=False, start_date__gt=timezone.localtime()) \
-                .exclude(deadline__isnull=False, deadline__lt=timezone.localtime()) \
-                .first()
-            return promo
-
-        def get_promo_basket_products(order_obj, promo_obj):
-            promo_products = order_obj.basket.inside.filter(
-                product__activity=True, product__kind__in=[Product.UNIQUE, Product.CHILD]
-            ).filter(Q(
-                product__in=promo_obj.products.values_list('id', flat=True)
-            ) | Q(
-                product__category__in=promo_obj.categories.values_list('id', flat=True)
-            ) | Q(
-                product__tags__in=promo_obj.tags.values_list('id', flat=True)
-            )
-            ).distinct()
-            return promo_products
-
-        def recalculate_basket_products_promo_prices(promo_bps, promo_obj):
-            for bp in promo_bps:
-
-                if promo_obj.discount_type == 'percent':
-                    bp.promo_price = round(
-                        bp.price * (1 - promo_obj.discount_amount / 100), 2)
-
-                elif promo_obj.special.discount_type == 'fixed':
-                    bp.promo_price = round(
-                        bp.price - promo_obj.discount_amount, 2)
-
-                bp.save()
-
         # Get order
-        if not self.request.user.is_anonymous:
-            order = get_object_or_404(Order, user=self.request.user, status=Order.ACTIVE)
-        else:
-            current_session = Session.objects.get(session_key=self.request.session.session_key)
-            order = get_object_or_404(Order, session=current_session, status=Order.ACTIVE)
+        order = get_active_order_or_404(self.request)
 
         if promocode:
             # Check promo code first
-            promo_active = check_promo_code(promocode)
-
-            if promo_active:
-                # If promo code is valid find promo products in basket
-                if promo_active.for_all_products:
-                    promo_basket_products = order.basket.inside.all()
-                else:
-                    promo_basket_products = get_promo_basket_products(order, promo_active)
-
-                if promo_basket_products:
-                    # Recalculate promo prices for promo products
-                    recalculate_basket_products_promo_prices(promo_basket_products, promo_active)
-
-                    order.promo = True
-                    order.promo_code = promo_active.code
-
-                else:
-                    return Response({'promocode': _('No promo products in the basket.')}, status=HTTP_400_BAD_REQUEST)
-
-            else:
+            rule = get_promo_rule(promocode)
+            if rule is None:
                 return Response({'promocode': _('Promocode is not valid.')}, status=HTTP_400_BAD_REQUEST)
 
-        else:
-            # Check if order already has a promo and recalculate the promo prices for products
-            if order.promo and order.promo_code:
-
-                # Check if promo code is valid
-                promo_active = check_promo_code(order.promo_code)
+            # If promo code is valid find promo products in basket and recalculate their promo prices
+            lines, changed = calculate_promo_prices(order.basket_id, rule)
+            if not any(line.promo_price is not None for line in lines):
+                return Response({'promocode': _('No promo products in the basket.')}, status=HTTP_400_BAD_REQUEST)
+            save_promo_prices(changed)
 
-                if promo_active:
-                    # For valid promocode find promo products in basket
-                    if promo_active.for_all_products:
-                        promo_basket_products = order.basket.inside.all()
-                    else:
-                        promo_basket_products = get_promo_basket_products(order, promo_active)
+            order.promo = True
+            order.promo_code = rule.code
 
-                    if promo_basket_products:
-                        # Recalculate promo prices for promo products
-                        recalculate_basket_products_promo_prices(promo_basket_products, promo_active)
-
-                else:
-                    # For invalid promocode erase all promo prices for all basket products
-                    for basket_product in order.basket.inside.all():
-                        basket_product.promo_price = None
-                        basket_product.save()
+        elif order.promo and order.promo_code:
+            # Recalculate the promo prices for products, they are erased if the promo code is not valid anymore
+            lines, changed = calculate_promo_prices(order.basket_id, get_promo_rule(order.promo_code))
+            save_promo_prices(changed)
 
         if new_step == 3:
             # Recalculate the price on the 3rd stage of order process:
-            order_price = 0
-            for basket_product in order.basket.inside.all():
-                product_price = basket_product.promo_price if basket_product.promo_price else basket_product.price
-                order_price += product_price * basket_product.quantity
-            order.price = order_price
+            totals = order.basket.get_totals()
+            order.price = totals['price']
 
             # Refresh delivery price
             delivery = order.delivery_info
-            order_price, delivery_price = 0, 0
-
-            if delivery.type == 'courier':
-                # if delivery.to_city.name in ['Moscow', 'Kostroma']:
-                if delivery.to_city.name == 'Moscow':
-                    for basket_product in order.basket.inside.all():
-                        order_price += basket_product.price * basket_product.quantity
-                    delivery_price = 650 if order_price < 3000 else 0
-
-                if delivery.to_city.name == 'Saint Petersburg':
-                    for basket_product in order.basket.inside.all():
-                        order_price += basket_product.price * basket_product.quantity
-                    delivery_price = 650 if order_price < 5000 else 0
-
-            delivery.price = delivery_price
+            delivery.price = get_delivery_price(delivery.type, delivery.to_city_id, totals['full_price'])
             delivery.save()
 
         order.step = new_step
@@ -324,11 +232,7 @@ class OrderDeliveryInfoCreateView(CreateAPIView):
     def create(self, request, *args, **kwargs):
         data = request.data
 
-        if not self.request.user.is_anonymous:
-            order = get_object_or_404(Order, user=self.request.user, status=Order.ACTIVE)
-        else:
-            current_session = Session.objects.get(session_key=self.request.session.session_key)
-            order = get_object_or_404(Order, session=current_session, status=Order.ACTIVE)
+        order = get_active_order_or_404(self.request)
 
         if order.delivery_info:
             return Response(_('Order already has a linked delivery info model'), status=HTTP_400_BAD_REQUEST)
@@ -352,11 +256,7 @@ class OrderDeliveryInfoUpdateView(UpdateAPIView):
     def update(self, request, *args, **kwargs):
         data = request.data
 
-        if not self.request.user.is_anonymous:
-            order = get_object_or_404(Order, user=self.request.user, status=Order.ACTIVE)
-        else:
-            current_session = Session.objects.get(session_key=self.request.session.session_key)
-            order = get_object_or_404(Order, session=current_session, status=Order.ACTIVE)
+        order = get_active_order_or_404(self.request)
 
         delivery_info = get_object_or_404(OrderDeliveryInfo, order=order)
         serializer = OrderDeliveryInfoSerializer(delivery_info, data=data, partial=True,
@@ -372,7 +272,7 @@ class OrderListView(ListAPIView):
     serializer_class = OrderListSerializer
 
     def get_queryset(self):
-        queryset = Order.objects.filter(user=self.request.user)
+        queryset = Order.objects.filter(user=self.request.user).prefetch_related('items')
         return queryset
 
 
@@ -383,11 +283,7 @@ class OrderPaymentInfoCreateView(CreateAPIView):
     def create(self, request, *args, **kwargs):
         data = request.data
 
-        if not self.request.user.is_anonymous:
-            order = get_object_or_404(Order, user=self.request.user, status=Order.ACTIVE)
-        else:
-            current_session = Session.objects.get(session_key=self.request.session.session_key)
-            order = get_object_or_404(Order, session=current_session, status=Order.ACTIVE)
+        order = get_active_order_or_404(self.request)
 
         if order.payment_info:
             return Response(_('Order already has a linked payment info model'), status=HTTP_400_BAD_REQUEST)
@@ -410,11 +306,7 @@ class OrderPaymentInfoUpdateView(UpdateAPIView):
     def update(self, request, *args, **kwargs):
         data = request.data
 
-        if not self.request.user.is_anonymous:
-            order = get_object_or_404(Order, user=self.request.user, status=Order.ACTIVE)
-        else:
-            current_session = Session.objects.get(session_key=self.request.session.session_key)
-            order = get_object_or_404(Order, session=current_session, status=Order.ACTIVE)
+        order = get_active_order_or_404(self.request)
 
         payment_info = get_object_or_404(OrderPaymentInfo, order=order)
         serializer = OrderPaymentInfoSerializer(payment_info, data=data, partial=True,
@@ -435,10 +327,14 @@ class OrderPaymentB2PInfoGetRedirectToPayView(RetrieveAPIView):
     def retrieve(self, request, *args, **kwargs):
         order = get_object_or_404(Order, id=self.kwargs['id'])
         payment_info = get_object_or_404(OrderPaymentInfo, order=order)
-        serializer: OrderPaymentInfoB2PSerializer = self.get_serializer(instance=payment_info.b2p)
+        b2p = get_object_or_404(OrderPaymentB2PInfo, payment_info=payment_info)
+        b2p.fail_abandoned_registration()
+        serializer: OrderPaymentInfoB2PSerializer = self.get_serializer(instance=b2p)
+        # The order is registered in background, the redirect is available when the registration succeeds
+        registered = b2p.b2p_order_register_status == OrderPaymentB2PInfo.B2P_SUCCESS
         return Response({
             **serializer.data,
-            "redirect": payment_info.b2p.get_order_b2p_redirected_authorize_url()
+            "redirect": b2p.get_order_b2p_redirected_authorize_url() if registered else None
         }, status=HTTP_200_OK)
 
 
@@ -464,11 +360,7 @@ class OrderPrivateInfoCreateView(CreateAPIView):
     def create(self, request, *args, **kwargs):
         data = request.data
 
-        if not self.request.user.is_anonymous:
-            order = get_object_or_404(Order, user=self.request.user, status=Order.ACTIVE)
-        else:
-            current_session = Session.objects.get(session_key=self.request.session.session_key)
-            order = get_object_or_404(Order, session=current_session, status=Order.ACTIVE)
+        order = get_active_order_or_404(self.request)
 
         if order.private_info:
             return Response(_('Order already has a linked private info model'), status=HTTP_400_BAD_REQUEST)
@@ -492,11 +384,7 @@ class OrderPrivateInfoUpdateView(UpdateAPIView):
     def update(self, request, *args, **kwargs):
         data = request.data
 
-        if not self.request.user.is_anonymous:
-            order = get_object_or_404(Order, user=self.request.user, status=Order.ACTIVE)
-        else:
-            current_session = Session.objects.get(session_key=self.request.session.session_key)
-            order = get_object_or_404(Order, session=current_session, status=Order.ACTIVE)
+        order = get_active_order_or_404(self.request)
 
         private_info = get_object_or_404(OrderPrivateInfo, order=order)
         serializer = OrderPrivateInfoSerializer(private_info, data=data, partial=True,
@@ -0,0 +1,162 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .b2p_utils import get_register_url
+
+# Seconds to connect to Best 2 Pay and to wait for its response
+CONNECT_TIMEOUT = 3
+READ_TIMEOUT = 15
+
+# Size of the keep-alive connections pool
+POOL_SIZE = 10
+
+# Requests are retried when the connection can't be established or the gateway is unavailable.
+# A request that reached Best 2 Pay and timed out is not retried, it may have registered the order
+MAX_RETRIES = 2
+RETRY_DELAY = 0.5
+RETRY_STATUSES = (502, 503, 504)
+
+# Longest time a registration with all its attempts may take, a registration in progress for longer
+# was abandoned by its stopped worker
+REGISTRATION_TIMEOUT = (CONNECT_TIMEOUT + READ_TIMEOUT) * (MAX_RETRIES + 1) + RETRY_DELAY * (2 ** MAX_RETRIES - 1)
+
+# Best 2 Pay is not called for the number of seconds after the number of failures in a row
+FAILURE_THRESHOLD = 5
+RECOVERY_TIMEOUT = 30
+
+# Number of threads registering the orders in background
+BACKGROUND_WORKERS = 4
+
+
+class B2PError(Exception):
+    pass
+
+
+class CircuitOpenError(B2PError):
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Stops the calls to a failing service for `recovery_timeout` seconds after `failure_threshold` failures
+    in a row. After the timeout one trial call is let through, the circuit is closed again if it succeeds.
+    """
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, recovery_timeout=RECOVERY_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.failures = 0
+        self.opened = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened is None:
+                return True
+            if time.monotonic() - self.opened >= self.recovery_timeout:
+                # Half open, the next failure opens the circuit for the whole timeout again
+                self.opened = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened = time.monotonic()
+
+
+class B2PClient(object):
+    """
+    Best 2 Pay API client sharing a pool of keep-alive connections between the threads of the process.
+    """
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, max_retries=MAX_RETRIES,
+                 retry_delay=RETRY_DELAY, breaker=None):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_retry_delay(self, attempt):
+        # Full jitter, so the retries of the concurrent requests don't come together
+        return random.uniform(0, self.retry_delay * 2 ** attempt)
+
+    def post(self, url, data):
+        if not self.breaker.allow():
+            raise CircuitOpenError('Best 2 Pay is unavailable, the calls are suspended.')
+
+        for attempt in range(self.max_retries + 1):
+            retry = attempt < self.max_retries
+            try:
+                response = self.session.post(url, data=data, timeout=self.timeout)
+            except requests.ConnectionError as error:
+                failure = error
+            except requests.Timeout as error:
+                failure, retry = error, False
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    self.breaker.record_success()
+                    return response
+                failure = B2PError('Best 2 Pay responded with status {0}.'.format(response.status_code))
+            if not retry:
+                break
+            time.sleep(self.get_retry_delay(attempt))
+
+        self.breaker.record_failure()
+        if isinstance(failure, B2PError):
+            raise failure
+        raise B2PError(str(failure)) from failure
+
+    def register_order(self, data):
+        """
+        Registers the order and returns its Best 2 Pay number.
+        """
+        response = self.post(get_register_url(), data)
+        if response.status_code != 200:
+            raise B2PError('Best 2 Pay responded with status {0}.'.format(response.status_code))
+        try:
+            root = ElementTree.fromstring(response.content)
+        except ElementTree.ParseError as error:
+            raise B2PError('Best 2 Pay responded with invalid XML.') from error
+        if root.tag == 'error' or root.find('id') is None:
+            raise B2PError('Best 2 Pay error {0}: {1}'.format(root.findtext('code'), root.findtext('description')))
+        return root.findtext('id')
+
+
+_client = None
+_executor = None
+_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = B2PClient()
+    return _client
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix='b2p')
+    return _executor
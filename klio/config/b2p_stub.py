@@ -0,0 +1,129 @@
+import itertools
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlencode, urlparse
+from xml.sax.saxutils import escape
+
+# Responses of the Best 2 Pay API the stub replays
+REGISTER_RESPONSE = '''<?xml version="1.0" encoding="UTF-8"?>
+<order>
+<id>{id}</id>
+<state>REGISTERED</state>
+<inprogress>0</inprogress>
+<date>{date}</date>
+<amount>{amount}</amount>
+<currency>{currency}</currency>
+<email>{email}</email>
+<phone>{phone}</phone>
+<reference>{reference}</reference>
+<description>{description}</description>
+<url>{url}</url>
+<parameters number="0"></parameters>
+<signature>{signature}</signature>
+</order>'''
+
+ERROR_RESPONSE = '''<?xml version="1.0" encoding="UTF-8"?>
+<error>
+<description>{description}</description>
+<code>{code}</code>
+</error>'''
+
+
+class B2PStubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super(B2PStubHandler, self).log_message(format, *args)
+
+    def send_xml(self, content, status=200):
+        content = content.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+        self.server.requests.append((self.path, data))
+
+        status = self.server.get_status()
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        if status != 200:
+            self.send_xml(ERROR_RESPONSE.format(description='Service unavailable', code=status), status)
+        elif not self.path.endswith('/Register'):
+            self.send_xml(ERROR_RESPONSE.format(description='Unknown method', code=101))
+        elif not data.get('amount') or not data.get('signature'):
+            self.send_xml(ERROR_RESPONSE.format(description='Invalid parameters', code=109))
+        else:
+            order_id = str(next(self.server.ids))
+            self.server.orders[order_id] = data
+            self.send_xml(REGISTER_RESPONSE.format(
+                id=order_id,
+                date=time.strftime('%Y.%m.%d %H:%M:%S'),
+                **{key: escape(data.get(key, '')) for key in (
+                    'amount', 'currency', 'email', 'phone', 'reference', 'description', 'url', 'signature'
+                )}
+            ))
+
+    def do_GET(self):
+        """
+        Payment page, redirects to the success url of the registered order.
+        """
+        url = urlparse(self.path)
+        order_id = parse_qs(url.query).get('id', [''])[0]
+        order = self.server.orders.get(order_id)
+        if not url.path.endswith('/Authorize') or order is None:
+            self.send_xml(ERROR_RESPONSE.format(description='Order not found', code=110), 404)
+            return
+        separator = '&' if '?' in order['url'] else '?'
+        self.send_response(302)
+        self.send_header('Location', order['url'] + separator + urlencode({
+            'id': order_id, 'operation': next(self.server.ids), 'reference': order.get('reference', ''),
+            'code': 0,
+        }))
+        self.end_headers()
+
+
+class B2PStubServer(ThreadingMixIn, HTTPServer):
+    """
+    Local Best 2 Pay API for development and tests. `statuses` are the HTTP statuses of the next responses,
+    e.g. `[503, 503]` makes two requests fail, `delay` is the number of seconds every response is delayed.
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, statuses=None, delay=0, verbose=False):
+        super(B2PStubServer, self).__init__((host, port), B2PStubHandler)
+        self.statuses = list(statuses or [])
+        self.delay = delay
+        self.verbose = verbose
+        self.ids = itertools.count(1000)
+        self.orders = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return 'http://{0}:{1}/webapi'.format(*self.server_address)
+
+    def get_status(self):
+        with self.lock:
+            return self.statuses.pop(0) if self.statuses else 200
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def handle_error(self, request, client_address):
+        # The client has given up waiting for a delayed response
+        if not issubclass(sys.exc_info()[0], ConnectionError):
+            super(B2PStubServer, self).handle_error(request, client_address)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
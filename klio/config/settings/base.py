@@ -54,6 +54,7 @@ class Base(Configuration):
         'django.middleware.common.CommonMiddleware',
         'django.middleware.csrf.CsrfViewMiddleware',
         'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'basket.middleware.CurrentBasketMiddleware',
         'django.contrib.messages.middleware.MessageMiddleware',
         'django.middleware.clickjacking.XFrameOptionsMiddleware',
     ]
@@ -159,10 +160,38 @@ class Base(Configuration):
 
     # SESSION_SAVE_EVERY_REQUEST = True
 
+    # Address of the memcached server shared by the workers (host:port),
+    # without it every worker caches in its own memory and the changes are not seen by the others
+    MEMCACHED_LOCATION = values.Value(None)
+
+    @property
+    def CACHES(self):
+        if self.MEMCACHED_LOCATION:
+            return {'default': {'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+                                'LOCATION': self.MEMCACHED_LOCATION}}
+        return {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+    # Sessions are read from the shared cache, baskets and orders refer to them by the key.
+    # The `signed_cookies` engine does not fit as its session key changes with the session data.
+    # Local caches of the workers would keep stale sessions, they are only read from the database then
+    @property
+    def SESSION_ENGINE(self):
+        if self.MEMCACHED_LOCATION:
+            return 'django.contrib.sessions.backends.cached_db'
+        return 'django.contrib.sessions.backends.db'
+
     CORS_ALLOW_CREDENTIALS = True
 
     DATA_UPLOAD_MAX_NUMBER_FIELDS = 10000
 
+    # Keep the catalog index in memory of every worker for product lists and filters, the index is built
+    # and refreshed in background, the lists are read from the database until it is up to date
+    PRODUCTS_FACET_INDEX = values.BooleanValue(False)
+
+    # Cache the responses of the read-mostly views until their models are changed and answer conditional requests,
+    # only enable with MEMCACHED_LOCATION as the changes have to be seen by all the workers
+    CACHE_RESPONSES = values.BooleanValue(False)
+
     # CITIES LIGHT SETTINGS
     CITIES_LIGHT_TRANSLATION_LANGUAGES = ['en', 'ru']
     CITIES_LIGHT_INCLUDE_COUNTRIES = ['RU']
@@ -220,5 +249,8 @@ class Base(Configuration):
     B2P_BASE_URL = os.getenv('B2P_BASE_URL')
     B2P_FAIL_REDIRECT = os.getenv('B2P_FAIL_REDIRECT')
     B2P_SUCCESS_REDIRECT = os.getenv('B2P_SUCCESS_REDIRECT')
+    # The order is registered in Best 2 Pay in a background thread, so a slow gateway doesn't hold the request,
+    # the frontend polls the redirect endpoint until the registration is finished
+    B2P_REGISTER_IN_BACKGROUND = values.BooleanValue(True)
 
     NOTIFIABLE_ADMIN_EMAIL_WHEN_ORDER_CREATED = os.getenv('NOTIFIABLE_ADMIN_EMAIL_WHEN_ORDER_CREATED').split(',')
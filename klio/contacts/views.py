@@ -1,10 +1,12 @@
 from rest_framework import generics
 
+from general.cache import CachedResponseMixin
 from .serializers import ContactDetailSerializer, ContactListSerializer, SocialListSerializer
-from .models import Contact, SocialNet
+from .models import Contact, ContactPhone, Phone, SocialNet, WorkingHours
 
 
-class ContactListView(generics.ListAPIView):
+class ContactListView(CachedResponseMixin, generics.ListAPIView):
+    cache_models = (Contact, ContactPhone, Phone, WorkingHours)
     serializer_class = ContactListSerializer
     queryset = Contact.objects.filter(activity=True)
 
@@ -14,6 +16,7 @@ class ContactDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Contact.objects.all()
 
 
-class SocialListView(generics.ListAPIView):
+class SocialListView(CachedResponseMixin, generics.ListAPIView):
+    cache_models = (SocialNet,)
     serializer_class = SocialListSerializer
     queryset = SocialNet.objects.filter(activity=True)
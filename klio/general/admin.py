@@ -3,7 +3,8 @@ from django.contrib.sites.admin import SiteAdmin as BaseSiteAdmin
 from django.contrib.sites.models import Site
 from django.utils.translation import gettext_lazy as _
 
-from .models import Article, Banner, CallbackInfo, Menu, MenuItem, News, Page, SiteSettings, SubscriberInfo
+from .models import (Article, Banner, CallbackInfo, Menu, MenuItem, News, OutgoingEmail, Page, SiteSettings,
+                     SubscriberInfo)
 
 
 admin.site.site_header = _('Klio Site Administration')
@@ -63,6 +64,12 @@ class NewsAdmin(admin.ModelAdmin):
     prepopulated_fields = {"slug": ("title",)}
 
 
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'to', 'created', 'status', 'attempts', 'next_attempt', 'sent']
+    list_filter = ['status']
+    readonly_fields = ['created', 'sent', 'last_error']
+
+
 class PageAdmin(admin.ModelAdmin):
     list_display = ['__str__', 'slug', 'modified', 'activity']
     list_editable = ['activity']
@@ -87,6 +94,7 @@ admin.site.register(CallbackInfo, HiddenAdmin)
 admin.site.register(Menu, MenuAdmin)
 admin.site.register(MenuItem, MenuItemAdmin)
 admin.site.register(News, NewsAdmin)
+admin.site.register(OutgoingEmail, OutgoingEmailAdmin)
 admin.site.register(Page, PageAdmin)
 admin.site.unregister(Site)
 admin.site.register(Site, SiteAdmin)
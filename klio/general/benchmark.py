@@ -0,0 +1,265 @@
+import json
+import time
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils import timezone
+
+from contacts.models import Contact
+from general.models import Article, Banner, News, Page
+from products.models import Brand, Category, Product
+from sale.models import Special
+from tags.models import Tag
+
+User = get_user_model()
+
+API_PREFIX = 'api/v1/'
+
+PERCENTILES = (50, 90, 99)
+
+
+def get_api_routes(patterns=None, prefix=''):
+    """
+    Returns routes of all the API endpoints, e.g. `api/v1/products/brands/<str:slug>/detail`.
+    """
+    routes = []
+    for pattern in get_resolver().url_patterns if patterns is None else patterns:
+        route = prefix + str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            routes.extend(get_api_routes(pattern.url_patterns, route))
+        elif isinstance(pattern, URLPattern) and route.startswith(API_PREFIX):
+            routes.append(route)
+    return routes
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of the sorted values.
+    """
+    return values[max(0, -(-len(values) * percent // 100) - 1)]
+
+
+class Scenario(object):
+    """
+    A request to an endpoint. Scenarios of the same route differ by the query or the data.
+    Isolated scenarios are requested by a new client, so they do not change the session of the others.
+    """
+
+    def __init__(self, route, path, method='get', data=None, authenticated=False, isolated=False, variant=''):
+        self.route = route
+        self.path = '/' + path
+        self.method = method
+        self.data = data
+        self.authenticated = authenticated
+        self.isolated = isolated
+        self.name = '%s %s%s' % (method.upper(), route, variant)
+
+    def run(self, client):
+        if self.data is None:
+            return getattr(client, self.method)(self.path)
+        return getattr(client, self.method)(self.path, json.dumps(self.data), content_type='application/json')
+
+
+def get_samples():
+    """
+    Finds the objects the endpoints are requested with, the biggest ones where it matters.
+    """
+    samples = {}
+    samples['category'] = Category.objects.filter(activity=True, parent__isnull=True).annotate(
+        descendants=Count('descendant_links')
+    ).order_by('-descendants').first()
+    samples['leaf'] = Category.objects.filter(
+        id__in=list(Category.get_active_leaves_ids()[:1000])
+    ).annotate(products_count=Count('products')).order_by('-products_count').first()
+    samples['brand'] = Brand.objects.filter(activity=True).annotate(
+        products_count=Count('product')
+    ).order_by('-products_count').first()
+    samples['special'] = Special.objects.filter(activity=True).order_by('id').first()
+    samples['product'] = Product.objects.filter(
+        activity=True, kind=Product.UNIQUE, categories__activity=True
+    ).order_by('id').first()
+    samples['tag'] = Tag.objects.filter(activity=True).first()
+    samples['article'] = Article.objects.first()
+    samples['banner'] = Banner.objects.first()
+    samples['news'] = News.objects.first()
+    samples['page'] = Page.objects.filter(activity=True).first()
+    samples['contact'] = Contact.objects.first()
+    return samples
+
+
+def get_scenarios(samples):
+    """
+    Returns the scenarios of the endpoints which can be requested with the samples. Basket and order
+    scenarios follow the checkout steps, so they are run in the order given.
+    """
+    category, leaf, brand, special, product = [samples[key] for key in ('category', 'leaf', 'brand', 'special', 'product')]
+    search_text = product.name.split()[0] if product else 'a'
+    scenarios = [
+        Scenario('api/v1/products/brands/list', 'api/v1/products/brands/list'),
+        Scenario('api/v1/products/categories/list', 'api/v1/products/categories/list'),
+        Scenario('api/v1/products/categories/list/mainpage', 'api/v1/products/categories/list/mainpage'),
+        Scenario('api/v1/products/new/filters/list', 'api/v1/products/new/filters/list'),
+        Scenario('api/v1/products/new/products/list', 'api/v1/products/new/products/list'),
+        Scenario('api/v1/products/list/mainpage/new', 'api/v1/products/list/mainpage/new'),
+        Scenario('api/v1/products/list/mainpage/special', 'api/v1/products/list/mainpage/special'),
+        Scenario('api/v1/products/search/list', 'api/v1/products/search/list?text=%s' % search_text),
+        Scenario('api/v1/products/search/list', 'api/v1/products/search/list?text=%s&sortby=price' % search_text,
+                 variant='?sortby=price'),
+        Scenario('api/v1/search', 'api/v1/search?text=%s' % search_text),
+        Scenario('api/v1/sale/specials/list', 'api/v1/sale/specials/list'),
+        Scenario('api/v1/tags/list', 'api/v1/tags/list'),
+        Scenario('api/v1/contacts/list', 'api/v1/contacts/list'),
+        Scenario('api/v1/contacts/socials/list', 'api/v1/contacts/socials/list'),
+        Scenario('api/v1/general/articles/list', 'api/v1/general/articles/list'),
+        Scenario('api/v1/general/banners/list', 'api/v1/general/banners/list'),
+        Scenario('api/v1/general/cities/list', 'api/v1/general/cities/list'),
+        Scenario('api/v1/general/menu/list', 'api/v1/general/menu/list'),
+        Scenario('api/v1/general/news/list', 'api/v1/general/news/list'),
+        Scenario('api/v1/general/settings/detail', 'api/v1/general/settings/detail'),
+    ]
+    for sample in (category, leaf):
+        if sample is None:
+            continue
+        variant = '' if sample is category else ' (leaf)'
+        scenarios += [
+            Scenario('api/v1/products/categories/<str:slug>/detail',
+                     'api/v1/products/categories/%s/detail' % sample.slug, variant=variant),
+            Scenario('api/v1/products/categories/<str:slug>/filters/list',
+                     'api/v1/products/categories/%s/filters/list' % sample.slug, variant=variant),
+            Scenario('api/v1/products/categories/<str:slug>/products/list',
+                     'api/v1/products/categories/%s/products/list' % sample.slug, variant=variant),
+            Scenario('api/v1/products/categories/<str:slug>/products/list',
+                     'api/v1/products/categories/%s/products/list?page=10' % sample.slug, variant=variant + '?page=10'),
+            Scenario('api/v1/products/categories/<str:slug>/products/list',
+                     'api/v1/products/categories/%s/products/list?sortby=price&direction=desc&cursor=' % sample.slug,
+                     variant=variant + '?sortby=price&cursor'),
+        ]
+    if brand:
+        scenarios += [
+            Scenario('api/v1/products/brands/<str:slug>/detail', 'api/v1/products/brands/%s/detail' % brand.slug),
+            Scenario('api/v1/products/brands/<str:slug>/filters/list',
+                     'api/v1/products/brands/%s/filters/list' % brand.slug),
+            Scenario('api/v1/products/brands/<str:slug>/products/list',
+                     'api/v1/products/brands/%s/products/list' % brand.slug),
+        ]
+    if special:
+        scenarios += [
+            Scenario('api/v1/sale/specials/<str:slug>/detail', 'api/v1/sale/specials/%s/detail' % special.slug),
+            Scenario('api/v1/sale/specials/<str:slug>/products/list',
+                     'api/v1/sale/specials/%s/products/list' % special.slug),
+        ]
+    for key, route, lookup in (
+            ('tag', 'api/v1/tags/<int:pk>/detail', 'pk'),
+            ('contact', 'api/v1/contacts/<int:pk>/detail', 'pk'),
+            ('article', 'api/v1/general/articles/<str:slug>/detail', 'slug'),
+            ('banner', 'api/v1/general/banners/<int:pk>/detail', 'pk'),
+            ('news', 'api/v1/general/news/<str:slug>/detail', 'slug'),
+            ('page', 'api/v1/general/pages/<str:slug>/detail', 'slug')):
+        if samples[key] is not None:
+            scenarios.append(Scenario(route, route.replace('<int:pk>' if lookup == 'pk' else '<str:slug>',
+                                                           str(getattr(samples[key], lookup)))))
+    if product:
+        path = 'api/v1/basket/products/%s/%s'
+        scenarios += [
+            Scenario('api/v1/products/categories/<str:category_slug>/products/<str:slug>/detail',
+                     'api/v1/products/categories/%s/products/%s/detail' % (
+                         product.categories.filter(activity=True).first().slug, product.slug)),
+            Scenario('api/v1/basket/products/<int:id>/add', path % (product.id, 'add'), method='post',
+                     data={'amount': 1, 'price': str(product.price)}),
+            Scenario('api/v1/basket/current', 'api/v1/basket/current'),
+            Scenario('api/v1/basket/products/<int:id>/update', path % (product.id, 'update'), method='put',
+                     data={'amount': 2, 'price': str(product.price)}),
+            Scenario('api/v1/basket/order/create', 'api/v1/basket/order/create', method='post', data={}),
+            Scenario('api/v1/basket/order/active', 'api/v1/basket/order/active'),
+            Scenario('api/v1/basket/products/<int:id>/delete', path % (product.id, 'delete'), method='delete'),
+            Scenario('api/v1/products/favorites/<int:id>/add', 'api/v1/products/favorites/%s/add' % product.id,
+                     method='post', data={}, authenticated=True),
+            Scenario('api/v1/products/favorites', 'api/v1/products/favorites', authenticated=True),
+            Scenario('api/v1/products/favorites/<int:id>/delete', 'api/v1/products/favorites/%s/delete' % product.id,
+                     method='delete', authenticated=True),
+        ]
+    scenarios += [
+        Scenario('api/v1/auth/login', 'api/v1/auth/login', method='post',
+                 data={'email': 'benchmark@example.com', 'password': 'benchmark'}, isolated=True),
+        Scenario('api/v1/auth/logout', 'api/v1/auth/logout', isolated=True),
+        Scenario('api/v1/basket/order/list', 'api/v1/basket/order/list', authenticated=True),
+        Scenario('api/v1/users/current', 'api/v1/users/current', authenticated=True),
+    ]
+    return scenarios
+
+
+def run_benchmark(runs=20, warmup=2, log=None):
+    """
+    Requests every scenario `runs` times (after `warmup` runs which are not measured) and returns
+    the latency percentiles (ms) and the number of SQL queries per scenario, with the API routes
+    which are not covered by any scenario. Changes made by the requests are rolled back.
+    """
+    log = log or (lambda message: None)
+    setup_test_environment()
+    try:
+        with transaction.atomic():
+            results = _run_scenarios(runs, warmup, log)
+            transaction.set_rollback(True)
+    finally:
+        teardown_test_environment()
+    return results
+
+
+def _run_scenarios(runs, warmup, log):
+    scenarios = get_scenarios(get_samples())
+    anonymous = Client()
+    authenticated = Client()
+    user = User.objects.create(email='benchmark-%s@example.com' % int(time.time()), first_name='Benchmark',
+                               last_name='Benchmark')
+    authenticated.force_login(user)
+
+    timings = {scenario.name: [] for scenario in scenarios}
+    queries = {scenario.name: [] for scenario in scenarios}
+    statuses = {}
+    for run in range(warmup + runs):
+        for scenario in scenarios:
+            client = Client() if scenario.isolated else authenticated if scenario.authenticated else anonymous
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = scenario.run(client)
+                duration = (time.perf_counter() - start) * 1000
+            statuses[scenario.name] = response.status_code
+            if run >= warmup:
+                timings[scenario.name].append(duration)
+                queries[scenario.name].append(len(context.captured_queries))
+        log('Run %s of %s.' % (run + 1, warmup + runs))
+
+    results = {}
+    for scenario in scenarios:
+        scenario_timings = sorted(timings[scenario.name])
+        result = {'path': scenario.path, 'status': statuses[scenario.name],
+                  'queries': sorted(queries[scenario.name])[len(queries[scenario.name]) // 2],
+                  'mean': round(sum(scenario_timings) / len(scenario_timings), 2)}
+        for percent in PERCENTILES:
+            result['p%s' % percent] = round(percentile(scenario_timings, percent), 2)
+        results[scenario.name] = result
+
+    covered = {scenario.route for scenario in scenarios}
+    return {
+        'created': timezone.now().isoformat(),
+        'runs': runs,
+        'results': results,
+        'not_covered': [route for route in get_api_routes() if route not in covered],
+    }
+
+
+def compare_results(results, baseline, threshold=0.2):
+    """
+    Returns rows of the results compared with the baseline: name, result, baseline result and
+    whether the scenario regressed - p50 latency grew by more than `threshold` or more queries are made.
+    """
+    rows = []
+    for name, result in results['results'].items():
+        base = baseline['results'].get(name) if baseline else None
+        regressed = bool(base) and (result['p50'] > base['p50'] * (1 + threshold) or result['queries'] > base['queries'])
+        rows.append((name, result, base, regressed))
+    return rows
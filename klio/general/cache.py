@@ -0,0 +1,309 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+# Requests of a value being computed wait for it for this number of seconds at most, then compute it themselves
+FLIGHT_TIMEOUT = 10
+
+# Seconds between the checks of the cache by the requests waiting for the other processes
+POLL_INTERVAL = 0.05
+
+# Responses of the views are cached for this number of seconds, they are invalidated by the changes of their models
+RESPONSE_CACHE_TIMEOUT = 60 * 60
+
+# An invalidated response is served for this number of seconds at most while one request refreshes it
+REFRESH_TIMEOUT = 30
+
+# Responses are validated with the time their ETag was first seen, it's kept for this number of seconds
+VALIDATOR_TIMEOUT = 24 * 60 * 60
+
+# Conditional request headers, a cached response is got without them and checked with them
+CONDITIONAL_HEADERS = ('HTTP_IF_MATCH', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE', 'HTTP_IF_UNMODIFIED_SINCE')
+
+# Headers of the responses cached with them
+CACHED_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control')
+
+# Labels of the models the cached responses depend on
+_tags = set()
+
+
+class Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _wait_for_other_process(key, lock_key):
+    deadline = time.monotonic() + FLIGHT_TIMEOUT
+    while cache.get(lock_key) is not None and time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+    return None
+
+
+def get_or_set_single_flight(key, func, timeout):
+    """
+    Returns the cached value or computes it with `func` and caches it for `timeout` seconds.
+    A burst of the requests of a missing value computes it once: the threads of the process wait for
+    the first one, the other processes wait while the lock key of the value is in the cache.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = Flight()
+    if not leader:
+        if flight.done.wait(FLIGHT_TIMEOUT) and flight.value is not None:
+            return flight.value
+        return func()
+
+    lock_key = '%s_lock' % key
+    locked = cache.add(lock_key, 1, FLIGHT_TIMEOUT)
+    try:
+        if not locked:
+            value = _wait_for_other_process(key, lock_key)
+        if value is None:
+            value = func()
+            cache.set(key, value, timeout)
+        flight.value = value
+    finally:
+        if locked:
+            cache.delete(lock_key)
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+    return value
+
+
+def get_tag_key(tag):
+    return 'response_tag_%s' % tag
+
+
+def get_tags_versions(tags):
+    """
+    Returns the versions of the tags. A missing version is started from the current time,
+    so the responses cached with an evicted version are not taken for fresh ones.
+    """
+    keys = [get_tag_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, int(time.time() * 1000), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def increment_tags_versions(tags):
+    for tag in tags:
+        try:
+            cache.incr(get_tag_key(tag))
+        except ValueError:
+            cache.set(get_tag_key(tag), int(time.time() * 1000), None)
+
+
+def invalidate_tags(tags):
+    """
+    Invalidates the responses depending on any of the tags when the current transaction is committed,
+    the responses refreshed before the commit would be cached with the old data.
+    """
+    tags = [tag for tag in tags if tag in _tags]
+    if tags:
+        transaction.on_commit(lambda: increment_tags_versions(tags))
+
+
+def invalidate_model_responses(sender, **kwargs):
+    invalidate_tags([sender._meta.label])
+
+
+def invalidate_relation_responses(sender, instance, action, model, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_tags([sender._meta.label, instance._meta.label, model._meta.label])
+
+
+def register_tags(models):
+    """
+    Makes the changes of the models invalidate the responses depending on them. The receivers are connected
+    to the models only, the other models are still deleted without being loaded.
+    """
+    for model in models:
+        _tags.add(model._meta.label)
+        post_save.connect(invalidate_model_responses, sender=model, dispatch_uid='response_cache_save')
+        post_delete.connect(invalidate_model_responses, sender=model, dispatch_uid='response_cache_delete')
+        for field in model._meta.get_fields():
+            through = field.many_to_many and (field.remote_field.through if field.concrete else field.through)
+            # Relations through the models of the project are changed by saving and deleting them
+            if through and through._meta.auto_created:
+                m2m_changed.connect(invalidate_relation_responses, sender=through,
+                                    dispatch_uid='response_cache_relation')
+
+
+def get_or_set_response(key, tags, func, timeout=RESPONSE_CACHE_TIMEOUT):
+    """
+    Returns the cached response or gets it with `func` and caches it with the versions of the tags.
+    A response invalidated by a change of a tag is refreshed by one request, the others get the stale response
+    meanwhile. A missing response is got once for a burst of the requests.
+    """
+    versions = get_tags_versions(tags)
+
+    def get_entry():
+        response = func()
+        if not response.is_rendered:
+            response.render()
+        headers = {header: response[header] for header in CACHED_HEADERS if response.has_header(header)}
+        return versions, response.status_code, response['Content-Type'], response.content, headers
+
+    entry = cache.get(key)
+    if entry is None:
+        entry = get_or_set_single_flight(key, get_entry, timeout)
+    elif entry[0] != versions and cache.add('%s_refresh' % key, 1, REFRESH_TIMEOUT):
+        try:
+            entry = get_entry()
+            cache.set(key, entry, timeout)
+        finally:
+            cache.delete('%s_refresh' % key)
+
+    _, status, content_type, content, headers = entry
+    response = HttpResponse(content, content_type=content_type, status=status)
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def get_validated_response(request, response):
+    """
+    Returns Not Modified (or Precondition Failed) response if the response's validators match
+    the conditional headers of the request, the response itself otherwise.
+    """
+    if response.status_code != 200:
+        return response
+    last_modified = response.get('Last-Modified')
+    return get_conditional_response(
+        request, etag=response.get('ETag'), last_modified=last_modified and parse_http_date_safe(last_modified),
+        response=response
+    )
+
+
+class CachedResponseMixin(object):
+    """
+    Caches GET responses of the view by the absolute URL (host, path and query string) and the `cache_headers`
+    of the request. The responses are invalidated by the changes of the `cache_models`.
+    """
+    cache_models = ()
+    cache_headers = ()
+    cache_timeout = RESPONSE_CACHE_TIMEOUT
+
+    def __init_subclass__(cls, **kwargs):
+        super(CachedResponseMixin, cls).__init_subclass__(**kwargs)
+        register_tags(cls.cache_models)
+
+    def get_cache_key(self, request):
+        parts = [request.build_absolute_uri()] + [request.META.get(
+            'HTTP_%s' % header.upper().replace('-', '_'), ''
+        ) for header in self.cache_headers]
+        return 'response_%s' % hashlib.md5('\n'.join(parts).encode('utf-8')).hexdigest()
+
+    def dispatch(self, request, *args, **kwargs):
+        get_response = super(CachedResponseMixin, self).dispatch
+        if request.method != 'GET' or not settings.CACHE_RESPONSES:
+            return get_response(request, *args, **kwargs)
+
+        # The whole response is cached, the conditions are checked against the cached one
+        conditions = {header: request.META.pop(header) for header in CONDITIONAL_HEADERS if header in request.META}
+        try:
+            response = get_or_set_response(
+                self.get_cache_key(request), [model._meta.label for model in self.cache_models],
+                lambda: get_response(request, *args, **kwargs), self.cache_timeout
+            )
+        finally:
+            request.META.update(conditions)
+        return get_validated_response(request, response)
+
+
+class ConditionalResponseMixin(object):
+    """
+    Answers conditional GET requests of the list and detail views with Not Modified without serializing the objects.
+
+    The ETag is a hash of the URL, the aggregates of the queryset of the view (the number of the objects and
+    the last modification time by default, see `get_validator_aggregates`) and the versions of the `cache_models`
+    (see `CachedResponseMixin`), changes of the related objects don't touch the modification time of the objects.
+    Last-Modified is the time the ETag was first seen.
+    """
+    cache_models = ()
+    modified_field = 'modified'
+
+    def __init_subclass__(cls, **kwargs):
+        super(ConditionalResponseMixin, cls).__init_subclass__(**kwargs)
+        register_tags(cls.cache_models)
+
+    def get_validator_aggregates(self):
+        aggregates = {'count': Count('pk')}
+        if self.modified_field:
+            aggregates['modified'] = Max(self.modified_field)
+        return aggregates
+
+    def get_validator_queryset(self):
+        """
+        Queryset of the list, or of the requested object for the detail views.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        if hasattr(self, 'retrieve'):
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return queryset
+
+    def get_validator_versions(self):
+        """
+        Versions of the data the response depends on besides the queryset.
+        """
+        return get_tags_versions([model._meta.label for model in self.cache_models])
+
+    def get_validator_values(self):
+        """
+        Values of the queryset the response depends on, its aggregates by default.
+        """
+        return self.get_validator_queryset().aggregate(**self.get_validator_aggregates())
+
+    def get_etag(self, request):
+        values = self.get_validator_values()
+        validator = [request.build_absolute_uri(), sorted((name, str(value)) for name, value in values.items()),
+                     self.get_validator_versions()]
+        return hashlib.md5(repr(validator).encode('utf-8')).hexdigest()
+
+    def get(self, request, *args, **kwargs):
+        # The versions of the models are shared by the workers through the cache as the cached responses are
+        if not settings.CACHE_RESPONSES:
+            return super(ConditionalResponseMixin, self).get(request, *args, **kwargs)
+
+        etag = self.get_etag(request)
+        cache.add('etag_%s' % etag, int(time.time()), VALIDATOR_TIMEOUT)
+        last_modified = cache.get('etag_%s' % etag) or int(time.time())
+
+        response = get_conditional_response(request, etag=quote_etag(etag), last_modified=last_modified)
+        if response is not None:
+            return response
+        response = super(ConditionalResponseMixin, self).get(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = quote_etag(etag)
+            response['Last-Modified'] = http_date(last_modified)
+            # Clients revalidate the responses every time, the unchanged ones are not sent again
+            patch_cache_control(response, no_cache=True)
+        return response
@@ -0,0 +1,52 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from general.benchmark import compare_results, run_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Measures latency percentiles and SQL queries of the API endpoints and compares them with the baseline.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=20, help='Number of measured requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=2, help='Number of requests per endpoint before measuring.')
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmark-baseline.json'),
+                            help='Path of the baseline file.')
+        parser.add_argument('--save', action='store_true', help='Save the results as the new baseline.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Relative growth of the median latency treated as a regression.')
+        parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error on regressions.')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if os.path.exists(options['baseline']):
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        results = run_benchmark(runs=options['runs'], warmup=options['warmup'], log=self.stderr.write)
+
+        self.stdout.write('{0:<90} {1:>6} {2:>9} {3:>9} {4:>9} {5:>8} {6:>16}'.format(
+            'endpoint', 'status', 'p50, ms', 'p90, ms', 'p99, ms', 'queries', 'baseline p50/q'))
+        regressions = []
+        for name, result, base, regressed in compare_results(results, baseline, options['threshold']):
+            line = '{0:<90} {1:>6} {2:>9} {3:>9} {4:>9} {5:>8} {6:>16}'.format(
+                name, result['status'], result['p50'], result['p90'], result['p99'], result['queries'],
+                '{0}/{1}'.format(base['p50'], base['queries']) if base else '-')
+            if regressed:
+                regressions.append(name)
+                line = self.style.ERROR(line + ' REGRESSION')
+            self.stdout.write(line)
+
+        for route in results['not_covered']:
+            self.stdout.write('Not covered: {0}'.format(route))
+
+        if options['save']:
+            with open(options['baseline'], 'w') as baseline_file:
+                json.dump(results, baseline_file, indent=2, sort_keys=True)
+            self.stdout.write('Saved the baseline to {0}.'.format(options['baseline']))
+
+        if regressions and options['fail_on_regression']:
+            raise CommandError('{0} endpoints regressed.'.format(len(regressions)))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from general.synthetic import CatalogGenerator
+
+
+class Command(BaseCommand):
+    help = 'Generates a synthetic catalog with baskets and orders for load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000, help='Number of products (up to 1M).')
+        parser.add_argument('--categories', type=int, default=1000, help='Number of categories.')
+        parser.add_argument('--depth', type=int, default=5, help='Depth of the categories tree.')
+        parser.add_argument('--properties', type=int, default=40, help='Number of product properties.')
+        parser.add_argument('--brands', type=int, default=200, help='Number of brands.')
+        parser.add_argument('--tags', type=int, default=100, help='Number of tags.')
+        parser.add_argument('--specials', type=int, default=20, help='Number of specials.')
+        parser.add_argument('--users', type=int, default=1000, help='Number of users.')
+        parser.add_argument('--baskets', type=int, default=2000,
+                            help='Number of baskets, the ones exceeding users belong to anonymous sessions.')
+        parser.add_argument('--prefix', default='syn', help='Prefix of the slugs, articles and emails of the data.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator.')
+        parser.add_argument('--clear', action='store_true', help='Remove the data generated with the prefix before.')
+
+    def handle(self, *args, **options):
+        generator = CatalogGenerator(prefix=options['prefix'], seed=options['seed'], log=self.stdout.write)
+        if options['clear']:
+            generator.clear()
+            self.stdout.write('Removed the data with prefix {0}.'.format(options['prefix']))
+        generator.generate(
+            categories=options['categories'], depth=options['depth'], products=options['products'],
+            properties=options['properties'], brands=options['brands'], tags=options['tags'],
+            specials=options['specials'], users=options['users'], baskets=options['baskets'],
+        )
+        self.stdout.write('Generated the catalog.')
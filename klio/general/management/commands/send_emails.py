@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from general.outbox import BATCH_SIZE, send_queued_emails
+
+
+class Command(BaseCommand):
+    help = 'Sends the queued emails.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Number of emails sent over one connection.')
+        parser.add_argument('--loop', action='store_true', help='Keep waiting for new emails.')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to wait for new emails in loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = send_queued_emails(batch_size=options['batch_size'])
+            if sent or failed:
+                self.stdout.write('Sent {0} emails, {1} failed.'.format(sent, failed))
+            elif not options['loop']:
+                break
+            else:
+                time.sleep(options['interval'])
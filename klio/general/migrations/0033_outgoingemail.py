@@ -0,0 +1,43 @@
+# Generated by Django 2.2.7 on 2026-10-18 12:55
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('general', '0032_banner_show_content'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingEmail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='created')),
+                ('subject', models.CharField(max_length=256, verbose_name='subject')),
+                ('template', models.CharField(max_length=128, verbose_name='template')),
+                ('context', django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict, verbose_name='context')),
+                ('from_email', models.CharField(blank=True, help_text='Leave blank to send from the default address.', max_length=256, verbose_name='from email')),
+                ('to', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=256), size=None, verbose_name='to')),
+                ('html', models.BooleanField(default=False, verbose_name='html')),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('sent', 'sent'), ('failed', 'failed')], default='pending', max_length=8, verbose_name='status')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='attempts')),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now, verbose_name='next attempt')),
+                ('last_error', models.TextField(blank=True, verbose_name='last error')),
+                ('sent', models.DateTimeField(blank=True, null=True, verbose_name='sent')),
+            ],
+            options={
+                'verbose_name': 'Outgoing email',
+                'verbose_name_plural': 'Outgoing emails',
+                'ordering': ['-created'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outgoingemail',
+            index=models.Index(fields=['status', 'next_attempt'], name='general_out_status_b70b36_idx'),
+        ),
+    ]
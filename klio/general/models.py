@@ -1,7 +1,9 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.fields import ArrayField, JSONField
 from django.contrib.sites.models import Site
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from ckeditor.fields import RichTextField
@@ -248,6 +250,44 @@ class News(models.Model):
         super(News, self).save(*args, **kwargs)
 
 
+class OutgoingEmail(models.Model):
+    """
+    Email queued to be rendered and sent by the `send_emails` command (see `outbox`).
+    It is saved in the transaction of the change it is about, so nothing is sent if the change is rolled back.
+    """
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, _('pending')),
+        (SENT, _('sent')),
+        (FAILED, _('failed')),
+    ]
+
+    created = models.DateTimeField(auto_now_add=True, verbose_name=_('created'))
+    subject = models.CharField(max_length=256, verbose_name=_('subject'))
+    template = models.CharField(max_length=128, verbose_name=_('template'))
+    context = JSONField(default=dict, blank=True, verbose_name=_('context'))
+    from_email = models.CharField(max_length=256, blank=True, verbose_name=_('from email'),
+                                  help_text=_('Leave blank to send from the default address.'))
+    to = ArrayField(models.CharField(max_length=256), verbose_name=_('to'))
+    html = models.BooleanField(default=False, verbose_name=_('html'))
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=PENDING, verbose_name=_('status'))
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name=_('attempts'))
+    next_attempt = models.DateTimeField(default=timezone.now, verbose_name=_('next attempt'))
+    last_error = models.TextField(blank=True, verbose_name=_('last error'))
+    sent = models.DateTimeField(blank=True, null=True, verbose_name=_('sent'))
+
+    class Meta:
+        ordering = ['-created']
+        indexes = [models.Index(fields=['status', 'next_attempt'])]
+        verbose_name = _('Outgoing email')
+        verbose_name_plural = _('Outgoing emails')
+
+    def __str__(self):
+        return self.subject
+
+
 class Page(models.Model):
     created = models.DateTimeField(auto_now_add=True, verbose_name=_('created'))
     modified = models.DateTimeField(auto_now=True, verbose_name=_('modified'))
@@ -0,0 +1,125 @@
+import json
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.mail import EmailMessage, get_connection
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+# Number of emails sent over one connection to the mail server
+BATCH_SIZE = 50
+
+# Failed email is retried after this number of seconds, the delay is doubled with every attempt
+# up to the maximum, the email is given up after the maximum number of attempts
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 60 * 60
+MAX_ATTEMPTS = 8
+
+
+def encode_context(value):
+    """
+    Prepares the template context to be saved as JSON, model instances are saved as references
+    and fetched again when the email is rendered, so the email shows the committed data.
+    """
+    if isinstance(value, models.Model):
+        return {'__model__': value._meta.label_lower, 'pk': value.pk}
+    if isinstance(value, dict):
+        return {key: encode_context(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_context(item) for item in value]
+    return json.loads(json.dumps(value, cls=DjangoJSONEncoder))
+
+
+def decode_context(value):
+    if isinstance(value, dict):
+        if '__model__' in value:
+            return apps.get_model(value['__model__'])._default_manager.filter(pk=value['pk']).first()
+        return {key: decode_context(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_context(item) for item in value]
+    return value
+
+
+def queue_email(to, subject, template, context=None, from_email=None, html=False):
+    """
+    Saves the email to be sent by the `send_emails` command. Call it inside the transaction
+    of the change the email is about.
+    """
+    return OutgoingEmail.objects.create(
+        to=list(to),
+        subject=subject,
+        template=template,
+        context=encode_context(context or {}),
+        from_email=from_email or '',
+        html=html,
+    )
+
+
+def render_email(email, connection=None):
+    message = EmailMessage(
+        email.subject,
+        render_to_string(email.template, decode_context(email.context)),
+        email.from_email or None,
+        email.to,
+        connection=connection,
+    )
+    if email.html:
+        message.content_subtype = 'html'
+    return message
+
+
+def get_retry_delay(attempts):
+    return timedelta(seconds=min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY))
+
+
+def _fail(email, error, now):
+    email.attempts += 1
+    email.last_error = '{0}: {1}'.format(type(error).__name__, error)
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = OutgoingEmail.FAILED
+    else:
+        email.next_attempt = now + get_retry_delay(email.attempts)
+
+
+def send_queued_emails(batch_size=BATCH_SIZE, connection=None):
+    """
+    Sends a batch of the due emails over one connection to the mail server. The batch is locked,
+    so several workers may run at once. Failed emails are rescheduled with backoff.
+    Returns the numbers of the sent and of the failed emails.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(OutgoingEmail.objects.select_for_update(skip_locked=True).filter(
+            status=OutgoingEmail.PENDING, next_attempt__lte=now
+        ).order_by('next_attempt', 'id')[:batch_size])
+        if not emails:
+            return 0, 0
+
+        sent = failed = 0
+        connection = connection or get_connection()
+        try:
+            connection.open()
+        except Exception as error:
+            for email in emails:
+                _fail(email, error, now)
+            failed = len(emails)
+        else:
+            try:
+                for email in emails:
+                    try:
+                        render_email(email, connection).send()
+                    except Exception as error:
+                        _fail(email, error, now)
+                        failed += 1
+                    else:
+                        email.status = OutgoingEmail.SENT
+                        email.sent = timezone.now()
+                        sent += 1
+            finally:
+                connection.close()
+        OutgoingEmail.objects.bulk_update(emails, ['status', 'attempts', 'next_attempt', 'last_error', 'sent'])
+    return sent, failed
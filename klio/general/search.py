@@ -0,0 +1,68 @@
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+
+# Search results are cached for this number of seconds
+SEARCH_CACHE_TIMEOUT = 30
+
+# Number of threads running the queries of the searches, every thread keeps its own database connection
+SEARCH_WORKERS = 8
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_search_params(query_params):
+    """
+    Returns the search query params normalized, so the same search is cached once: the text
+    is lowercased with the whitespace collapsed (the similarity and the text search ignore the case),
+    the tags are sorted.
+    """
+    text = ' '.join((query_params.get('text') or '').split()).lower()
+    tags = sorted({tag.strip() for tag in (query_params.get('tags') or '').split(',') if tag.strip()})
+    return {
+        'text': text,
+        'tags': tags,
+        'article': (query_params.get('article') or '').strip(),
+        'obj_type': query_params.get('type') or '',
+        'sort_by': query_params.get('sortby') or '',
+        'direction': query_params.get('direction') or '',
+    }
+
+
+def get_search_cache_key(params, host):
+    digest = hashlib.md5(json.dumps([params, host], sort_keys=True).encode('utf-8')).hexdigest()
+    return 'search_%s' % digest
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix='search')
+    return _executor
+
+
+def _run_in_thread(func):
+    # Connections of the threads are kept open between the searches, a new database session
+    # is much slower on its first queries. A connection is closed on any error
+    try:
+        return func()
+    except Exception:
+        connection.close()
+        raise
+
+
+def run_parallel(tasks):
+    """
+    Runs the independent functions (a dict of names and functions) in the threads, returns a dict of their results.
+    Inside a transaction the functions run in the current thread, the other connections don't see its changes.
+    """
+    if connection.in_atomic_block:
+        return {name: func() for name, func in tasks.items()}
+    futures = {name: get_executor().submit(_run_in_thread, func) for name, func in tasks.items()}
+    return {name: future.result() for name, future in futures.items()}
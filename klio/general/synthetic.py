@@ -0,0 +1,370 @@
+import random
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.db import transaction
+from django.db.models import Max, Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from basket.models import Basket, BasketProduct, Order, OrderItem
+from products.facet_index import log_products_changes
+from products.listing import refresh_listings_specials, update_products_listings
+from products.models import (Brand, Category, CategoryClosure, Product, ProductImage, ProductProperty,
+                             ProductPropertyValue, ProductType, Unit)
+from products.search import update_products_search
+from sale.models import Special, SpecialProduct
+from tags.models import Tag
+
+User = get_user_model()
+
+BATCH_SIZE = 1000
+
+WORDS = (
+    'agate', 'amber', 'amethyst', 'aquamarine', 'beryl', 'bracelet', 'brooch', 'chain', 'charm', 'citrine', 'coral',
+    'crystal', 'cufflinks', 'diamond', 'earrings', 'emerald', 'garnet', 'gold', 'jade', 'jasper', 'lapis', 'locket',
+    'malachite', 'moonstone', 'necklace', 'onyx', 'opal', 'pearl', 'pendant', 'peridot', 'platinum', 'quartz', 'ring',
+    'ruby', 'sapphire', 'silver', 'spinel', 'tiara', 'topaz', 'tourmaline', 'turquoise', 'zircon',
+)
+
+
+class CatalogGenerator(object):
+    """
+    Generates a synthetic catalog for load testing: a deep category tree, unique, parent and child
+    products with property values, images and tags, brands, specials, users with baskets and orders.
+
+    Everything is created in bulk bypassing the model signals, the derived data (category closure,
+    properties documents and listings) is built by the generator. All the slugs, articles and emails
+    are prefixed, so the data can be removed by `clear` and generated again.
+    """
+
+    def __init__(self, prefix='syn', seed=0, log=None):
+        self.prefix = prefix
+        self.random = random.Random(seed)
+        self.log = log or (lambda message: None)
+        self.now = timezone.now()
+
+    def name(self, words=3):
+        return ' '.join(self.random.choice(WORDS) for _ in range(words)).capitalize()
+
+    def slug(self, kind, number):
+        return '%s-%s-%s' % (self.prefix, kind, number)
+
+    def clear(self):
+        """
+        Removes the data of the previous run with the same prefix.
+        """
+        prefix = self.prefix + '-'
+        Order.objects.filter(Q(user__email__startswith=prefix) | Q(basket__session_key__startswith=prefix)).delete()
+        Basket.objects.filter(Q(user__email__startswith=prefix) | Q(session_key__startswith=prefix)).delete()
+        Session.objects.filter(session_key__startswith=prefix).delete()
+        User.objects.filter(email__startswith=prefix).delete()
+        Special.objects.filter(slug__startswith=prefix).delete()
+        Product.objects.filter(slug__startswith=prefix, kind=Product.CHILD).delete()
+        Product.objects.filter(slug__startswith=prefix).delete()
+        Category.objects.filter(slug__startswith=prefix).delete()
+        ProductType.objects.filter(slug__startswith=prefix).delete()
+        ProductProperty.objects.filter(slug__startswith=prefix).delete()
+        Brand.objects.filter(slug__startswith=prefix).delete()
+        Tag.objects.filter(name__startswith=prefix).delete()
+        Unit.objects.filter(name__startswith=prefix).delete()
+        log_products_changes()
+
+    def generate(self, categories=1000, depth=5, products=10000, properties=40, brands=200, tags=100, specials=20,
+                 users=1000, baskets=2000):
+        self.create_categories(categories, depth)
+        self.create_references(properties, brands, tags)
+        self.create_specials(specials)
+        self.create_products(products)
+        self.create_special_products()
+        self.create_baskets(users, baskets)
+        log_products_changes()
+
+    def create_categories(self, count, depth):
+        """
+        Creates a tree of `depth` levels, every next level is wider.
+        """
+        roots = max(1, min(20, count // 50))
+        branching = 1.0
+        while roots * sum(branching ** level for level in range(depth)) < count:
+            branching += 0.1
+
+        self.categories = []
+        parents = []
+        number = 0
+        closure = []
+        ancestors = {}
+        for level in range(depth):
+            size = int(round(roots * branching ** level)) if level < depth - 1 else count - number
+            size = min(size, count - number)
+            if size <= 0:
+                break
+            level_categories = []
+            for _ in range(size):
+                parent = self.random.choice(parents) if parents else None
+                name = self.name(2)
+                level_categories.append(Category(
+                    name=name, slug=self.slug('category', number), parent=parent,
+                    group=parent.group if parent else 0, meta_title=name, meta_description=name,
+                    meta_keywords=', '.join(name.split()), order=self.random.randint(1, 100),
+                    activity=self.random.random() > 0.03,
+                ))
+                number += 1
+            Category.objects.bulk_create(level_categories, batch_size=BATCH_SIZE)
+
+            if not parents:
+                for category in level_categories:
+                    category.group = category.pk
+                Category.objects.bulk_update(level_categories, ['group'], batch_size=BATCH_SIZE)
+            for category in level_categories:
+                ancestors[category.pk] = [(category.pk, 0)] + [
+                    (ancestor_id, ancestor_depth + 1) for ancestor_id, ancestor_depth in ancestors.get(category.parent_id, [])
+                ]
+                closure.extend(CategoryClosure(ancestor_id=ancestor_id, descendant_id=category.pk, depth=ancestor_depth)
+                               for ancestor_id, ancestor_depth in ancestors[category.pk])
+            self.categories.extend(level_categories)
+            parents = level_categories
+        CategoryClosure.objects.bulk_create(closure, batch_size=BATCH_SIZE)
+
+        parents_ids = {category.parent_id for category in self.categories}
+        self.leaves = [category for category in self.categories if category.pk not in parents_ids]
+        self.log('Created %s categories, %s leaves.' % (len(self.categories), len(self.leaves)))
+
+    def create_references(self, properties, brands, tags):
+        """
+        Creates units, property types with properties, brands and tags.
+        """
+        self.units = Unit.objects.bulk_create([Unit(name='%s-%s' % (self.prefix, name)) for name in ('pcs', 'g', 'ct')])
+
+        types = [ProductProperty.TEXT, ProductProperty.INTEGER, ProductProperty.BOOLEAN, ProductProperty.FLOAT]
+        self.properties = ProductProperty.objects.bulk_create([
+            ProductProperty(name='%s %s %s' % (self.prefix, self.name(2), number), slug=self.slug('property', number),
+                            type=types[number % len(types)], interval=1, units=self.random.choice(self.units))
+            for number in range(properties)
+        ])
+        self.options = {prop.pk: [self.name(1) for _ in range(self.random.randint(3, 12))]
+                        for prop in self.properties if prop.type == ProductProperty.TEXT}
+
+        self.product_types = ProductType.objects.bulk_create([
+            ProductType(name=self.name(2), slug=self.slug('type', number)) for number in range(max(1, properties // 4))
+        ])
+        self.types_properties = {}
+        for product_type in self.product_types:
+            self.types_properties[product_type.pk] = self.random.sample(
+                self.properties, min(len(self.properties), self.random.randint(4, 12))
+            )
+            product_type.properties.set(self.types_properties[product_type.pk])
+
+        self.brands = Brand.objects.bulk_create([
+            Brand(name=self.name(1), slug=self.slug('brand', number), logo='brands/%s.png' % self.prefix,
+                  order=number, activity=self.random.random() > 0.05)
+            for number in range(brands)
+        ])
+        self.tags = Tag.objects.bulk_create([Tag(name='%s-%s' % (self.prefix, self.name(1))) for _ in range(tags)])
+        self.log('Created %s properties, %s brands and %s tags.' % (len(self.properties), len(self.brands), len(self.tags)))
+
+    @transaction.atomic
+    def create_specials(self, count):
+        self.specials = []
+        for number in range(count):
+            name = self.name(2)
+            special = Special.objects.create(
+                name=name, slug=self.slug('special', number), deadline=self.now + timezone.timedelta(days=30),
+                discount_type=self.random.choice([Special.PERCENT, Special.FIXED]),
+                discount_amount=Decimal(self.random.randint(5, 30)), activity=self.random.random() > 0.2,
+            )
+            special.categories.set(self.random.sample(self.categories, min(len(self.categories), 3)))
+            special.tags.set(self.random.sample(self.tags, min(len(self.tags), 2)))
+            self.specials.append(special)
+        self.log('Created %s specials.' % count)
+
+    def get_value(self, prop):
+        if prop.type == ProductProperty.TEXT:
+            return {'value_text': self.random.choice(self.options[prop.pk])}
+        if prop.type == ProductProperty.INTEGER:
+            return {'value_integer': self.random.randint(0, 1000)}
+        if prop.type == ProductProperty.BOOLEAN:
+            return {'value_boolean': self.random.random() > 0.5}
+        return {'value_float': round(self.random.uniform(0, 100), 2)}
+
+    def create_products(self, count):
+        """
+        Creates products chunk by chunk: every tenth group is a parent with 2-5 children.
+        """
+        self.art = Product.objects.aggregate(art=Max('art'))['art'] or 0
+        self.products_ids = []
+        number = 0
+        while number < count:
+            chunk = min(BATCH_SIZE, count - number)
+            with transaction.atomic():
+                number += self.create_products_chunk(number, chunk)
+            self.log('Created %s of %s products.' % (min(number, count), count))
+
+    def create_products_chunk(self, number, count):
+        owners = []
+        children_counts = []
+        created = 0
+        while created < count:
+            is_parent = self.random.random() < 0.1 and count - created > 2
+            children_count = min(self.random.randint(2, 5), count - created - 1) if is_parent else 0
+            name = self.name()
+            owners.append(Product(
+                name=name, slug=self.slug('product', number + created), meta_title=name, meta_description=name,
+                meta_keywords=', '.join(name.split()), kind=Product.PARENT if is_parent else Product.UNIQUE,
+                product_type=self.random.choice(self.product_types), brand=self.random.choice(self.brands),
+                art=None if is_parent else self.next_art(), units=self.random.choice(self.units),
+                price=None if is_parent else self.price(), in_stock=0 if is_parent else self.in_stock(),
+                base_amount=1, is_new=Product.NEW if self.random.random() < 0.05 else Product.CALCULATED,
+                order=self.random.randint(1, 100), activity=self.random.random() > 0.03,
+            ))
+            children_counts.append(children_count)
+            created += 1 + children_count
+        Product.objects.bulk_create(owners)
+
+        owners_children = []
+        for owner, children_count in zip(owners, children_counts):
+            owner_children = []
+            for child_number in range(children_count):
+                name = '%s %s' % (owner.name, child_number + 1)
+                owner_children.append(Product(
+                    name=name, slug='%s-%s' % (owner.slug, child_number), meta_title=name, meta_description=name,
+                    meta_keywords=', '.join(name.split()), kind=Product.CHILD, parent=owner, art=self.next_art(),
+                    price=self.price(), in_stock=self.in_stock(), base_amount=None, order=child_number + 1,
+                    activity=self.random.random() > 0.03,
+                ))
+            owners_children.append(owner_children)
+        children = [child for owner_children in owners_children for child in owner_children]
+        Product.objects.bulk_create(children)
+        products = owners + children
+        products_ids = [product.pk for product in products]
+        Product.objects.filter(id__in=products_ids).update(
+            created=RawSQL("now() - random() * interval '365 days'", [])
+        )
+
+        categories = []
+        tags = []
+        for owner in owners:
+            for category in self.random.sample(self.leaves, min(len(self.leaves), self.random.choice([1, 1, 1, 2]))):
+                categories.append(Product.categories.through(product_id=owner.pk, category_id=category.pk))
+            if self.random.random() < 0.2:
+                tags.append(Product.tags.through(product_id=owner.pk, tag_id=self.random.choice(self.tags).pk))
+        Product.categories.through.objects.bulk_create(categories, batch_size=BATCH_SIZE)
+        Product.tags.through.objects.bulk_create(tags, batch_size=BATCH_SIZE)
+
+        # Children have values of all the properties of their parents, some of them are their own
+        values = []
+        for owner, owner_children in zip(owners, owners_children):
+            owner_values = {prop.pk: self.get_value(prop) for prop in self.types_properties[owner.product_type_id]}
+            values.extend(ProductPropertyValue(product_id=owner.pk, prop_id=prop_id, **value)
+                          for prop_id, value in owner_values.items())
+            for child in owner_children:
+                values.extend(ProductPropertyValue(
+                    product_id=child.pk, prop_id=prop.pk,
+                    **(self.get_value(prop) if self.random.random() < 0.3 else owner_values[prop.pk])
+                ) for prop in self.types_properties[owner.product_type_id])
+        ProductPropertyValue.objects.bulk_create(values, batch_size=BATCH_SIZE)
+
+        images = []
+        for product in products:
+            for order in range(self.random.randint(0 if product.is_child else 1, 3)):
+                images.append(ProductImage(product_id=product.pk, img='products/%s-%s.jpg' % (self.prefix, product.pk % 100),
+                                           order=order + 1))
+        ProductImage.objects.bulk_create(images, batch_size=BATCH_SIZE)
+
+        owners_ids = [owner.pk for owner in owners]
+        Product.update_properties_documents(owners_ids)
+        update_products_listings(owners_ids)
+        update_products_search(owners_ids)
+        self.products_ids.extend(product.pk for product in products if not product.is_parent)
+        return len(products)
+
+    def next_art(self):
+        self.art += 1
+        return self.art
+
+    def price(self):
+        return Decimal(self.random.randint(500, 500000)) / 100
+
+    def in_stock(self):
+        return self.random.choice([0, 0, 1, 2, 5, 10, 100])
+
+    def create_special_products(self):
+        # A product has at most one relation shown on main and one not shown
+        relations = []
+        used = set()
+        for special in self.specials:
+            for product_id in self.random.sample(self.products_ids, min(len(self.products_ids), 50)):
+                key = (product_id, self.random.random() < 0.2)
+                if key not in used:
+                    used.add(key)
+                    relations.append(SpecialProduct(special=special, product_id=product_id, on_main=key[1]))
+        SpecialProduct.objects.bulk_create(relations, batch_size=BATCH_SIZE)
+        refresh_listings_specials()
+        self.log('Created %s special products.' % len(relations))
+
+    def create_baskets(self, users_count, count):
+        """
+        Creates users and anonymous sessions with baskets, a half of the baskets are ordered.
+        """
+        password = make_password(None)
+        users = User.objects.bulk_create([
+            User(email='%s-%s@example.com' % (self.prefix, number), password=password, first_name=self.name(1),
+                 last_name=self.name(1))
+            for number in range(users_count)
+        ], batch_size=BATCH_SIZE)
+
+        session_data = SessionStore().encode({})
+        sessions = Session.objects.bulk_create([
+            Session(session_key='%s-%s' % (self.prefix, number), session_data=session_data,
+                    expire_date=self.now + timezone.timedelta(days=14))
+            for number in range(count - min(count, len(users)))
+        ], batch_size=BATCH_SIZE)
+
+        baskets = []
+        for number in range(count):
+            ordered = number % 2 == 0
+            if number < len(users):
+                baskets.append(Basket(user=users[number], is_active=not ordered))
+            else:
+                baskets.append(Basket(session_key=sessions[number - len(users)].session_key, is_active=not ordered))
+        Basket.objects.bulk_create(baskets, batch_size=BATCH_SIZE)
+
+        basket_products = []
+        orders = []
+        orders_lines = []
+        products = {
+            product_id: (art, '{0}:{1}'.format(parent_name, name) if parent_name else name, price)
+            for product_id, art, name, parent_name, price in Product.objects.filter(id__in=self.products_ids).values_list(
+                'id', 'art', 'name', 'parent__name', 'price'
+            )
+        }
+        for basket in baskets:
+            products_ids = self.random.sample(self.products_ids, min(len(self.products_ids), self.random.randint(1, 10)))
+            lines = [(product_id, self.random.randint(1, 5)) for product_id in products_ids]
+            basket_products.extend(
+                BasketProduct(basket=basket, product_id=product_id, quantity=quantity, price=products[product_id][2])
+                for product_id, quantity in lines
+            )
+            if not basket.is_active:
+                total = sum(((products[product_id][2] or 0) * quantity for product_id, quantity in lines), Decimal(0))
+                orders.append(Order(user=basket.user, session_key=basket.session_key, basket=basket, price=total,
+                                    status=self.random.choice([Order.PENDING, Order.DELIVERY, Order.COMPLETED,
+                                                               Order.DENIED])))
+                orders_lines.append(lines)
+        BasketProduct.objects.bulk_create(basket_products, batch_size=BATCH_SIZE)
+        Order.objects.bulk_create(orders, batch_size=BATCH_SIZE)
+
+        # Placed orders are shown from the snapshots of their products (see `Order.save_items`)
+        items = []
+        for order, lines in zip(orders, orders_lines):
+            for product_id, quantity in lines:
+                art, name, price = products[product_id]
+                items.append(OrderItem(order=order, product_id=product_id, art=art, name=name, price=price,
+                                       quantity=quantity, total=(price or 0) * quantity))
+        OrderItem.objects.bulk_create(items, batch_size=BATCH_SIZE)
+        self.log('Created %s users, %s baskets, %s orders and %s order items.' % (
+            len(users), len(baskets), len(orders), len(items)
+        ))
@@ -0,0 +1,205 @@
+import threading
+import time
+
+from django.contrib.sites.models import Site
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from basket.models import Order
+from products.models import Brand, Category, CategoryClosure, Product, ProductListing, ProductSearch
+from products.search import get_searchable_products, rebuild_products_search
+from products.views import BrandListView
+from .benchmark import percentile
+from .cache import get_or_set_single_flight, increment_tags_versions
+from .models import OutgoingEmail, Page
+from .outbox import MAX_ATTEMPTS, queue_email, send_queued_emails
+from .synthetic import CatalogGenerator
+
+
+class CatalogGeneratorTestCase(TestCase):
+    def test_generate(self):
+        generator = CatalogGenerator(seed=1)
+        generator.generate(categories=30, depth=3, products=200, properties=8, brands=5, tags=5, specials=2,
+                           users=5, baskets=10)
+
+        self.assertEqual(Category.objects.count(), 30)
+        self.assertEqual(CategoryClosure.objects.filter(depth=0).count(), 30)
+        self.assertEqual(Product.objects.count(), 200)
+        self.assertTrue(Product.objects.filter(kind=Product.CHILD, parent__kind=Product.PARENT).exists())
+        self.assertEqual(ProductListing.objects.count(), 200)
+        self.assertEqual(ProductSearch.objects.count(), 200)
+        self.assertTrue(Order.objects.exists())
+        self.assertFalse(Order.objects.filter(items__isnull=True).exists())
+
+        response = self.client.get('/api/v1/products/categories/%s/products/list' % generator.categories[0].slug)
+        self.assertEqual(response.status_code, 200)
+
+        product = get_searchable_products().first()
+        response = self.client.get('/api/v1/products/search/list', {'text': product.name})
+        self.assertIn(product.id, [result['id'] for result in response.data['results']])
+
+        generator.clear()
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(Category.objects.exists())
+
+
+class PercentileTestCase(TestCase):
+    def test_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 90), 7)
+
+
+class FailingEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionError('Connection refused')
+
+
+class OutboxTestCase(TestCase):
+    def queue(self):
+        return queue_email(['user@example.com'], 'Subject', 'registration/activation_email_body.txt',
+                           {'site': Site.objects.get_current(), 'activation_key': 'key', 'expiration_days': 7})
+
+    def test_send(self):
+        site = Site.objects.get_current()
+        for i in range(3):
+            self.queue()
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(send_queued_emails(batch_size=2), (2, 0))
+        self.assertEqual(send_queued_emails(batch_size=2), (1, 0))
+        self.assertEqual(send_queued_emails(batch_size=2), (0, 0))
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].to, ['user@example.com'])
+        self.assertIn(site.domain + '/register/activate/key', mail.outbox[0].body)
+        self.assertFalse(OutgoingEmail.objects.exclude(status=OutgoingEmail.SENT).exists())
+
+    def test_retry(self):
+        email = self.queue()
+
+        self.assertEqual(send_queued_emails(connection=FailingEmailBackend()), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutgoingEmail.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertIn('Connection refused', email.last_error)
+        self.assertGreater(email.next_attempt, timezone.now())
+        self.assertEqual(send_queued_emails(), (0, 0))
+
+        OutgoingEmail.objects.update(next_attempt=timezone.now(), attempts=MAX_ATTEMPTS - 1)
+        self.assertEqual(send_queued_emails(connection=FailingEmailBackend()), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutgoingEmail.FAILED)
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class SearchCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_single_flight(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        threads = [threading.Thread(target=get_or_set_single_flight, args=('flight', compute, 60)) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(get_or_set_single_flight('flight', compute, 60), 'value')
+        self.assertEqual(len(calls), 1)
+
+    def test_search_is_cached(self):
+        category = Category.objects.create(name='Rings', slug='rings')
+        product = Product.objects.create(name='Agate ring', slug='agate-ring', art=3491)
+        product.categories.add(category)
+        rebuild_products_search()
+
+        response = self.client.get('/api/v1/search', {'text': 'Agate  Ring'})
+        self.assertEqual(response.json()['counts'], {'categories': 1, 'products': 1, 'articles': 0, 'news': 0})
+        self.assertEqual(response.json()['products'][0]['id'], product.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/v1/search', {'text': 'agate ring'}).json(), response.json())
+
+
+@override_settings(CACHE_RESPONSES=True)
+class ResponseCacheTestCase(TestCase):
+    url = '/api/v1/products/brands/list'
+
+    def setUp(self):
+        cache.clear()
+
+    def get_names(self):
+        return [brand['name'] for brand in self.client.get(self.url).json()]
+
+    def test_response_is_cached_until_invalidated(self):
+        brand = Brand.objects.create(name='Klio', slug='klio')
+        self.assertEqual(self.get_names(), ['Klio'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_names(), ['Klio'])
+        # The ETag and the list
+        with self.assertNumQueries(2):
+            self.client.get(self.url, {'ordering': 'name'})
+
+        # Invalidated on commit, there's no commit in the test
+        brand.name = 'Agate'
+        brand.save()
+        self.assertEqual(self.get_names(), ['Klio'])
+        increment_tags_versions(['products.Brand'])
+        self.assertEqual(self.get_names(), ['Agate'])
+
+    def test_stale_response_is_served_while_refreshed(self):
+        brand = Brand.objects.create(name='Klio', slug='klio')
+        self.get_names()
+        brand.name = 'Agate'
+        brand.save()
+        increment_tags_versions(['products.Brand'])
+
+        # Another request is refreshing the response
+        key = BrandListView().get_cache_key(RequestFactory().get(self.url))
+        cache.add('%s_refresh' % key, 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_names(), ['Klio'])
+        cache.delete('%s_refresh' % key)
+        self.assertEqual(self.get_names(), ['Agate'])
+
+    def test_cached_response_is_validated(self):
+        Brand.objects.create(name='Klio', slug='klio')
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+@override_settings(CACHE_RESPONSES=True)
+class ConditionalResponseTestCase(TestCase):
+    url = '/api/v1/general/pages/about/detail'
+
+    def setUp(self):
+        cache.clear()
+
+    def test_not_modified(self):
+        page = Page.objects.create(name='About', slug='about', content='Klio')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.assertEqual(self.client.get('/api/v1/general/pages/contacts/detail',
+                                         HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+        page.content = 'Klio jewelry'
+        page.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
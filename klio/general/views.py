@@ -1,10 +1,8 @@
 from collections import namedtuple
+from functools import partial
 from django.contrib.postgres.search import TrigramSimilarity
-from django.core.mail import EmailMessage
-from django.db.models import CharField, Q
-from django.db.models.functions import Cast
+from django.db import transaction
 from django.shortcuts import get_object_or_404
-from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
@@ -15,15 +13,22 @@ from rest_framework.response import Response
 from rest_framework.status import HTTP_200_OK
 from rest_framework.viewsets import ViewSet
 
+from products.listing import prefetch_products_listing
+from products.search import get_searchable_products, search_products, search_products_by_art, similarity_threshold
 from products.models import Category, Product
-from .models import Article, Banner, Menu, News, Page, SiteSettings
+from tags.models import Tag
+from .cache import CachedResponseMixin, ConditionalResponseMixin, get_or_set_single_flight
+from .models import Article, Banner, Menu, MenuItem, News, Page, SiteSettings
+from .outbox import queue_email
+from .search import SEARCH_CACHE_TIMEOUT, get_search_cache_key, get_search_params, run_parallel
 from .serializers import (ArticleDetailSerializer, ArticleListSerializer, BannerDetailSerializer,
                           BannerListSerializer, CityListSerializer, MenuListSerializer, NewsDetailSerializer,
                           NewsListSerializer, PageDetailSerializer, SearchDataSerializer, SiteDetailSerializer,
                           SubscriberInfoDetailSerializer)
 
 
-class ArticleListView(ListAPIView):
+class ArticleListView(ConditionalResponseMixin, ListAPIView):
+    cache_models = (Article,)
     serializer_class = ArticleListSerializer
     queryset = Article.objects.filter(
         activity=True
@@ -34,7 +39,8 @@ class ArticleListView(ListAPIView):
     )
 
 
-class ArticleDetailView(RetrieveUpdateDestroyAPIView):
+class ArticleDetailView(ConditionalResponseMixin, RetrieveUpdateDestroyAPIView):
+    cache_models = (Article, Tag)
     lookup_field = 'slug'
     serializer_class = ArticleDetailSerializer
     queryset = Article.objects.all()
@@ -56,17 +62,21 @@ class BannerDetailView(RetrieveUpdateDestroyAPIView):
     queryset = Banner.objects.all()
 
 
-class CityListView(ListAPIView):
+class CityListView(CachedResponseMixin, ListAPIView):
+    cache_models = (City,)
     serializer_class = CityListSerializer
     queryset = City.objects.all().exclude(alternate_names='null').order_by('alternate_names')
 
 
-class MenuListView(ListAPIView):
+class MenuListView(CachedResponseMixin, ConditionalResponseMixin, ListAPIView):
+    cache_models = (Menu, MenuItem)
+    modified_field = None
     serializer_class = MenuListSerializer
     queryset = Menu.objects.filter(activity=True)
 
 
-class NewsListView(ListAPIView):
+class NewsListView(ConditionalResponseMixin, ListAPIView):
+    cache_models = (News,)
     serializer_class = NewsListSerializer
     queryset = News.objects.filter(
         activity=True
@@ -77,13 +87,15 @@ class NewsListView(ListAPIView):
     )
 
 
-class NewsDetailView(RetrieveUpdateDestroyAPIView):
+class NewsDetailView(ConditionalResponseMixin, RetrieveUpdateDestroyAPIView):
+    cache_models = (News, Tag)
     lookup_field = 'slug'
     serializer_class = NewsDetailSerializer
     queryset = News.objects.all()
 
 
-class PageDetailView(RetrieveUpdateDestroyAPIView):
+class PageDetailView(ConditionalResponseMixin, RetrieveUpdateDestroyAPIView):
+    cache_models = (Page,)
     lookup_field = 'slug'
     serializer_class = PageDetailSerializer
     queryset = Page.objects.filter(activity=True)
@@ -92,31 +104,17 @@ class PageDetailView(RetrieveUpdateDestroyAPIView):
 class SearchListView(ViewSet):
     SearchData = namedtuple('SearchData', ('categories', 'products', 'articles', 'news'))
 
+    # Numbers of the found objects of every type returned if no type is requested
+    LIMITS = {'categories': 4, 'products': 8, 'articles': 4, 'news': 4}
+
     def list(self, request):
-        tags = self.request.query_params.get('tags')
-        article = self.request.query_params.get('article')
-        text = self.request.query_params.get('text')
-        obj_type = self.request.query_params.get('type')
-        sort_by = self.request.query_params.get('sortby')
-        direction = self.request.query_params.get('direction')
-
-        # Get all active categories with only active parents ids
-        categories_ids = list(Category.objects.filter(activity=True, parent__isnull=True).values_list('id', flat=True))
-        parents = categories_ids
-        children = True
-        while children:
-            children = list(Category.objects.filter(activity=True, parent_id__in=parents).values_list('id', flat=True))
-            categories_ids += children
-            parents = children
-
-        active_child_categories_ids = list(Category.objects.filter(
-            id__in=categories_ids, children__isnull=True
-        ).values_list('id', flat=True))
+        params = get_search_params(request.query_params)
+        key = get_search_cache_key(params, request.get_host())
+        return Response(get_or_set_single_flight(key, lambda: self.search(request, **params), SEARCH_CACHE_TIMEOUT))
 
+    def get_querysets(self, text, tags, article, obj_type, sort_by, direction):
         categories = Category.objects.filter(activity=True)
-        products = Product.objects.filter(activity=True, kind__in=[Product.UNIQUE, Product.CHILD]).filter(
-            Q(categories__in=active_child_categories_ids) | Q(parent__categories__in=active_child_categories_ids)
-        ).distinct()
+        products = get_searchable_products()
         articles = Article.objects.filter(activity=True)
         news = News.objects.filter(activity=True)
 
@@ -127,13 +125,7 @@ class SearchListView(ViewSet):
                 similarity__gt=0.15
             ).order_by('-similarity')
 
-            products_art = products.annotate(
-                similarity=TrigramSimilarity(Cast('art', CharField()), text)
-            ).filter(similarity__gt=0.3)
-            products_trgm = products.exclude(id__in=products_art.values_list('id', flat=True)).annotate(
-                similarity=TrigramSimilarity('name', text)
-            ).filter(similarity__gt=0.15)
-            products = (products_art | products_trgm).order_by('-similarity')
+            products = search_products(products, text)
 
             articles = articles.annotate(
                 similarity=TrigramSimilarity('title', text)
@@ -148,65 +140,78 @@ class SearchListView(ViewSet):
             ).order_by('-similarity')
 
         if tags:
-            tags_list = tags.split(',')
             # Need to get empty set of categories
             categories = categories.filter(id=0)
-            products = products.filter(tags__name__in=tags_list)
-            articles = articles.filter(tags__name__in=tags_list)
-            news = news.filter(tags__name__in=tags_list)
+            products = products.filter(id__in=Product.objects.filter(tags__name__in=tags).values('id'))
+            articles = articles.filter(tags__name__in=tags)
+            news = news.filter(tags__name__in=tags)
 
         if article:
             categories = categories.none()
-            products = products.annotate(
-                similarity=TrigramSimilarity(Cast('art', CharField()), article)
-            ).filter(similarity__gt=0.5).order_by('-similarity', 'art')
+            products = search_products_by_art(products, article, 0.5).order_by('-similarity', 'art')
             articles = articles.none()
             news = news.none()
 
-        categories_count = categories.count()
-        products_count = products.count()
-        articles_count = articles.count()
-        news_count = news.count()
-
-        search_data = self.SearchData(
-            categories=categories[:4], products=products[:8], articles=articles[:4], news=news[:4]
+        if obj_type == 'categories' and sort_by == 'name':
+            if direction == 'asc':
+                categories = categories.order_by('name')
+            if direction == 'desc':
+                categories = categories.order_by('-name')
+        if obj_type == 'articles' and sort_by == 'title':
+            if direction == 'acs':
+                articles = articles.order_by('title')
+            if direction == 'desc':
+                articles = articles.order_by('-title')
+        if obj_type == 'news' and sort_by == 'title':
+            if direction == 'acs':
+                news = news.order_by('title')
+            if direction == 'desc':
+                news = news.order_by('-title')
+
+        return {'categories': categories, 'products': prefetch_products_listing(products), 'articles': articles,
+                'news': news}
+
+    @staticmethod
+    def evaluate(name, func):
+        if name == 'products':
+            # The similarity threshold of the products search is set per transaction, the query may run on its own connection
+            with similarity_threshold():
+                return func()
+        return func()
+
+    def search(self, request, obj_type, **params):
+        querysets = self.get_querysets(obj_type=obj_type, **params)
+        if obj_type in querysets:
+            # Products of the type are listed by the products search view
+            slices = {obj_type: slice(None)} if obj_type != 'products' else {}
+        else:
+            slices = {name: slice(limit) for name, limit in self.LIMITS.items()}
+
+        # The counts and the objects are independent queries, they are run in parallel on their own connections
+        tasks = {}
+        for name, queryset in querysets.items():
+            tasks[name, 'count'] = partial(self.evaluate, name, queryset.count)
+            if name in slices:
+                tasks[name, 'items'] = partial(self.evaluate, name, partial(list, queryset[slices[name]]))
+        results = run_parallel(tasks)
+
+        serializer = SearchDataSerializer(
+            self.SearchData(**{name: results.get((name, 'items')) for name in querysets}),
+            context={'request': request},
+            counts={name: results[name, 'count'] for name in querysets}
         )
+        return serializer.data
 
-        if obj_type:
-            if obj_type == 'categories':
-                if sort_by == 'name':
-                    if direction == 'asc':
-                        categories = categories.order_by('name')
-                    if direction == 'desc':
-                        categories = categories.order_by('-name')
-                search_data = self.SearchData(categories=categories, products=None, articles=None, news=None)
-            if obj_type == 'products':
-                search_data = self.SearchData(categories=None, products=None, articles=None, news=None)
-            if obj_type == 'articles':
-                if sort_by == 'title':
-                    if direction == 'acs':
-                        articles = articles.order_by('title')
-                    if direction == 'desc':
-                        articles = articles.order_by('-title')
-                search_data = self.SearchData(categories=None, products=None, articles=articles, news=None)
-            if obj_type == 'news':
-                if sort_by == 'title':
-                    if direction == 'acs':
-                        news = news.order_by('title')
-                    if direction == 'desc':
-                        news = news.order_by('-title')
-                search_data = self.SearchData(categories=None, products=None, articles=None, news=news)
-
-        serializer = SearchDataSerializer(search_data, context={'request': request},
-                                          counts={'categories': categories_count, 'products': products_count,
-                                                  'articles': articles_count, 'news': news_count})
-        return Response(serializer.data)
-
-
-class SettingsDetailView(RetrieveAPIView):
+
+class SettingsDetailView(CachedResponseMixin, ConditionalResponseMixin, RetrieveAPIView):
+    cache_models = (SiteSettings,)
+    modified_field = None
     serializer_class = SiteDetailSerializer
     queryset = SiteSettings.objects.all()
 
+    def get_validator_queryset(self):
+        return self.get_queryset().filter(activity=True)
+
     def get_object(self):
         queryset = self.get_queryset()
         obj = get_object_or_404(queryset, activity=True)
@@ -224,20 +229,15 @@ class SuscriberInfoCreateView(CreateAPIView):
 
         serializer = self.serializer_class(data=data, context={'request': self.request})
         if serializer.is_valid(raise_exception=True):
-            serializer.create(validated_data=serializer.validated_data)
-            self.admin_email_notification('new_subscription.html', data=serializer.validated_data)
+            with transaction.atomic():
+                serializer.create(validated_data=serializer.validated_data)
+                self.admin_email_notification('new_subscription.html', data=serializer.validated_data)
             return Response(HTTP_200_OK)
 
     def admin_email_notification(self, template, subj='Письмо с сайта Klio!', **kwargs):
-        html_content = render_to_string(template, {'kwargs': kwargs})
-        from_email, to = 'Klio Website <pythonchem1st@gmail.com>', ['reactive.90@mail.ru']
-        msg = EmailMessage(subj, html_content, from_email, to)
-        msg.content_subtype = "html"
-        msg.send()
+        queue_email(['reactive.90@mail.ru'], subj, template, {'kwargs': kwargs},
+                    from_email='Klio Website <pythonchem1st@gmail.com>', html=True)
 
     def email_confirm(self, template, **kwargs):
-        html_content = render_to_string(template, kwargs)
-        from_email, to = 'Klio AutoReply <pythonchem1st@gmail.com>', [kwargs['email']]
-        msg = EmailMessage(_('Your Request Received!'), html_content, from_email, to)
-        msg.content_subtype = "html"
-        msg.send()
+        queue_email([kwargs['email']], str(_('Your Request Received!')), template, kwargs,
+                    from_email='Klio AutoReply <pythonchem1st@gmail.com>', html=True)
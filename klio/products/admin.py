@@ -4,7 +4,7 @@ from decimal import Decimal
 
 from django.contrib import admin
 from django.db import models
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.forms import FileField, Form, Textarea
 from django.shortcuts import redirect, render
 from django.urls import path
@@ -13,10 +13,13 @@ from django.utils.translation import gettext_lazy as _
 from slugify import slugify
 
 from sale.models import SpecialProduct
+from .facet_index import log_products_changes
 from .forms import ProductForm
+from .listing import schedule_products_listings_update
 from .models import (Brand, Category, Product, ProductImage, ProductProperty, ProductPropertyValue,
                      ProductType, Unit)
-from .utils import export_products_names_csv
+from .search import schedule_products_search_update
+from .utils import export_products_names_csv, schedule_update
 
 CYRILLIC = [
     (u'ё', u'yo'),
@@ -194,6 +197,7 @@ class ProductAdmin(admin.ModelAdmin):
             csv_file = request.FILES["csv_file"]
             csv_data = csv.reader(csv_file.read().decode('utf-8').splitlines(), delimiter=';')
             next(csv_data)
+            arts = set()
             for row in csv_data:
                 art, name = row
                 slug = slugify(name, replacements=CYRILLIC)
@@ -208,6 +212,11 @@ class ProductAdmin(admin.ModelAdmin):
                         except IntegrityError:
                             prod_count = Product.objects.filter(slug__startswith=slug).count()
                             product.update(slug='{0}-{1}'.format(slug, prod_count + 1), name=name)
+                        arts.add(art)
+            # Names are updated without signals
+            products_ids = list(Product.objects.filter(art__in=arts).values_list('id', flat=True))
+            schedule_products_search_update(products_ids)
+            schedule_update(log_products_changes, products_ids)
 
             self.message_user(request, _("CSV file was successfully uploaded."))
             return redirect("..")
@@ -230,6 +239,7 @@ class ProductAdmin(admin.ModelAdmin):
         if request.method == "POST":
             csv_file = request.FILES["csv_file"]
             csv_data = csv.reader(csv_file.read().decode('utf-8').splitlines(), delimiter=';')
+            arts = set()
             for row in csv_data:
                 art, in_stock, price = row
                 in_stock, price = in_stock.replace(u'\xa0', u''), price.replace(u'\xa0', u'')
@@ -238,6 +248,11 @@ class ProductAdmin(admin.ModelAdmin):
                                                            in_stock=Decimal(in_stock.replace(',', '.')))
                 except ValueError:
                     continue
+                arts.add(art)
+            # Stock and prices are updated without signals
+            products_ids = list(Product.objects.filter(art__in=arts).values_list('id', flat=True))
+            schedule_products_listings_update(products_ids)
+            schedule_update(log_products_changes, products_ids)
 
             self.message_user(request, _("CSV file was successfully uploaded."))
             return redirect("..")
@@ -251,6 +266,7 @@ class ProductAdmin(admin.ModelAdmin):
         if request.method == "POST":
             csv_file = request.FILES["csv_file"]
             csv_data = csv.reader(csv_file.read().decode('utf-8').splitlines(), delimiter=';')
+            arts = set()
             for row in csv_data:
                 category1, category2, category3, category4, art, content, brand_name = row
 
@@ -323,6 +339,12 @@ class ProductAdmin(admin.ModelAdmin):
                             product.categories.add(parent_category)
                 except ValueError:
                     continue
+                arts.add(art)
+            # Brands are updated without signals
+            products_ids = list(Product.objects.filter(art__in=arts).values_list('id', flat=True))
+            schedule_products_listings_update(products_ids)
+            schedule_products_search_update(products_ids)
+            schedule_update(log_products_changes, products_ids)
 
             self.message_user(request, _("CSV file was successfully uploaded."))
             return redirect("..")
@@ -338,56 +360,58 @@ class ProductAdmin(admin.ModelAdmin):
             csv_data = csv.reader(csv_file.read().decode('utf-8').splitlines(), delimiter=';')
             header = next(csv_data)
             props_names = header[1:]
-            for row in csv_data:
-                art, props_values = row[0], row[1:]
+            # Properties documents of the products are rebuilt once, when the whole file is loaded
+            with transaction.atomic():
+                for row in csv_data:
+                    art, props_values = row[0], row[1:]
 
-                if not props_values or not art:
-                    continue
+                    if not props_values or not art:
+                        continue
 
-                try:
-                    product_id = Product.objects.filter(art=art).values_list('id', flat=True)[0]
-                except IndexError:
-                    continue
+                    try:
+                        product_id = Product.objects.filter(art=art).values_list('id', flat=True)[0]
+                    except IndexError:
+                        continue
 
-                for index, pv in enumerate(props_values):
+                    for index, pv in enumerate(props_values):
 
-                    if not pv:
-                        continue
+                        if not pv:
+                            continue
 
-                    if '.' in pv:
-                        try:
-                            pv = float(pv)
-                        except ValueError:
-                            value_type, interval = 'text', None
-                        else:
-                            value_type, interval = 'float', 0.01
+                        if '.' in pv:
+                            try:
+                                pv = float(pv)
+                            except ValueError:
+                                value_type, interval = 'text', None
+                            else:
+                                value_type, interval = 'float', 0.01
 
-                    else:
-                        try:
-                            pv = int(pv)
-                        except ValueError:
-                            value_type, interval = 'text', None
                         else:
-                            value_type, interval = 'integer', 1
+                            try:
+                                pv = int(pv)
+                            except ValueError:
+                                value_type, interval = 'text', None
+                            else:
+                                value_type, interval = 'integer', 1
 
-                    prop_slug = slugify(props_names[index], replacements=CYRILLIC)
-                    try:
-                        prop_id = ProductProperty.objects.filter(slug=prop_slug).values_list('id', flat=True)[0]
-                    except IndexError:
-                        prop = ProductProperty.objects.create(name=props_names[index], slug=prop_slug,
-                                                              interval=interval, type=value_type)
-                        prop_id = prop.id
-
-                    value, is_new_value = ProductPropertyValue.objects.get_or_create(product_id=product_id,
-                                                                                     prop_id=prop_id)
-                    if value_type == 'integer':
-                        value.value_integer = pv
-                    if value_type == 'float':
-                        value.value_float = pv
-                    if value_type == 'text':
-                        value.value_text = pv
-
-                    value.save()
+                        prop_slug = slugify(props_names[index], replacements=CYRILLIC)
+                        try:
+                            prop_id = ProductProperty.objects.filter(slug=prop_slug).values_list('id', flat=True)[0]
+                        except IndexError:
+                            prop = ProductProperty.objects.create(name=props_names[index], slug=prop_slug,
+                                                                  interval=interval, type=value_type)
+                            prop_id = prop.id
+
+                        value, is_new_value = ProductPropertyValue.objects.get_or_create(product_id=product_id,
+                                                                                         prop_id=prop_id)
+                        if value_type == 'integer':
+                            value.value_integer = pv
+                        if value_type == 'float':
+                            value.value_float = pv
+                        if value_type == 'text':
+                            value.value_text = pv
+
+                        value.save()
 
             self.message_user(request, _("CSV file was successfully uploaded."))
             return redirect("..")
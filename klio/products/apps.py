@@ -5,3 +5,6 @@ from django.utils.translation import ugettext_lazy as _
 class ProductsConfig(AppConfig):
     name = 'products'
     verbose_name = _('Products App')
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,514 @@
+import copy
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .filters import RESERVED_PARAMS, TEXT_VALUES_SEPARATOR, get_products_ordering, parse_range
+from .listing import NEW_PRODUCT_PERIOD, prefetch_products_listing
+from .models import Product, ProductChange, ProductProperty, ProductPropertyValue
+
+# Changes are kept for this period, the index not refreshed for half of it is rebuilt
+CHANGES_RETENTION = timezone.timedelta(days=1)
+
+# Changes a bit older than the version are read again as their transactions could be committed later
+CHANGES_LOOKBACK = 100
+
+# Old changes are removed every time this number of changes is logged
+CHANGES_PRUNE_EVERY = 1000
+
+# Fields the products lists are sorted by (see `filters.get_products_ordering` and `pagination.get_sort_key`)
+SORT_FIELDS = ('name', 'price', 'order')
+
+logger = logging.getLogger(__name__)
+
+
+def to_bitmap(positions):
+    """
+    Packs bit positions into an int.
+    """
+    positions = list(positions)
+    if not positions:
+        return 0
+    bits = bytearray(max(positions) // 8 + 1)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bytes(bits), 'little')
+
+
+def iter_positions(bitmap):
+    """
+    Yields positions of the set bits in ascending order.
+    """
+    for index, byte in enumerate(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')):
+        while byte:
+            lowest = byte & -byte
+            yield (index << 3) + lowest.bit_length() - 1
+            byte ^= lowest
+
+
+def count_bits(bitmap):
+    return bin(bitmap).count('1')
+
+
+def log_products_changes(products_ids=None):
+    """
+    Logs changes of the products for the facet indexes of all the workers.
+    Without products the indexes are rebuilt.
+    """
+    if products_ids is None:
+        changes = [ProductChange()]
+    else:
+        changes = [ProductChange(product_id=product_id) for product_id in products_ids]
+    changes = ProductChange.objects.bulk_create(changes)
+    if any(change.id % CHANGES_PRUNE_EVERY == 0 for change in changes):
+        ProductChange.objects.filter(created__lt=timezone.now() - CHANGES_RETENTION).delete()
+
+
+def get_catalog_version():
+    """
+    Returns the id of the last logged change of the products.
+    """
+    return ProductChange.objects.aggregate(version=Max('id'))['version'] or 0
+
+
+class FacetIndex(object):
+    """
+    In-memory index of the catalog for product lists and filters.
+
+    Every product gets a bit position. Sets of products are bitmaps (packed into ints) keyed by:
+    - `('active',)`, `('kind', kind)`, `('in_stock',)` and `('new',)` - fields of the products;
+    - `('category', id)` - products of the category or having a parent of the category;
+    - `('brand', id)` - products of the brand;
+    - `('property', id)` - products having a value (even empty) of the property;
+    - `('set', id)` - products having a non-empty value of the property;
+    - `('value', id, value)` - products having the value of a text or boolean property.
+    Values of integer and float properties and creation dates of the products with calculated novelty
+    are kept in sorted lists of `(value, position)` for range queries. Products are sorted by the values
+    of `SORT_FIELDS` kept by position.
+
+    Property values are the own values of the products, as the documents of the listed
+    (unique and parent) products are.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.refreshed = None
+        self.seen = set()
+        self.ids = []
+        self.positions = {}
+        self.bitmaps = {}
+        self.numbers = {}
+        self.created = []
+        self.sort_values = {}
+        self.memberships = {}
+        self.properties = {}
+        self.texts = {}
+
+    def build(self):
+        """
+        Loads the whole catalog.
+        """
+        self.__init__()
+        self.version = get_catalog_version()
+        self.seen = set(ProductChange.objects.filter(id__gt=self.version - CHANGES_LOOKBACK).values_list('id', flat=True))
+        self.properties = {prop.slug: prop for prop in ProductProperty.objects.only('id', 'slug', 'type')}
+        self._load(Product.objects.all())
+        self.refreshed = timezone.now()
+
+    def copy(self):
+        """
+        Returns a copy of the index which can be refreshed while this one is in use.
+        """
+        index = copy.copy(self)
+        index.seen = set(self.seen)
+        index.ids = list(self.ids)
+        index.positions = dict(self.positions)
+        index.bitmaps = dict(self.bitmaps)
+        index.numbers = {prop_id: list(values) for prop_id, values in self.numbers.items()}
+        index.created = list(self.created)
+        index.sort_values = dict(self.sort_values)
+        index.memberships = dict(self.memberships)
+        index.texts = {prop_id: set(values) for prop_id, values in self.texts.items()}
+        return index
+
+    def is_expired(self):
+        """
+        Whether the index is to be rebuilt as the changes it could miss are removed from the log.
+        """
+        return self.refreshed is None or timezone.now() - self.refreshed > CHANGES_RETENTION / 2
+
+    def is_stale(self):
+        """
+        Whether there are changes of the products not loaded into the index yet.
+        """
+        return not self.seen.issuperset(ProductChange.objects.filter(
+            id__gt=self.version - CHANGES_LOOKBACK
+        ).values_list('id', flat=True))
+
+    def refresh(self):
+        """
+        Reloads the products changed since the last refresh.
+        """
+        now = timezone.now()
+        if self.is_expired():
+            return self.build()
+
+        changes = list(ProductChange.objects.filter(
+            id__gt=self.version - CHANGES_LOOKBACK
+        ).values_list('id', 'product_id'))
+        self.refreshed = now
+        unseen = [(change_id, product_id) for change_id, product_id in changes if change_id not in self.seen]
+        if not unseen:
+            return
+        if any(product_id is None for _, product_id in unseen):
+            return self.build()
+
+        products_ids = {product_id for _, product_id in unseen}
+        self._load(Product.objects.filter(Q(id__in=products_ids) | Q(parent_id__in=products_ids)), products_ids)
+        self.version = max(self.version, max(change_id for change_id, _ in unseen))
+        self.seen = {change_id for change_id, _ in changes if change_id > self.version - CHANGES_LOOKBACK}
+
+    def _remove(self, product_id):
+        position = self.positions.get(product_id)
+        if position is None or position not in self.memberships:
+            return
+        keys, numbers, created = self.memberships.pop(position)
+        mask = ~(1 << position)
+        for key in keys:
+            self.bitmaps[key] &= mask
+        for prop_id, value in numbers:
+            values = self.numbers[prop_id]
+            del values[bisect_left(values, (value, position))]
+        if created is not None:
+            del self.created[bisect_left(self.created, (created, position))]
+
+    def _load(self, queryset, removed_ids=()):
+        """
+        Loads the products of the queryset replacing their previous state.
+        """
+        products = list(queryset.values_list(
+            'id', 'parent_id', 'kind', 'activity', 'in_stock', 'is_new', 'created', 'brand_id', *SORT_FIELDS
+        ))
+        products_ids = [product[0] for product in products]
+        for product_id in set(removed_ids) | set(products_ids):
+            self._remove(product_id)
+
+        categories = {}
+        for product_id, category_id in Product.categories.through.objects.filter(
+                product_id__in={product_id for product in products for product_id in product[:2] if product_id}
+        ).values_list('product_id', 'category_id'):
+            categories.setdefault(product_id, []).append(category_id)
+
+        memberships = {}
+        for product_id, parent_id, kind, activity, in_stock, is_new, created, brand_id, *sort_values in products:
+            position = self.positions.get(product_id)
+            if position is None:
+                position = self.positions[product_id] = len(self.ids)
+                self.ids.append(product_id)
+            self.sort_values[position] = dict(zip(SORT_FIELDS, sort_values))
+
+            keys = [('kind', kind)]
+            keys.extend(('category', category_id) for category_id in set(
+                categories.get(product_id, []) + categories.get(parent_id, [])
+            ))
+            if activity:
+                keys.append(('active',))
+            if in_stock and in_stock > 0:
+                keys.append(('in_stock',))
+            if is_new == Product.NEW:
+                keys.append(('new',))
+            if brand_id:
+                keys.append(('brand', brand_id))
+            memberships[position] = (keys, [], created if is_new == Product.CALCULATED else None)
+
+        types = {prop.id: prop.type for prop in self.properties.values()}
+        for product_id, prop_id, *values in ProductPropertyValue.objects.filter(
+                product_id__in=products_ids).values_list('product_id', 'prop_id', 'value_text', 'value_integer',
+                                                          'value_boolean', 'value_float'):
+            if prop_id not in types:
+                continue
+            keys, numbers, _ = memberships[self.positions[product_id]]
+            keys.append(('property', prop_id))
+            value = dict(zip((ProductProperty.TEXT, ProductProperty.INTEGER, ProductProperty.BOOLEAN,
+                              ProductProperty.FLOAT), values))[types[prop_id]]
+            if value is None:
+                continue
+            keys.append(('set', prop_id))
+            if types[prop_id] in (ProductProperty.INTEGER, ProductProperty.FLOAT):
+                numbers.append((prop_id, value))
+            else:
+                keys.append(('value', prop_id, value))
+                if types[prop_id] == ProductProperty.TEXT:
+                    self.texts.setdefault(prop_id, set()).add(value)
+
+        keys_positions = {}
+        numbers = {}
+        created = []
+        for position, (keys, product_numbers, product_created) in memberships.items():
+            for key in keys:
+                keys_positions.setdefault(key, []).append(position)
+            for prop_id, value in product_numbers:
+                numbers.setdefault(prop_id, []).append((value, position))
+            if product_created is not None:
+                created.append((product_created, position))
+        for key, positions in keys_positions.items():
+            self.bitmaps[key] = self.bitmaps.get(key, 0) | to_bitmap(positions)
+        for prop_id, values in numbers.items():
+            self.numbers.setdefault(prop_id, []).extend(values)
+            self.numbers[prop_id].sort()
+        self.created.extend(created)
+        self.created.sort()
+        self.memberships.update(memberships)
+
+    def get_bitmap(self, key):
+        return self.bitmaps.get(key, 0)
+
+    def get_union(self, keys):
+        bitmap = 0
+        for key in keys:
+            bitmap |= self.get_bitmap(key)
+        return bitmap
+
+    def get_range(self, prop_id, min_value, max_value):
+        values = self.numbers.get(prop_id, [])
+        start = bisect_left(values, (min_value, -1))
+        end = bisect_right(values, (max_value, float('inf')))
+        return to_bitmap(position for _, position in values[start:end])
+
+    def get_products_bitmap(self, kinds, categories_ids=None, brands_ids=None, new=False):
+        """
+        Returns active products of given kinds which belong to any of the categories,
+        any of the brands and are new (if given).
+        """
+        bitmap = self.get_bitmap(('active',)) & self.get_union(('kind', kind) for kind in kinds)
+        if categories_ids is not None:
+            bitmap &= self.get_union(('category', category_id) for category_id in categories_ids)
+        if brands_ids is not None:
+            bitmap &= self.get_union(('brand', brand_id) for brand_id in brands_ids)
+        if new:
+            start = bisect_left(self.created, (timezone.now() - NEW_PRODUCT_PERIOD, -1))
+            bitmap &= self.get_bitmap(('new',)) | to_bitmap(position for _, position in self.created[start:])
+        return bitmap
+
+    def filter_bitmap(self, bitmap, query_params):
+        """
+        Applies stock and property filters of the query params (see `filters.get_properties_filter`).
+        """
+        if query_params.get('in_stock'):
+            bitmap &= self.get_bitmap(('in_stock',))
+        for key in query_params:
+            if key in RESERVED_PARAMS or key.count('_') != 1:
+                continue
+            prop_slug, prop_type = key.split('_')
+            value = query_params.get(key)
+            prop = self.properties.get(prop_slug)
+
+            if prop_type == 'b' and value == 'true':
+                bitmap &= self.get_bitmap(('value', prop.id, True)) if prop else 0
+
+            if prop_type == 't':
+                bitmap &= self.get_union(
+                    ('value', prop.id, text_value) for text_value in value.split(TEXT_VALUES_SEPARATOR)
+                ) if prop else 0
+
+            if prop_type == 'd':
+                min_value, max_value = parse_range(key, value)
+                prop_bitmap = self.get_range(prop.id, min_value, max_value) if prop else 0
+                if min_value <= 0 <= max_value:
+                    prop_bitmap |= ~self.get_bitmap(('set', prop.id)) if prop else -1
+                bitmap &= prop_bitmap
+        return bitmap
+
+    def get_products_ids(self, bitmap):
+        return [self.ids[position] for position in iter_positions(bitmap)]
+
+    def get_products(self, bitmap, query_params):
+        """
+        Returns the products filtered by the query params sorted in the index (see `IndexedProducts`).
+        """
+        bitmap = self.filter_bitmap(bitmap, query_params)
+        start = bisect_left(self.created, (timezone.now() - NEW_PRODUCT_PERIOD, -1))
+        new_count = count_bits(bitmap & to_bitmap(position for _, position in self.created[start:]))
+        products = [(self.ids[position], self.sort_values[position]) for position in iter_positions(bitmap)]
+        return IndexedProducts(products, get_products_ordering(query_params), new_count)
+
+    def get_properties_ids(self, bitmap):
+        return [prop.id for prop in self.properties.values() if self.get_bitmap(('property', prop.id)) & bitmap]
+
+    def get_facets(self, bitmap):
+        """
+        Same as `facets.get_products_facets` for the products of the bitmap.
+        """
+        facets = {}
+        positions = None
+        for prop in self.properties.values():
+            if not self.get_bitmap(('property', prop.id)) & bitmap:
+                continue
+            if prop.type in (ProductProperty.INTEGER, ProductProperty.FLOAT):
+                if positions is None:
+                    positions = set(iter_positions(bitmap))
+                values = [value for value, position in self.numbers.get(prop.id, []) if position in positions]
+                facets[prop.id] = {'min': values[0] if values else None, 'max': values[-1] if values else None}
+            if prop.type == ProductProperty.TEXT:
+                counts = {}
+                for text_value in self.texts.get(prop.id, ()):
+                    products_count = count_bits(self.get_bitmap(('value', prop.id, text_value)) & bitmap)
+                    if products_count:
+                        counts[text_value] = products_count
+                if counts:
+                    facets[prop.id] = {'options': sorted(counts), 'counts': counts}
+        return facets
+
+
+class IndexedProducts(object):
+    """
+    Products of the facet index sorted in memory, only the products of the requested slice or page
+    are fetched from the database. Sliced by the page number pagination and paged by `get_cursor_page`
+    by the keyset one (see `pagination.CatalogPagination`).
+
+    Sorted as `filters.get_products_ordering` sorts in the database (NULLs last in ascending order),
+    the names are compared by code points rather than by the database collation.
+    """
+
+    def __init__(self, products, ordering, new_count):
+        self.products = products
+        self.ordered = sort_products(products, ordering)
+        self.new_count = new_count
+
+    def count(self):
+        return len(self.ordered)
+
+    def __len__(self):
+        return len(self.ordered)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.fetch(self.ordered[item])
+        return self.fetch([self.ordered[item]])[0]
+
+    def fetch(self, products_ids):
+        products = {product.id: product for product in prefetch_products_listing(
+            Product.objects.filter(id__in=products_ids)
+        )}
+        return [products[product_id] for product_id in products_ids if product_id in products]
+
+    def get_cursor_page(self, field, descending, cursor, size):
+        """
+        Returns `size` products following the cursor (the field value and the id of the last product
+        of the previous page) sorted by the field and the id, the products without the value go last.
+        """
+        products = [(values[field], product_id) for product_id, values in self.products]
+        ordered = sorted(key for key in products if key[0] is not None)
+        if descending:
+            ordered.reverse()
+        nulls = sorted(key for key in products if key[0] is None)
+        if descending:
+            nulls.reverse()
+
+        if cursor is not None:
+            value, product_id = cursor
+            if value is None:
+                ordered = []
+                nulls = [key for key in nulls if (key[1] < product_id if descending else key[1] > product_id)]
+            else:
+                value = Product._meta.get_field(field).to_python(value)
+                ordered = [key for key in ordered if (key < (value, product_id) if descending else
+                                                      key > (value, product_id))]
+        return self.fetch([product_id for _, product_id in (ordered + nulls)[:size]])
+
+    def get_validator_values(self):
+        """
+        Same as the aggregates of `views.ProductListResponseMixin`, the rest of the products
+        are validated by the version of the catalog.
+        """
+        return {'count': len(self.ordered), 'new': self.new_count}
+
+
+def sort_products(products, ordering):
+    """
+    Returns the ids of the `(id, sort values)` products sorted by the fields of the ordering.
+    """
+    products = sorted(products, key=lambda product: product[0])
+    for field in reversed(ordering):
+        descending = field.startswith('-')
+        field = field.lstrip('-')
+
+        def get_key(product):
+            value = product[1][field]
+            return value is None, value if value is not None else 0
+
+        # Stable sorts, reversed ones keep the order of the equal products as well
+        products.sort(key=get_key, reverse=descending)
+    return [product_id for product_id, _ in products]
+
+
+_index = None
+_index_lock = threading.Lock()
+_index_updating = False
+
+
+def _update_index():
+    """
+    Builds the index of the worker or refreshes a copy of it, then swaps the new one in.
+    """
+    global _index, _index_updating
+
+    try:
+        index = _index
+        if index is None:
+            index = FacetIndex()
+            index.build()
+        else:
+            index = index.copy()
+            index.refresh()
+        with _index_lock:
+            _index = index
+    except Exception:
+        logger.exception('Facet index update failed')
+    finally:
+        connection.close()
+        with _index_lock:
+            _index_updating = False
+
+
+def start_index_update():
+    """
+    Starts the update of the worker's index in a background thread, unless it is already running.
+    """
+    global _index_updating
+
+    with _index_lock:
+        if _index_updating:
+            return
+        _index_updating = True
+    threading.Thread(target=_update_index, name='facet-index', daemon=True).start()
+
+
+@contextmanager
+def use_facet_index():
+    """
+    Yields the facet index of the worker or None if the index is disabled, is not built yet or misses
+    some changes of the products, the products are read from the database then. The index is built
+    and refreshed in background (see `start_index_update`), the requests never wait for it.
+    """
+    if not settings.PRODUCTS_FACET_INDEX:
+        yield None
+        return
+
+    with _index_lock:
+        index = _index
+    if index is None:
+        start_index_update()
+        yield None
+        return
+
+    stale = index.is_stale()
+    if stale or index.is_expired():
+        start_index_update()
+    yield None if stale else index
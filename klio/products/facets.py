@@ -0,0 +1,39 @@
+from django.db.models import Count, Max, Min
+
+from .models import ProductProperty, ProductPropertyValue
+
+
+def get_products_facets(products_ids):
+    """
+    Collects filter data of all the properties of given products in two grouped queries.
+
+    Returns a dict keyed by property id:
+    - `min` and `max` - for integer and float properties;
+    - `options` - ordered distinct values of text properties and `counts` - number of products per value.
+    """
+    facets = {}
+    values = ProductPropertyValue.objects.filter(product__in=products_ids).order_by()
+
+    numeric = values.filter(
+        prop__type__in=[ProductProperty.INTEGER, ProductProperty.FLOAT]
+    ).values('prop_id', 'prop__type').annotate(
+        min_integer=Min('value_integer'), max_integer=Max('value_integer'),
+        min_float=Min('value_float'), max_float=Max('value_float'),
+    )
+    for row in numeric:
+        facets[row['prop_id']] = {
+            'min': row['min_%s' % row['prop__type']],
+            'max': row['max_%s' % row['prop__type']],
+        }
+
+    text = values.filter(
+        prop__type=ProductProperty.TEXT, value_text__isnull=False
+    ).values('prop_id', 'value_text').annotate(
+        products_count=Count('product_id', distinct=True)
+    ).order_by('prop_id', 'value_text')
+    for row in text:
+        facet = facets.setdefault(row['prop_id'], {'options': [], 'counts': {}})
+        facet['options'].append(row['value_text'])
+        facet['counts'][row['value_text']] = row['products_count']
+
+    return facets
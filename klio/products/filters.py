@@ -0,0 +1,84 @@
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework.exceptions import ValidationError
+
+# Query params of the product lists which are not property filters
+RESERVED_PARAMS = ('sortby', 'direction', 'size', 'page', 'in_stock')
+
+TEXT_VALUES_SEPARATOR = '|;|'
+
+
+def parse_range(key, value):
+    """
+    Parses `min,max` range of a digit property filter.
+    """
+    try:
+        min_value, max_value = [float(v) for v in value.split(',')]
+    except ValueError:
+        raise ValidationError({key: _('Range should be provided in the format min,max.')})
+    return min_value, max_value
+
+
+def get_properties_filter(query_params):
+    """
+    Compiles property filters of the query params into a single condition on
+    the products properties document (see `Product.properties_document`).
+
+    Filters are passed as `<property slug>_<type>=<value>`:
+    - `_b` - boolean property, only `true` value filters the products;
+    - `_t` - text property, choices are separated by `|;|`;
+    - `_d` - integer or float property, value is a `min,max` range. Products without
+      a value of the property are treated as having 0.
+    """
+    condition = Q()
+    for key in query_params:
+        if key in RESERVED_PARAMS or key.count('_') != 1:
+            continue
+        prop_slug, prop_type = key.split('_')
+        value = query_params.get(key)
+
+        if prop_type == 'b' and value == 'true':
+            condition &= Q(properties_document__contains={prop_slug: True})
+
+        if prop_type == 't':
+            prop_condition = Q()
+            for text_value in value.split(TEXT_VALUES_SEPARATOR):
+                prop_condition |= Q(properties_document__contains={prop_slug: text_value})
+            condition &= prop_condition
+
+        if prop_type == 'd':
+            min_value, max_value = parse_range(key, value)
+            field = 'properties_document__%s' % prop_slug
+            prop_condition = Q(**{field + '__gte': min_value, field + '__lte': max_value})
+            if min_value <= 0 <= max_value:
+                prop_condition |= ~Q(properties_document__has_key=prop_slug)
+            condition &= prop_condition
+    return condition
+
+
+def get_products_ordering(query_params):
+    sort_by = query_params.get('sortby')
+    direction = query_params.get('direction')
+    ordering = []
+    if sort_by == 'name':
+        if direction == 'asc':
+            ordering.append('name')
+        if direction == 'desc':
+            ordering.append('-name')
+    if sort_by == 'price':
+        if direction == 'desc':
+            ordering.append('-price')
+        else:
+            ordering.append('price')
+    ordering.append('order')
+    return ordering
+
+
+def filter_products(queryset, query_params):
+    """
+    Applies stock, property filters and sorting of the query params to the products queryset.
+    """
+    if query_params.get('in_stock'):
+        queryset = queryset.filter(in_stock__gt=0)
+    return queryset.filter(get_properties_filter(query_params)).order_by(*get_products_ordering(query_params))
@@ -0,0 +1,178 @@
+import logging
+
+from django.db import transaction
+from django.db.models import Prefetch, Q, prefetch_related_objects
+from django.utils.timezone import timedelta
+
+from sale.utils import SpecialPriceResolver
+from .models import Category, Product, ProductImage, ProductListing
+from .utils import schedule_update
+
+# Products are valued as new for this period if their novelty is calculated
+NEW_PRODUCT_PERIOD = timedelta(days=60)
+
+# Relations of the listing read by the product list serializer
+LISTING_RELATED = ('listing__units', 'listing__image')
+
+# Relations the listing values are calculated from
+SOURCE_RELATED = ('parent', 'units', 'brand')
+
+CHUNK_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def get_source_prefetches():
+    """
+    Returns prefetches of the data the listing values are calculated from:
+    - `active_categories` - active categories of the product and of its parent;
+    - `listing_images` - images of the product, the first one is shown in the list.
+    """
+    active_categories = Category.objects.filter(activity=True)
+    return [
+        Prefetch('categories', queryset=active_categories, to_attr='active_categories'),
+        Prefetch('parent__categories', queryset=active_categories, to_attr='active_categories'),
+        Prefetch('images', queryset=ProductImage.objects.order_by('-activity', 'order', 'id'),
+                 to_attr='listing_images'),
+    ]
+
+
+def calculate_products_listings(queryset):
+    """
+    Calculates (without saving) listings of the products of the queryset.
+    """
+    products = list(queryset.select_related(*SOURCE_RELATED).prefetch_related(*get_source_prefetches()))
+    resolver = SpecialPriceResolver()
+    resolver.prepare(products)
+
+    listings = []
+    for product in products:
+        owner = product.parent if product.is_child else product
+        special = resolver.resolve(product) or {}
+        listings.append(ProductListing(
+            product=product,
+            brand=product.get_brand(),
+            units=product.get_units(),
+            base_amount=product.get_base_amount(),
+            category_slug=owner.active_categories[0].slug if owner.active_categories else '',
+            image=product.listing_images[0] if product.listing_images else None,
+            is_new=product.is_new == Product.NEW,
+            new_until=product.created + NEW_PRODUCT_PERIOD if product.is_new == Product.CALCULATED else None,
+            special_slug=special.get('slug', ''),
+            special_threshold=special.get('threshold'),
+            special_price=special.get('new_price'),
+        ))
+    return listings
+
+
+def save_products_listings(listings):
+    with transaction.atomic():
+        ProductListing.objects.filter(product_id__in=[listing.product_id for listing in listings]).delete()
+        return ProductListing.objects.bulk_create(listings)
+
+
+def update_products_listings(products_ids):
+    """
+    Recalculates listings of the products and of their children.
+    """
+    return save_products_listings(calculate_products_listings(
+        Product.objects.filter(Q(id__in=products_ids) | Q(parent_id__in=products_ids))
+    ))
+
+
+def schedule_products_listings_update(products_ids):
+    """
+    Updates listings of the products when the current transaction is committed.
+    """
+    schedule_update(update_products_listings, products_ids)
+
+
+def schedule_listings_specials_refresh(products_ids):
+    """
+    Refreshes specials of the listings of the products and of their children when the current transaction is committed.
+    """
+    schedule_update(refresh_listings_specials, products_ids)
+
+
+def rebuild_products_listings(chunk_size=CHUNK_SIZE):
+    """
+    Recalculates listings of all the products chunk by chunk. Returns the number of listings.
+    """
+    count = 0
+    last_id = 0
+    while True:
+        products_ids = list(Product.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not products_ids:
+            return count
+        count += len(save_products_listings(calculate_products_listings(Product.objects.filter(id__in=products_ids))))
+        last_id = products_ids[-1]
+
+
+def refresh_listings_specials(products_ids=None, chunk_size=CHUNK_SIZE):
+    """
+    Recalculates specials of the listings of the products and of their children (of all the listings
+    if no ids are given), saves only the changed ones.
+    """
+    resolver = SpecialPriceResolver()
+    queryset = ProductListing.objects.all()
+    if products_ids is not None:
+        products_ids = list(products_ids)
+        queryset = queryset.filter(Q(product_id__in=products_ids) | Q(product__parent_id__in=products_ids))
+    last_id = 0
+    while True:
+        listings = list(queryset.filter(
+            product_id__gt=last_id
+        ).select_related('product').order_by('product_id')[:chunk_size])
+        if not listings:
+            return
+        resolver.prepare([listing.product for listing in listings])
+
+        changed = []
+        for listing in listings:
+            special = resolver.resolve(listing.product) or {}
+            values = (special.get('slug', ''), special.get('threshold'), special.get('new_price'))
+            if values != (listing.special_slug, listing.special_threshold,
+                          None if listing.special_price is None else str(listing.special_price)):
+                listing.special_slug, listing.special_threshold, listing.special_price = values
+                changed.append(listing)
+        ProductListing.objects.bulk_update(changed, ['special_slug', 'special_threshold', 'special_price'])
+        last_id = listings[-1].product_id
+
+
+def get_listing_prefetches(with_children=True):
+    """
+    Returns prefetches of the child products (`listing_children`) with their listings.
+    Children of the child products are never listed.
+    """
+    children = Product.objects.none()
+    if with_children:
+        children = Product.objects.order_by('-activity', 'product_type', 'order', 'id').select_related(
+            *LISTING_RELATED
+        ).prefetch_related(
+            *get_listing_prefetches(with_children=False)
+        )
+    return [Prefetch('children', queryset=children, to_attr='listing_children')]
+
+
+def prefetch_products_listing(queryset):
+    """
+    Adds everything the product list serializer needs to the products queryset,
+    so a page of products costs the same number of queries whatever its size.
+    """
+    return queryset.select_related(*LISTING_RELATED).prefetch_related(*get_listing_prefetches())
+
+
+def prefetch_products_listing_objects(products):
+    """
+    Same as `prefetch_products_listing` for already fetched products. Listings are saved by the signals,
+    by the migration and by `rebuild_product_listings`, a missing one is calculated for the response only
+    and never saved by the request.
+    """
+    prefetch_related_objects([product for product in products if not hasattr(product, 'listing_children')],
+                             *LISTING_RELATED, *get_listing_prefetches())
+    products = products + [child for product in products for child in product.listing_children]
+    missing = {product.id: product for product in products if not hasattr(product, 'listing')}
+    if missing:
+        logger.warning('Listings of the products %s are missing, run rebuild_product_listings', sorted(missing))
+        for listing in calculate_products_listings(Product.objects.filter(id__in=list(missing))):
+            missing[listing.product_id].listing = listing
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products.listing import CHUNK_SIZE, rebuild_products_listings
+
+
+class Command(BaseCommand):
+    help = 'Recalculates listings of all the products.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Number of products per transaction.')
+
+    def handle(self, *args, **options):
+        count = rebuild_products_listings(chunk_size=options['chunk_size'])
+        self.stdout.write('Rebuilt {0} product listings.'.format(count))
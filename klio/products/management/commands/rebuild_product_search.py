@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products.search import CHUNK_SIZE, rebuild_products_search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds search documents of all the products.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Number of products per statement.')
+
+    def handle(self, *args, **options):
+        count = rebuild_products_search(chunk_size=options['chunk_size'])
+        self.stdout.write('Rebuilt {0} product search documents.'.format(count))
@@ -0,0 +1,43 @@
+# Generated by Django 2.2.7 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_category_closure(apps, schema_editor):
+    Category = apps.get_model('products', 'Category')
+    CategoryClosure = apps.get_model('products', 'CategoryClosure')
+
+    parents = dict(Category.objects.values_list('id', 'parent_id'))
+    links = []
+    for category_id in parents:
+        ancestor_id, depth = category_id, 0
+        while ancestor_id is not None and depth <= len(parents):
+            links.append(CategoryClosure(ancestor_id=ancestor_id, descendant_id=category_id, depth=depth))
+            ancestor_id, depth = parents[ancestor_id], depth + 1
+    CategoryClosure.objects.bulk_create(links, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0053_auto_20200825_1002'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField(default=0, verbose_name='depth')),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='products.Category', verbose_name='ancestor')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='products.Category', verbose_name='descendant')),
+            ],
+            options={
+                'verbose_name': 'Category closure',
+                'verbose_name_plural': 'Category closures',
+                'unique_together': {('ancestor', 'descendant')},
+            },
+        ),
+        migrations.RunPython(fill_category_closure, migrations.RunPython.noop),
+    ]
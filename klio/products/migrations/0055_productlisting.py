@@ -0,0 +1,34 @@
+# Generated by Django 2.2.7 on 2026-10-18 09:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0054_categoryclosure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductListing',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listing', serialize=False, to='products.Product', verbose_name='product')),
+                ('base_amount', models.DecimalField(blank=True, decimal_places=4, max_digits=10, null=True, verbose_name='base amount')),
+                ('category_slug', models.SlugField(blank=True, max_length=128, verbose_name='category slug')),
+                ('is_new', models.BooleanField(default=False, verbose_name='is new')),
+                ('new_until', models.DateTimeField(blank=True, help_text='Calculated novelty ends at this date.', null=True, verbose_name='new until')),
+                ('special_slug', models.SlugField(blank=True, max_length=128, verbose_name='special slug')),
+                ('special_threshold', models.IntegerField(blank=True, null=True, verbose_name='special threshold')),
+                ('special_price', models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True, verbose_name='special price')),
+                ('brand', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.Brand', verbose_name='brand')),
+                ('image', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.ProductImage', verbose_name='image')),
+                ('units', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.Unit', verbose_name='units')),
+            ],
+            options={
+                'verbose_name': 'Product listing',
+                'verbose_name_plural': 'Product listings',
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 2.2.7 on 2026-10-18 09:24
+
+import django.contrib.postgres.fields.jsonb
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+def fill_properties_documents(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductPropertyValue = apps.get_model('products', 'ProductPropertyValue')
+
+    documents = {}
+    for value in ProductPropertyValue.objects.select_related('prop').iterator():
+        prop_value = getattr(value, 'value_%s' % value.prop.type)
+        if prop_value is not None:
+            documents.setdefault(value.product_id, {})[value.prop.slug] = prop_value
+
+    products = list(Product.objects.only('id', 'parent_id'))
+    for product in products:
+        product.properties_document = {**documents.get(product.parent_id, {}), **documents.get(product.id, {})}
+    Product.objects.bulk_update(products, ['properties_document'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0055_productlisting'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='properties_document',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict, editable=False, verbose_name='properties document'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['properties_document'], name='products_pr_propert_93b9fb_gin'),
+        ),
+        migrations.RunPython(fill_properties_documents, migrations.RunPython.noop),
+    ]
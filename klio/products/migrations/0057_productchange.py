@@ -0,0 +1,25 @@
+# Generated by Django 2.2.7 on 2026-10-18 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0056_product_properties_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.PositiveIntegerField(blank=True, null=True, verbose_name='product id')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='created')),
+            ],
+            options={
+                'verbose_name': 'Product change',
+                'verbose_name_plural': 'Product changes',
+            },
+        ),
+    ]
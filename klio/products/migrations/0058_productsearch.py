@@ -0,0 +1,72 @@
+# Generated by Django 2.2.7 on 2026-10-18 10:00
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Search documents of the existing products, same as `products.search.UPDATE_SEARCH_SQL`
+BUILD_SEARCH_SQL = '''
+INSERT INTO products_productsearch (product_id, name, art, tags, brand, categories, document)
+SELECT product.id, product.name, product.art, product.tags, product.brand, product.categories,
+       setweight(to_tsvector('russian', product.name), 'A') ||
+       setweight(to_tsvector('simple', product.art), 'A') ||
+       setweight(to_tsvector('russian', product.tags), 'B') ||
+       setweight(to_tsvector('russian', product.brand), 'B') ||
+       setweight(to_tsvector('russian', product.categories), 'C')
+FROM (
+    SELECT p.id, p.name, COALESCE(p.art::text, '') AS art,
+           (SELECT COALESCE(string_agg(DISTINCT t.name, ' '), '')
+            FROM products_product_tags pt JOIN tags_tag t ON t.id = pt.tag_id
+            WHERE pt.product_id = p.id OR pt.product_id = p.parent_id) AS tags,
+           COALESCE(b.name, '') AS brand,
+           (SELECT COALESCE(string_agg(DISTINCT c.name, ' '), '')
+            FROM products_product_categories pc
+            JOIN products_categoryclosure cc ON cc.descendant_id = pc.category_id
+            JOIN products_category c ON c.id = cc.ancestor_id
+            WHERE pc.product_id = p.id OR pc.product_id = p.parent_id) AS categories
+    FROM products_product p
+    LEFT JOIN products_product parent ON parent.id = p.parent_id
+    LEFT JOIN products_brand b ON b.id = CASE WHEN p.kind = 'child' THEN parent.brand_id ELSE p.brand_id END
+) product
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('general', '0029_trgm_postgres_create_extension'),
+        ('products', '0057_productchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearch',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search', serialize=False, to='products.Product', verbose_name='product')),
+                ('name', models.CharField(max_length=128, verbose_name='name')),
+                ('art', models.CharField(blank=True, max_length=16, verbose_name='vendor code')),
+                ('tags', models.TextField(blank=True, verbose_name='tags')),
+                ('brand', models.CharField(blank=True, max_length=64, verbose_name='brand')),
+                ('categories', models.TextField(blank=True, verbose_name='categories')),
+                ('document', django.contrib.postgres.search.SearchVectorField(null=True, verbose_name='document')),
+            ],
+            options={
+                'verbose_name': 'Product search document',
+                'verbose_name_plural': 'Product search documents',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='productsearch',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['document'], name='products_search_document_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productsearch',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='products_search_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='productsearch',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['art'], name='products_search_art_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.RunSQL(BUILD_SEARCH_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.7 on 2026-10-18 14:20
+
+from django.db import migrations
+
+CHUNK_SIZE = 1000
+
+
+def fill_missing_listings(apps, schema_editor):
+    # Listings are calculated by the same code as in the signals and in `rebuild_product_listings`
+    from products.listing import update_products_listings
+
+    Product = apps.get_model('products', 'Product')
+    products_ids = list(Product.objects.filter(listing__isnull=True).order_by('id').values_list('id', flat=True))
+    for start in range(0, len(products_ids), CHUNK_SIZE):
+        update_products_listings(products_ids[start:start + CHUNK_SIZE])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0058_productsearch'),
+        ('sale', '0022_auto_20200428_1801'),
+        ('tags', '0003_auto_20200325_0246'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_missing_listings, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,11 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from cities_light.models import City
@@ -74,10 +79,79 @@ class Category(models.Model):
 
         if self.pk and not self.parent:
             self.group = self.pk
-            return super(Category, self).save(*args, **kwargs)
+        else:
+            self.group = self.parent.group
+        super(Category, self).save(*args, **kwargs)
+        self._save_closure()
 
-        self.group = self.parent.group
-        return super(Category, self).save(*args, **kwargs)
+    def clean(self):
+        if self.pk and self.parent_id and CategoryClosure.objects.filter(
+                ancestor_id=self.pk, descendant_id=self.parent_id).exists():
+            raise ValidationError(_('Category can not be nested into itself or its subcategories.'))
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Category, cls).from_db(db, field_names, values)
+        instance._loaded_parent_id = instance.__dict__.get('parent_id')
+        return instance
+
+    def _save_closure(self):
+        """
+        Attaches the category (with its whole subtree) to the closure of its current parent.
+        Called after every save, does nothing unless the category is new or has been moved.
+        """
+        if getattr(self, '_loaded_parent_id', None) == self.parent_id and \
+                CategoryClosure.objects.filter(ancestor_id=self.pk, descendant_id=self.pk).exists():
+            return
+
+        with transaction.atomic():
+            subtree = dict(CategoryClosure.objects.filter(ancestor_id=self.pk).values_list('descendant_id', 'depth'))
+            if not subtree:
+                CategoryClosure.objects.create(ancestor_id=self.pk, descendant_id=self.pk, depth=0)
+                subtree = {self.pk: 0}
+
+            # Detach the subtree from the old ancestors
+            CategoryClosure.objects.filter(descendant_id__in=subtree).exclude(ancestor_id__in=subtree).delete()
+
+            # And attach it to the new ones
+            if self.parent_id:
+                ancestors = CategoryClosure.objects.filter(descendant_id=self.parent_id).values_list('ancestor_id', 'depth')
+                CategoryClosure.objects.bulk_create([
+                    CategoryClosure(ancestor_id=ancestor_id, descendant_id=descendant_id,
+                                    depth=ancestor_depth + 1 + descendant_depth)
+                    for ancestor_id, ancestor_depth in ancestors
+                    for descendant_id, descendant_depth in subtree.items()
+                ])
+        self._loaded_parent_id = self.parent_id
+
+    @classmethod
+    def get_active_descendants_ids(cls, slug):
+        """
+        Ids of the active category with given slug and all its subcategories which
+        can be reached through active categories only.
+        """
+        inactive_on_path = CategoryClosure.objects.filter(
+            descendant_id=OuterRef('descendant_id'), depth__lte=OuterRef('depth'), ancestor__activity=False
+        )
+        return CategoryClosure.objects.filter(
+            ancestor__slug=slug
+        ).annotate(
+            inactive_on_path=Exists(inactive_on_path)
+        ).filter(
+            inactive_on_path=False
+        ).values_list('descendant_id', flat=True)
+
+    @classmethod
+    def get_active_leaves_ids(cls):
+        """
+        Ids of the categories without subcategories which have only active parents and are active themselves.
+        """
+        return cls.objects.annotate(
+            inactive_on_path=Exists(CategoryClosure.objects.filter(descendant_id=OuterRef('pk'), ancestor__activity=False)),
+            has_children=Exists(cls.objects.filter(parent_id=OuterRef('pk')))
+        ).filter(
+            inactive_on_path=False, has_children=False
+        ).order_by().values_list('id', flat=True)
 
     def __str__(self):
         full_name = self.name
@@ -101,6 +175,38 @@ class Category(models.Model):
         return False
 
 
+class CategoryClosure(models.Model):
+    """
+    Every ancestor/descendant pair of the categories tree including the pair of
+    a category with itself (depth 0). Kept up to date by Category.save, rows of the
+    deleted categories are removed by cascade.
+    """
+    ancestor = models.ForeignKey('Category', on_delete=models.CASCADE, related_name='descendant_links',
+                                 verbose_name=_('ancestor'))
+    descendant = models.ForeignKey('Category', on_delete=models.CASCADE, related_name='ancestor_links',
+                                   verbose_name=_('descendant'))
+    depth = models.PositiveIntegerField(default=0, verbose_name=_('depth'))
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+        verbose_name = _('Category closure')
+        verbose_name_plural = _('Category closures')
+
+
+class ProductChange(models.Model):
+    """
+    Log of the changed products, the id of the last change is the version of the catalog.
+    Workers keeping the facet index in memory reload the products changed since their version.
+    A change without a product means that the whole catalog has to be reloaded.
+    """
+    product_id = models.PositiveIntegerField(blank=True, null=True, verbose_name=_('product id'))
+    created = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name=_('created'))
+
+    class Meta:
+        verbose_name = _('Product change')
+        verbose_name_plural = _('Product changes')
+
+
 class CategoryCityRating(models.Model):
     category = models.ForeignKey('Category', on_delete=models.CASCADE, blank=False, null=False,
                                  verbose_name=_('category'))
@@ -167,6 +273,8 @@ class Product(models.Model):
                                         verbose_name=_('properties'),
                                         help_text=_("Properties should be set on Product Type level, but you can"
                                                     "provide single-product property as well."))
+    """ Values of the properties by their slugs, child products inherit values missing from their parent. """
+    properties_document = JSONField(default=dict, blank=True, editable=False, verbose_name=_('properties document'))
     """ Not required for parent products. """
     in_stock = models.DecimalField(default=0, blank=False, null=True, max_digits=10, decimal_places=4,
                                    help_text=_('For parents it will be calculated automatically'),
@@ -194,6 +302,7 @@ class Product(models.Model):
 
     class Meta:
         ordering = ['-activity', 'product_type', 'order']
+        indexes = [GinIndex(fields=['properties_document'])]
         verbose_name = _('Product')
         verbose_name_plural = _('Products')
 
@@ -322,6 +431,25 @@ class Product(models.Model):
     def get_child_list(self):
         return self.__class__.objects.filter(parent=self)
 
+    @classmethod
+    def update_properties_documents(cls, products_ids):
+        """
+        Rebuilds properties documents of the products and of their children from the property values.
+        """
+        products = list(cls.objects.filter(Q(id__in=products_ids) | Q(parent_id__in=products_ids)).only('id', 'parent_id'))
+        owners_ids = {product.id for product in products}
+        owners_ids.update(product.parent_id for product in products if product.parent_id)
+
+        documents = {}
+        values = ProductPropertyValue.objects.filter(product_id__in=owners_ids).select_related('prop')
+        for value in values:
+            if value.value is not None:
+                documents.setdefault(value.product_id, {})[value.prop.slug] = value.value
+
+        for product in products:
+            product.properties_document = {**documents.get(product.parent_id, {}), **documents.get(product.id, {})}
+        cls.objects.bulk_update(products, ['properties_document'], batch_size=1000)
+
 
 class ProductImage(models.Model):
     product = models.ForeignKey('Product', on_delete=models.CASCADE, blank=False, null=False, related_name='images',
@@ -339,6 +467,52 @@ class ProductImage(models.Model):
         verbose_name_plural = _('Product images')
 
 
+class ProductListing(models.Model):
+    """
+    Values shown in product lists with the inherited ones already taken from the parent:
+    brand, units, base amount, the first active category, the first image, novelty and special.
+    Kept up to date by the signals of the products app, rebuilt by the `rebuild_product_listings` command.
+    """
+    product = models.OneToOneField('Product', on_delete=models.CASCADE, primary_key=True, related_name='listing',
+                                   verbose_name=_('product'))
+    brand = models.ForeignKey('Brand', on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+                              verbose_name=_('brand'))
+    units = models.ForeignKey('Unit', on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+                              verbose_name=_('units'))
+    base_amount = models.DecimalField(blank=True, null=True, max_digits=10, decimal_places=4,
+                                      verbose_name=_('base amount'))
+    category_slug = models.SlugField(max_length=128, blank=True, verbose_name=_('category slug'))
+    image = models.ForeignKey('ProductImage', on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+                              verbose_name=_('image'))
+    is_new = models.BooleanField(default=False, verbose_name=_('is new'))
+    new_until = models.DateTimeField(blank=True, null=True, verbose_name=_('new until'),
+                                     help_text=_('Calculated novelty ends at this date.'))
+    special_slug = models.SlugField(max_length=128, blank=True, verbose_name=_('special slug'))
+    special_threshold = models.IntegerField(blank=True, null=True, verbose_name=_('special threshold'))
+    special_price = models.DecimalField(blank=True, null=True, max_digits=15, decimal_places=2,
+                                        verbose_name=_('special price'))
+
+    class Meta:
+        verbose_name = _('Product listing')
+        verbose_name_plural = _('Product listings')
+
+    def get_is_new(self):
+        if self.is_new or (self.new_until and self.new_until > timezone.now()):
+            return True
+        return None
+
+    def get_special(self):
+        if not self.special_slug:
+            return None
+        result = {
+            'slug': self.special_slug,
+            'threshold': self.special_threshold,
+        }
+        if self.special_price is not None:
+            result['new_price'] = str(self.special_price)
+        return result
+
+
 class ProductProperty(models.Model):
     (TEXT, INTEGER, BOOLEAN, FLOAT) = (
         "text", "integer", "boolean", "float")
@@ -453,6 +627,31 @@ class ProductPropertyValue(models.Model):
             raise ValidationError(_("Value") + self.prop.name + _('is required'))
 
 
+class ProductSearch(models.Model):
+    """
+    Search document of the product: its name and art with the names of its tags, brand and categories
+    (with all their ancestors), the child products inherit them from the parent. Kept up to date
+    by the signals of the products app, rebuilt by the `rebuild_product_search` command (see `search`).
+    """
+    product = models.OneToOneField('Product', on_delete=models.CASCADE, primary_key=True, related_name='search',
+                                   verbose_name=_('product'))
+    name = models.CharField(max_length=128, verbose_name=_('name'))
+    art = models.CharField(max_length=16, blank=True, verbose_name=_('vendor code'))
+    tags = models.TextField(blank=True, verbose_name=_('tags'))
+    brand = models.CharField(max_length=64, blank=True, verbose_name=_('brand'))
+    categories = models.TextField(blank=True, verbose_name=_('categories'))
+    document = SearchVectorField(null=True, verbose_name=_('document'))
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['document'], name='products_search_document_idx'),
+            GinIndex(fields=['name'], name='products_search_name_trgm_idx', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['art'], name='products_search_art_trgm_idx', opclasses=['gin_trgm_ops']),
+        ]
+        verbose_name = _('Product search document')
+        verbose_name_plural = _('Product search documents')
+
+
 class ProductType(models.Model):
     created = models.DateTimeField(auto_now_add=True, verbose_name=_('created'))
     modified = models.DateTimeField(auto_now=True, verbose_name=_('modified'))
@@ -0,0 +1,163 @@
+import base64
+import hashlib
+import json
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import F, Q
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+# Exact counts of the cursor pages are cached for this number of seconds
+COUNT_CACHE_TIMEOUT = 5 * 60
+
+
+def get_sort_key(query_params, default='order'):
+    """
+    Returns the field the products are sorted by and whether the order is descending.
+    Same options as `filters.get_products_ordering`: `sortby=name|price` and `direction=asc|desc`.
+    """
+    sort_by = query_params.get('sortby')
+    direction = query_params.get('direction')
+    if sort_by in ('name', 'price'):
+        return sort_by, direction == 'desc'
+    return default, False
+
+
+class DynamicPageNumberPagination(PageNumberPagination):
+    page_size_query_param = 'size'
+    max_page_size = 100
+
+
+class CatalogPagination(DynamicPageNumberPagination):
+    """
+    Page number pagination or, if the `cursor` query param is given (empty for the first page),
+    keyset pagination which costs the same whatever the page is deep.
+
+    Cursor pages are sorted by the sort key of the view (see `get_sort_key`) and the product id,
+    products without the key value go last. The cursor is the key and the id of the last product
+    of the page. The total count is returned only if requested by the `count` query param:
+    `exact` - counted once per `COUNT_CACHE_TIMEOUT`, `estimate` - estimated by the query planner.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = _('Invalid cursor')
+
+    def is_cursor_mode(self, request):
+        return self.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.is_cursor_mode(request)
+        if not self.cursor_mode:
+            return super(CatalogPagination, self).paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.count = None
+        self.next_cursor = None
+        if isinstance(queryset, list):
+            if request.query_params.get(self.count_query_param):
+                self.count = len(queryset)
+            return queryset
+
+        field, descending = view.get_sort_key() if hasattr(view, 'get_sort_key') else get_sort_key(request.query_params)
+        size = self.get_page_size(request)
+        cursor = self.decode_cursor(request.query_params.get(self.cursor_query_param))
+
+        # Products sorted in the facet index are paged by the index
+        if hasattr(queryset, 'get_cursor_page'):
+            if request.query_params.get(self.count_query_param):
+                self.count = len(queryset)
+            try:
+                products = queryset.get_cursor_page(field, descending, cursor, size + 1)
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+            return self.get_page(products, field, size)
+
+        key = F(field).desc(nulls_last=True) if descending else F(field).asc(nulls_last=True)
+        queryset = queryset.order_by(key, '-id' if descending else 'id')
+
+        self.count = self.get_count(queryset, request)
+
+        if cursor is not None:
+            queryset = queryset.filter(self.get_cursor_filter(field, descending, *cursor))
+        return self.get_page(list(queryset[:size + 1]), field, size)
+
+    def get_page(self, products, field, size):
+        """
+        Returns the page of the products fetched with one more product, which tells there is the next page.
+        """
+        if len(products) > size:
+            products = products[:size]
+            last = products[-1]
+            self.next_cursor = self.encode_cursor(getattr(last, field), last.id)
+        return products
+
+    def get_cursor_filter(self, field, descending, value, product_id):
+        """
+        Returns the condition of the products following the product with given key value and id.
+        """
+        lookup = 'lt' if descending else 'gt'
+        if value is None:
+            return Q(**{field + '__isnull': True, 'id__' + lookup: product_id})
+        return (Q(**{field + '__' + lookup: value}) | Q(**{field: value, 'id__' + lookup: product_id}) |
+                Q(**{field + '__isnull': True}))
+
+    def encode_cursor(self, value, product_id):
+        if value is not None and not isinstance(value, (int, float, str)):
+            value = str(value)
+        return base64.urlsafe_b64encode(json.dumps([value, product_id]).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            value, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            return value, int(product_id)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == 'exact':
+            # Keyed by the request as the queries may depend on the current time
+            params = sorted((key, value) for key, value in request.query_params.lists()
+                            if key not in (self.cursor_query_param, self.page_size_query_param))
+            cache_key = 'products_count_%s' % hashlib.md5(('%s%s' % (request.path, params)).encode()).hexdigest()
+            count = cache.get(cache_key)
+            if count is None:
+                count = queryset.count()
+                cache.set(cache_key, count, COUNT_CACHE_TIMEOUT)
+            return count
+        if mode == 'estimate':
+            sql, params = queryset.query.sql_with_params()
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return plan[0]['Plan']['Plan Rows']
+        return None
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super(CatalogPagination, self).get_next_link()
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super(CatalogPagination, self).get_paginated_response(data)
+
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['results'] = data
+        return Response(response)
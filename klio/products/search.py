@@ -0,0 +1,142 @@
+from contextlib import contextmanager
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db import connection, transaction
+from django.db.models import DecimalField, F, Q
+from django.db.models.functions import Cast, Greatest
+
+from .models import Category, Product
+from .utils import schedule_update
+
+# Minimal trigram similarity of the product name and of the art to the searched text
+NAME_SIMILARITY = 0.15
+ART_SIMILARITY = 0.3
+
+# Similarities are rounded to numeric values, they are compared exactly to the values of the cursors
+SIMILARITY_FIELD = DecimalField(max_digits=20, decimal_places=15)
+
+# Text search configuration of the words of the documents, arts are indexed as they are
+SEARCH_CONFIG = 'russian'
+
+CHUNK_SIZE = 1000
+
+# Builds the search documents of the products (`{where}`) and of their children in one statement.
+# The fields are weighted: name and art - A, tags and brand - B, categories with their ancestors - C
+UPDATE_SEARCH_SQL = '''
+INSERT INTO products_productsearch (product_id, name, art, tags, brand, categories, document)
+SELECT product.id, product.name, product.art, product.tags, product.brand, product.categories,
+       setweight(to_tsvector('{config}', product.name), 'A') ||
+       setweight(to_tsvector('simple', product.art), 'A') ||
+       setweight(to_tsvector('{config}', product.tags), 'B') ||
+       setweight(to_tsvector('{config}', product.brand), 'B') ||
+       setweight(to_tsvector('{config}', product.categories), 'C')
+FROM (
+    SELECT p.id, p.name, COALESCE(p.art::text, '') AS art,
+           (SELECT COALESCE(string_agg(DISTINCT t.name, ' '), '')
+            FROM products_product_tags pt JOIN tags_tag t ON t.id = pt.tag_id
+            WHERE pt.product_id = p.id OR pt.product_id = p.parent_id) AS tags,
+           COALESCE(b.name, '') AS brand,
+           (SELECT COALESCE(string_agg(DISTINCT c.name, ' '), '')
+            FROM products_product_categories pc
+            JOIN products_categoryclosure cc ON cc.descendant_id = pc.category_id
+            JOIN products_category c ON c.id = cc.ancestor_id
+            WHERE pc.product_id = p.id OR pc.product_id = p.parent_id) AS categories
+    FROM products_product p
+    LEFT JOIN products_product parent ON parent.id = p.parent_id
+    LEFT JOIN products_brand b ON b.id = CASE WHEN p.kind = '{child}' THEN parent.brand_id ELSE p.brand_id END
+    WHERE {{where}}
+) product
+ON CONFLICT (product_id) DO UPDATE SET
+    name = EXCLUDED.name, art = EXCLUDED.art, tags = EXCLUDED.tags, brand = EXCLUDED.brand,
+    categories = EXCLUDED.categories, document = EXCLUDED.document
+'''.format(config=SEARCH_CONFIG, child=Product.CHILD)
+
+
+def update_products_search(products_ids):
+    """
+    Rebuilds search documents of the products and of their children. Returns the number of documents.
+    """
+    products_ids = list(products_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(UPDATE_SEARCH_SQL.format(where='p.id = ANY(%s) OR p.parent_id = ANY(%s)'),
+                       [products_ids, products_ids])
+        return cursor.rowcount
+
+
+def schedule_products_search_update(products_ids):
+    """
+    Updates search documents of the products when the current transaction is committed.
+    """
+    schedule_update(update_products_search, products_ids)
+
+
+def rebuild_products_search(chunk_size=CHUNK_SIZE):
+    """
+    Rebuilds search documents of all the products chunk by chunk. Returns the number of documents.
+    """
+    count = 0
+    last_id = 0
+    with connection.cursor() as cursor:
+        while True:
+            products_ids = list(Product.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not products_ids:
+                return count
+            cursor.execute(UPDATE_SEARCH_SQL.format(where='p.id = ANY(%s)'), [products_ids])
+            count += cursor.rowcount
+            last_id = products_ids[-1]
+
+
+@contextmanager
+def similarity_threshold():
+    """
+    Sets the threshold of the trigram similarity operator (`%`) for the transaction the search querysets
+    are evaluated in, the trigram indexes are used by the operator only. The setting is local to the transaction,
+    so it is never left on the connection for the other requests.
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT set_config('pg_trgm.similarity_threshold', %s, true)", [str(NAME_SIMILARITY)])
+        yield
+
+
+def get_searchable_products():
+    """
+    Returns active unique and child products of the active leaf categories (of their own or of the parent).
+    """
+    active_child_categories_ids = list(Category.get_active_leaves_ids())
+    return Product.objects.filter(activity=True, kind__in=[Product.UNIQUE, Product.CHILD]).filter(
+        id__in=Product.objects.filter(
+            Q(categories__in=active_child_categories_ids) | Q(parent__categories__in=active_child_categories_ids)
+        ).values('id')
+    )
+
+
+def search_products(queryset, text):
+    """
+    Filters the products found by the text in their search documents: by the similar name or art
+    or by the words of any field. The products are annotated with `similarity` (numeric, so it is read back
+    exactly for the cursors) and ordered by it. Should be evaluated inside `similarity_threshold`.
+    """
+    query = SearchQuery(text, config=SEARCH_CONFIG)
+    return queryset.annotate(
+        art_similarity=TrigramSimilarity('search__art', text),
+        similarity=Cast(Greatest(
+            F('art_similarity'), TrigramSimilarity('search__name', text), SearchRank(F('search__document'), query)
+        ), SIMILARITY_FIELD)
+    ).filter(
+        Q(search__art__trigram_similar=text, art_similarity__gt=ART_SIMILARITY) |
+        Q(search__name__trigram_similar=text) |
+        Q(search__document=query)
+    ).order_by('-similarity', 'id')
+
+
+def search_products_by_art(queryset, art, threshold):
+    """
+    Filters the products with the art similar to the given one, the products are annotated with `similarity`
+    and ordered by it. Should be evaluated inside `similarity_threshold`.
+    """
+    return queryset.annotate(
+        similarity=Cast(TrigramSimilarity('search__art', art), SIMILARITY_FIELD)
+    ).filter(
+        search__art__trigram_similar=art, similarity__gt=threshold
+    ).order_by('-similarity', 'id')
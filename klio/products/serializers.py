@@ -1,11 +1,12 @@
-from django.db.models import Max, Min
+from django.db import models
 from django.utils.timezone import now, timedelta
 
 from rest_framework import serializers
 from rest_framework_recursive.fields import RecursiveField
 
-from sale.models import Special
+from sale.utils import SpecialPriceResolver
 from tags.serializers import TagSerializer
+from .listing import prefetch_products_listing_objects
 from .models import Brand, Category, Product, ProductImage, ProductProperty
 
 
@@ -116,6 +117,17 @@ class ProductPropertySerializer(serializers.ModelSerializer):
         return None
 
 
+class ProductListPageSerializer(serializers.ListSerializer):
+    """
+    Loads listings of the whole page of products before serializing them one by one.
+    """
+
+    def to_representation(self, data):
+        products = list(data.all() if isinstance(data, models.Manager) else data)
+        prefetch_products_listing_objects(products)
+        return super(ProductListPageSerializer, self).to_representation(products)
+
+
 class ProductListSerializer(serializers.ModelSerializer):
     base_amount = serializers.SerializerMethodField()
     categories = serializers.SerializerMethodField()
@@ -123,74 +135,42 @@ class ProductListSerializer(serializers.ModelSerializer):
     is_new = serializers.SerializerMethodField()
     special = serializers.SerializerMethodField()
     units = serializers.SerializerMethodField()
-    child_list = serializers.ListField(source='get_child_list', child=RecursiveField())
+    child_list = serializers.ListField(source='listing_children', child=RecursiveField())
 
     class Meta:
         model = Product
         fields = ('id', 'name', 'slug', 'categories', 'image', 'in_stock', 'art', 'base_amount', 'units', 'price',
                   'wholesale_threshold', 'wholesale_price', 'is_new', 'special', 'child_list')
+        list_serializer_class = ProductListPageSerializer
 
     def get_base_amount(self, obj):
-        return obj.get_base_amount()
+        return obj.listing.base_amount
 
     # TODO: choose category!
     def get_categories(self, obj):
-        return obj.get_categories().first().slug if obj.get_categories() else 'no-categories'
+        return obj.listing.category_slug or 'no-categories'
 
     def get_image(self, obj):
-        return ProductImageSerializer(instance=obj.images.filter().first(),
+        return ProductImageSerializer(instance=obj.listing.image,
                                       context={"request": self.context.get('request')}
                                       ).data
 
     def get_special(self, obj):
-        result = {}
-        special = None
-        # TODO: do smth with selection of just the first special
-        # First get private product special
-        special_relation = obj.special_relations.filter(special__activity=True).first()
-        if special_relation:
-            special = special_relation.special
-        # Else get special via category
-        if not special:
-            if obj.get_categories():
-                special = Special.objects.filter(
-                    categories__in=obj.get_categories().distinct().values_list('id', flat=True)
-                ).first()
-        # Or via tags
-        if not special:
-            tags_ids = [tag.id for tag in obj.tags.filter(activity=True)]
-            special = Special.objects.filter(tags__in=tags_ids).first()
-
-        if special:
-            result['slug'] = special.slug
-            result['threshold'] = special.threshold if special.threshold else 0
-            if special_relation and special_relation.discount_amount:
-                result['new_price'] = str(round(obj.price - special.discount_amount, 2))
-                return result
-            else:
-                if special.discount_type == 'percent':
-                    result['new_price'] = str(round(obj.price * (1 - special.discount_amount / 100), 2))
-                elif special.special.discount_type == 'fixed':
-                    result['new_price'] = str(round(obj.price - special.discount_amount, 2))
-            return result
-        return None
+        return obj.listing.get_special()
 
     def get_is_new(self, obj):
-        result = None
-        if obj.is_new == 'new':
-            result = True
-        if obj.is_new == 'calculated':
-            if obj.created > now() - timedelta(days=60):
-                result = True
-        return result
+        return obj.listing.get_is_new()
 
     def get_units(self, obj):
-        if obj.get_units():
-            return obj.get_units().name
+        if obj.listing.units:
+            return obj.listing.units.name
         return None
 
 
 class BasketProductListSerializer(ProductListSerializer):
+    """
+    Products with their basket lines given as `basket_product` (see `basket.serializers.get_basket_products`).
+    """
     quantity = serializers.SerializerMethodField()
     current_price = serializers.SerializerMethodField()
 
@@ -198,23 +178,27 @@ class BasketProductListSerializer(ProductListSerializer):
         fields = ProductListSerializer.Meta.fields + ('quantity', 'current_price',)
 
     def get_current_price(self, obj):
-        return obj.in_basket.get(basket_id=self.context.get('basket_id')).price
+        return obj.basket_product.price
 
     def get_quantity(self, obj):
-        return obj.in_basket.get(basket_id=self.context.get('basket_id')).quantity
+        return obj.basket_product.quantity
 
 
 class FilterListSerializer(serializers.ModelSerializer):
     type = serializers.SerializerMethodField()
     value = serializers.SerializerMethodField()
     options = serializers.SerializerMethodField()
+    options_counts = serializers.SerializerMethodField()
     min = serializers.SerializerMethodField()
     max = serializers.SerializerMethodField()
     units = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductProperty
-        fields = ('name', 'slug', 'type', 'units', 'value', 'options', 'min', 'max', 'interval')
+        fields = ('name', 'slug', 'type', 'units', 'value', 'options', 'options_counts', 'min', 'max', 'interval')
+
+    def get_facet(self, obj):
+        return self.context.get('facets', {}).get(obj.id, {})
 
     def get_type(self, obj):
         if obj.type in ['integer', 'float']:
@@ -223,27 +207,28 @@ class FilterListSerializer(serializers.ModelSerializer):
 
     def get_options(self, obj):
         if obj.type == 'text':
-            products_ids = self.context.get('products_ids')
-            return obj.values.filter(product__in=products_ids, value_text__isnull=False)\
-                             .distinct()\
-                             .values_list('value_text', flat=True)
+            return self.get_facet(obj).get('options', [])
+        return None
+
+    def get_options_counts(self, obj):
+        if obj.type == 'text':
+            return self.get_facet(obj).get('counts', {})
         return None
 
     def get_min(self, obj):
         if obj.type in ['integer', 'float']:
-            products_ids = self.context.get('products_ids')
-            return list(obj.values.filter(product__in=products_ids).aggregate(Min('value_%s' % obj.type)).values())[0]
+            return self.get_facet(obj).get('min')
         return None
 
     def get_max(self, obj):
         if obj.type in ['integer', 'float']:
-            products_ids = self.context.get('products_ids')
-            return list(obj.values.filter(product__in=products_ids).aggregate(Max('value_%s' % obj.type)).values())[0]
+            return self.get_facet(obj).get('max')
         return None
 
     def get_value(self, obj):
-        if self.get_min(obj) and self.get_max(obj):
-            return [self.get_min(obj), self.get_max(obj)]
+        min_value, max_value = self.get_min(obj), self.get_max(obj)
+        if min_value and max_value:
+            return [min_value, max_value]
         return None
 
     def get_units(self, obj):
@@ -306,37 +291,7 @@ class ProductSerializer(serializers.ModelSerializer):
                                      many=True, context=self.context).data
 
     def get_special(self, obj):
-        result = {}
-        special = None
-        # TODO: do smth with selection of just the first special
-        # First get private product special
-        special_relation = obj.special_relations.filter(special__activity=True).first()
-        if special_relation:
-            special = special_relation.special
-        # Else get special via category
-        if not special:
-            if obj.get_categories():
-                special = Special.objects.filter(
-                    categories__in=obj.get_categories().values_list('id', flat=True)
-                ).first()
-        # Or via tags
-        if not special:
-            tags_ids = [tag.id for tag in obj.tags.filter(activity=True)]
-            special = Special.objects.filter(tags__in=tags_ids).first()
-
-        if special:
-            result['slug'] = special.slug
-            result['threshold'] = special.threshold if special.threshold else 0
-            if special_relation and special_relation.discount_amount:
-                result['new_price'] = str(round(obj.price - special.discount_amount, 2))
-                return result
-            else:
-                if special.discount_type == 'percent':
-                    result['new_price'] = str(round(obj.price * (1 - special.discount_amount / 100), 2))
-                elif special.special.discount_type == 'fixed':
-                    result['new_price'] = str(round(obj.price - special.discount_amount, 2))
-            return result
-        return None
+        return SpecialPriceResolver.for_context(self.context).resolve(obj)
 
     def get_units(self, obj):
         if obj.get_units():
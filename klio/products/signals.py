@@ -0,0 +1,144 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .facet_index import log_products_changes
+from .listing import schedule_products_listings_update
+from tags.models import Tag
+from .models import Brand, Category, CategoryClosure, Product, ProductImage, ProductProperty, ProductPropertyValue
+from .search import schedule_products_search_update
+from .utils import schedule_update
+
+
+def get_subtree_products_ids(category):
+    """
+    Ids of the products of the category and of all its subcategories, their search documents
+    contain the name of the category.
+    """
+    return Product.objects.filter(
+        categories__in=CategoryClosure.objects.filter(ancestor_id=category.pk).values('descendant_id')
+    ).values_list('id', flat=True).distinct()
+
+
+@receiver(post_save, sender=Product)
+def update_product_listing(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_products_listings_update([instance.id])
+        schedule_products_search_update([instance.id])
+        schedule_update(Product.update_properties_documents, [instance.id])
+        schedule_update(log_products_changes, [instance.id])
+
+
+@receiver(post_delete, sender=Product)
+def log_deleted_product_change(sender, instance, **kwargs):
+    schedule_update(log_products_changes, [instance.id])
+
+
+@receiver(post_save, sender=ProductPropertyValue)
+@receiver(post_delete, sender=ProductPropertyValue)
+def update_product_properties_document(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_update(Product.update_properties_documents, [instance.product_id])
+        schedule_update(log_products_changes, [instance.product_id])
+
+
+@receiver(post_save, sender=ProductProperty)
+def update_property_products_documents(sender, instance, raw=False, **kwargs):
+    """
+    Documents are keyed by the slugs and typed by the types of the properties.
+    """
+    if not raw:
+        schedule_update(Product.update_properties_documents, instance.values.values_list('product_id', flat=True))
+        schedule_update(log_products_changes)
+
+
+@receiver(post_delete, sender=ProductProperty)
+@receiver(post_delete, sender=Brand)
+def log_catalog_change(sender, instance, **kwargs):
+    """
+    Properties and brands are shared by many products, the facet indexes are rebuilt.
+    """
+    schedule_update(log_products_changes)
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def update_product_image_listing(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_products_listings_update([instance.product_id])
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+@receiver(m2m_changed, sender=Product.tags.through)
+def update_product_relations_listings(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Categories and tags define the category and the special shown in the listing.
+    Changed from a category or a tag side all its products are updated.
+    """
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            products_ids = [instance.id]
+        else:
+            return
+    elif action == 'pre_clear':
+        instance._cleared_products_ids = list(instance.products.values_list('id', flat=True))
+        return
+    elif action in ('post_add', 'post_remove'):
+        products_ids = pk_set
+    elif action == 'post_clear':
+        products_ids = getattr(instance, '_cleared_products_ids', [])
+    else:
+        return
+
+    schedule_products_listings_update(products_ids)
+    schedule_products_search_update(products_ids)
+    # Tags are not indexed by the facet index
+    if sender is Product.categories.through:
+        schedule_update(log_products_changes, products_ids)
+
+
+@receiver(post_save, sender=Category)
+def update_category_listings(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_products_listings_update(instance.products.values_list('id', flat=True))
+        schedule_products_search_update(get_subtree_products_ids(instance))
+
+
+@receiver(pre_delete, sender=Category)
+def collect_category_products(sender, instance, **kwargs):
+    instance._deleted_products_ids = list(instance.products.values_list('id', flat=True))
+    instance._subtree_products_ids = list(get_subtree_products_ids(instance))
+
+
+@receiver(post_delete, sender=Category)
+def update_deleted_category_listings(sender, instance, **kwargs):
+    schedule_products_listings_update(getattr(instance, '_deleted_products_ids', []))
+    schedule_products_search_update(getattr(instance, '_subtree_products_ids', []))
+    schedule_update(log_products_changes, getattr(instance, '_deleted_products_ids', []))
+
+
+@receiver(post_save, sender=Brand)
+def update_brand_products_search(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_products_search_update(instance.product_set.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Brand)
+def collect_brand_products(sender, instance, **kwargs):
+    instance._deleted_products_ids = list(instance.product_set.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+def update_tag_products_search(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_products_search_update(instance.products.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Tag)
+def collect_tag_products(sender, instance, **kwargs):
+    instance._deleted_products_ids = list(instance.products.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Brand)
+@receiver(post_delete, sender=Tag)
+def update_deleted_products_search(sender, instance, **kwargs):
+    schedule_products_search_update(getattr(instance, '_deleted_products_ids', []))
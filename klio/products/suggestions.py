@@ -0,0 +1,270 @@
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .facet_index import CHANGES_LOOKBACK, CHANGES_RETENTION
+from .models import Category, Product, ProductChange
+from tags.models import Tag
+
+# The index checks the changes of the catalog at most once per this number of seconds
+REFRESH_INTERVAL = 10
+
+# Entries are found by the beginnings of their first words, the rest of the words are not indexed
+MAX_WORDS = 8
+
+# Number of the index keys looked through for a suggestion request at most
+SCAN_LIMIT = 500
+
+# The sorted keys are rebuilt instead of being updated one by one for more changed entries
+REBUILD_THRESHOLD = 200
+
+# Default and maximal numbers of the suggestions
+SUGGESTIONS_LIMIT = 10
+MAX_SUGGESTIONS_LIMIT = 20
+
+# Order of the suggestions of the same match
+TYPES_ORDER = ('category', 'tag', 'product', 'art')
+
+LATIN_LAYOUT = 'qwertyuiop[]asdfghjkl;\'zxcvbnm,.`'
+CYRILLIC_LAYOUT = 'йцукенгшщзхъфывапролджэячсмитьбюё'
+TO_CYRILLIC = str.maketrans(LATIN_LAYOUT, CYRILLIC_LAYOUT)
+TO_LATIN = str.maketrans(CYRILLIC_LAYOUT, LATIN_LAYOUT)
+
+NOT_WORD_RE = re.compile(r'[\W_]+')
+
+
+def normalize(text):
+    """
+    Returns the words of the text lowercased, without punctuation, with `ё` replaced by `е`.
+    """
+    return NOT_WORD_RE.sub(' ', text.lower().replace('ё', 'е')).split()
+
+
+def get_layout_variants(text):
+    """
+    Returns the text and the text typed in the other keyboard layout (Latin QWERTY or Russian ЙЦУКЕН),
+    the layout is converted before the normalization as some Russian letters are punctuation keys.
+    """
+    text = text.lower()
+    variants = []
+    for variant in (text, text.translate(TO_CYRILLIC), text.translate(TO_LATIN)):
+        words = normalize(variant)
+        if words and words not in variants:
+            variants.append(words)
+    return variants
+
+
+class SuggestionIndex(object):
+    """
+    In-memory prefix index of the names of the active categories, tags and products and of the products arts.
+
+    Entries are keyed by `(type, id)`. Every entry has a key for each of its first words: the normalized
+    text from the word to the end. The keys are kept in sorted lists of `(key, entry key)` grouped by
+    the type of the entries and by whether the key starts from the first word, the keys starting with
+    the typed text are found by binary search.
+
+    Products are reloaded incrementally from the log of the products changes (as the facet index is),
+    categories and tags are few, they are reloaded on every refresh and only the changed ones are reindexed.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.refreshed = None
+        self.checked = None
+        self.seen = set()
+        self.entries = {}
+        self.keys = {}
+
+    def build(self):
+        """
+        Loads the whole catalog.
+        """
+        self.__init__()
+        self.version = ProductChange.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        self.seen = set(ProductChange.objects.filter(id__gt=self.version - CHANGES_LOOKBACK).values_list('id', flat=True))
+        self.entries = self._get_products_entries(Product.objects.all())
+        self.entries.update(self._get_named_entries())
+        self._index_entries()
+        self.refreshed = timezone.now()
+        self.checked = time.monotonic()
+
+    def refresh(self):
+        """
+        Reloads the products changed since the last refresh, and the changed categories and tags.
+        """
+        now = timezone.now()
+        if self.refreshed is None or now - self.refreshed > CHANGES_RETENTION / 2:
+            return self.build()
+        self.refreshed = now
+        self.checked = time.monotonic()
+
+        entries = self._get_named_entries()
+        changed = {
+            entry_key for entry_key in set(entries) | {key for key in self.entries if key[0] in ('category', 'tag')}
+            if entries.get(entry_key) != self.entries.get(entry_key)
+        }
+
+        changes = list(ProductChange.objects.filter(
+            id__gt=self.version - CHANGES_LOOKBACK
+        ).values_list('id', 'product_id'))
+        unseen = [(change_id, product_id) for change_id, product_id in changes if change_id not in self.seen]
+        if any(product_id is None for _, product_id in unseen):
+            return self.build()
+        if unseen:
+            products_ids = {product_id for _, product_id in unseen}
+            entries.update(self._get_products_entries(
+                Product.objects.filter(Q(id__in=products_ids) | Q(parent_id__in=products_ids))
+            ))
+            changed.update(
+                entry_key for entry_key in self.entries if entry_key[0] in ('product', 'art') and (
+                    entry_key[1] in products_ids or self.entries[entry_key].get('parent_id') in products_ids
+                )
+            )
+            changed.update(entry_key for entry_key in entries if entry_key[0] in ('product', 'art'))
+            self.version = max(self.version, max(change_id for change_id, _ in unseen))
+            self.seen = {change_id for change_id, _ in changes if change_id > self.version - CHANGES_LOOKBACK}
+
+        self._update({entry_key: entries.get(entry_key) for entry_key in changed})
+
+    def _get_products_entries(self, queryset):
+        """
+        Names of the active listed (unique and parent) products and arts of the active products,
+        arts of the children are suggested with the names of their parents.
+        """
+        entries = {}
+        products = queryset.filter(activity=True).exclude(kind=Product.CHILD, parent__activity=False).values_list(
+            'id', 'parent_id', 'kind', 'name', 'slug', 'art', 'parent__name', 'parent__slug'
+        )
+        for product_id, parent_id, kind, name, slug, art, parent_name, parent_slug in products:
+            if kind == Product.CHILD:
+                name, slug = '%s %s' % (parent_name, name), parent_slug
+            else:
+                entries[('product', product_id)] = {'text': name, 'words': normalize(name), 'slug': slug}
+            if art is not None:
+                entries[('art', product_id)] = {'text': str(art), 'words': [str(art)], 'name': name, 'slug': slug,
+                                                'parent_id': parent_id}
+        return entries
+
+    def _get_named_entries(self):
+        entries = {}
+        for category_id, name, slug in Category.objects.filter(activity=True).values_list('id', 'name', 'slug'):
+            entries[('category', category_id)] = {'text': name, 'words': normalize(name), 'slug': slug}
+        for tag_id, name in Tag.objects.filter(activity=True).values_list('id', 'name'):
+            entries[('tag', tag_id)] = {'text': name, 'words': normalize(name)}
+        return entries
+
+    @staticmethod
+    def _get_keys(entry_key, words):
+        """
+        Yields the groups of the keys of the entry (whether the key starts from the first word and
+        the type of the entry) and the keys.
+        """
+        for position in range(min(len(words), MAX_WORDS)):
+            yield (min(position, 1), entry_key[0]), (' '.join(words[position:]), entry_key)
+
+    def _index_entries(self):
+        self.keys = {}
+        for entry_key, entry in self.entries.items():
+            for group, key in self._get_keys(entry_key, entry['words']):
+                self.keys.setdefault(group, []).append(key)
+        for keys in self.keys.values():
+            keys.sort()
+
+    def _update(self, entries):
+        """
+        Replaces the entries (removes the ones given as None) with their keys.
+        """
+        rebuild = len(entries) > REBUILD_THRESHOLD
+        for entry_key, entry in entries.items():
+            previous = self.entries.pop(entry_key, None)
+            if entry is not None:
+                self.entries[entry_key] = entry
+            if rebuild:
+                continue
+            if previous is not None:
+                for group, key in self._get_keys(entry_key, previous['words']):
+                    keys = self.keys[group]
+                    del keys[bisect_left(keys, key)]
+            if entry is not None:
+                for group, key in self._get_keys(entry_key, entry['words']):
+                    insort(self.keys.setdefault(group, []), key)
+
+        if rebuild:
+            self._index_entries()
+
+    def _scan(self, group, prefix):
+        """
+        Yields the entry keys of the group's keys starting with the prefix in alphabetical order, SCAN_LIMIT at most.
+        """
+        keys = self.keys.get(group, [])
+        start = bisect_left(keys, (prefix,))
+        for index in range(start, min(start + SCAN_LIMIT, len(keys))):
+            key, entry_key = keys[index]
+            if not key.startswith(prefix):
+                return
+            yield entry_key
+
+    def _scan_words(self, entry_type, words):
+        """
+        Yields the entry keys of the type having words starting with every one of the words.
+        """
+        for match in (0, 1):
+            for entry_key in self._scan((match, entry_type), max(words, key=len)):
+                entry_words = self.entries[entry_key]['words']
+                if all(any(entry_word.startswith(word) for entry_word in entry_words) for word in words):
+                    yield entry_key
+
+    def suggest(self, text, limit=SUGGESTIONS_LIMIT):
+        """
+        Returns the entries starting with the text, the entries having a word starting with the text
+        and the entries having words starting with every word of the text (in this order),
+        each of them then for the text typed in the other keyboard layout.
+        Only the first `limit` of the keys in the order are looked through.
+        """
+        variants = get_layout_variants(text)
+        suggestions = []
+        found = set()
+        for match in (0, 1, 2):
+            for words in variants:
+                if match == 2 and len(words) == 1:
+                    continue
+                for entry_type in TYPES_ORDER:
+                    if match < 2:
+                        entries_keys = self._scan((match, entry_type), ' '.join(words))
+                    else:
+                        entries_keys = self._scan_words(entry_type, words)
+                    for entry_key in entries_keys:
+                        entry = self.entries[entry_key]
+                        if entry_key in found or (entry_type, entry['text']) in found:
+                            continue
+                        found.update((entry_key, (entry_type, entry['text'])))
+                        suggestion = {'type': entry_type, 'id': entry_key[1], 'text': entry['text']}
+                        suggestion.update((name, entry[name]) for name in ('name', 'slug') if name in entry)
+                        suggestions.append(suggestion)
+                        if len(suggestions) == limit:
+                            return suggestions
+        return suggestions
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_suggestions(text, limit=SUGGESTIONS_LIMIT):
+    """
+    Returns the suggestions of the worker's index, the index is built on the first call
+    and refreshed once per REFRESH_INTERVAL at most.
+    """
+    global _index
+
+    with _index_lock:
+        if _index is None:
+            _index = SuggestionIndex()
+            _index.build()
+        elif time.monotonic() - _index.checked > REFRESH_INTERVAL:
+            _index.refresh()
+        return _index.suggest(text, limit)
@@ -0,0 +1,484 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework.test import APITestCase
+
+from . import facet_index
+from .facet_index import FacetIndex, log_products_changes
+from .listing import rebuild_products_listings
+from tags.models import Tag
+from .models import (Brand, Category, CategoryClosure, Product, ProductChange, ProductImage, ProductListing,
+                     ProductProperty, ProductPropertyValue, ProductSearch, Unit)
+from sale.models import Special
+from .search import (get_searchable_products, rebuild_products_search, search_products, search_products_by_art,
+                     similarity_threshold)
+from .suggestions import SuggestionIndex
+
+
+class CategoryClosureTestCase(TestCase):
+    def setUp(self):
+        self.root = Category.objects.create(name='Jewelry', slug='jewelry')
+        self.child = Category.objects.create(name='Rings', slug='rings', parent=self.root)
+        self.grandchild = Category.objects.create(name='Silver rings', slug='silver-rings', parent=self.child)
+        self.other = Category.objects.create(name='Gifts', slug='gifts')
+
+    def get_ancestors(self, category):
+        return dict(CategoryClosure.objects.filter(descendant=category).values_list('ancestor_id', 'depth'))
+
+    def test_create(self):
+        self.assertEqual(self.get_ancestors(self.root), {self.root.id: 0})
+        self.assertEqual(self.get_ancestors(self.grandchild),
+                         {self.root.id: 2, self.child.id: 1, self.grandchild.id: 0})
+
+    def test_move_subtree(self):
+        self.child.parent = self.other
+        self.child.save()
+
+        self.assertEqual(self.get_ancestors(self.child), {self.other.id: 1, self.child.id: 0})
+        self.assertEqual(self.get_ancestors(self.grandchild),
+                         {self.other.id: 2, self.child.id: 1, self.grandchild.id: 0})
+        self.assertEqual(set(Category.get_active_descendants_ids('jewelry')), {self.root.id})
+
+    def test_cycle_is_rejected(self):
+        self.root.parent = self.grandchild
+        with self.assertRaises(ValidationError):
+            self.root.clean()
+        self.child.parent = self.child
+        with self.assertRaises(ValidationError):
+            self.child.clean()
+        self.child.parent = self.other
+        self.child.clean()
+
+    def test_inactive_ancestor_hides_descendants(self):
+        self.assertEqual(set(Category.get_active_descendants_ids('jewelry')),
+                         {self.root.id, self.child.id, self.grandchild.id})
+
+        self.child.activity = False
+        self.child.save()
+        self.assertEqual(set(Category.get_active_descendants_ids('jewelry')), {self.root.id})
+        # Requested directly the subcategories of the inactive category are active
+        self.assertEqual(set(Category.get_active_descendants_ids('silver-rings')), {self.grandchild.id})
+        self.assertEqual(set(Category.get_active_leaves_ids()), {self.other.id})
+
+
+class ProductListQueriesTestCase(APITestCase):
+    url = '/api/v1/products/categories/catalog/products/list'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Catalog', slug='catalog')
+        cls.units = Unit.objects.create(name='pcs')
+
+    def create_products(self, count):
+        for i in range(count):
+            product = Product.objects.create(name='Product %s' % i, slug='product-%s' % i, art=i, price=100,
+                                             units=self.units)
+            product.categories.add(self.category)
+            ProductImage.objects.create(product=product, img='products/product-%s.jpg' % i)
+
+            parent = Product.objects.create(name='Parent %s' % i, slug='parent-%s' % i, kind=Product.PARENT,
+                                            units=self.units)
+            parent.categories.add(self.category)
+            for j in range(2):
+                Product.objects.create(name='Child %s %s' % (i, j), slug='child-%s-%s' % (i, j), art=1000 * (i + 1) + j,
+                                       kind=Product.CHILD, parent=parent, price=50)
+        rebuild_products_listings()
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url, {'size': 100})
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.data['count']
+
+    def test_queries_do_not_depend_on_page_size(self):
+        self.create_products(1)
+        queries, count = self.count_queries()
+        self.assertEqual(count, 2)
+
+        Product.objects.all().delete()
+        self.create_products(10)
+        self.assertEqual(self.count_queries(), (queries, 20))
+
+    def test_missing_listing(self):
+        def get_products(response):
+            return [{**product, 'image': bool(product['image'])} for product in response.data['results']]
+
+        self.create_products(1)
+        expected = get_products(self.client.get(self.url))
+        ProductListing.objects.filter(product__slug__in=['product-0', 'child-0-1']).delete()
+
+        with self.assertLogs('products.listing', 'WARNING'):
+            response = self.client.get(self.url)
+        self.assertEqual(get_products(response), expected)
+        # Requests never save listings
+        self.assertEqual(ProductListing.objects.count(), 2)
+
+    @override_settings(CACHE_RESPONSES=True)
+    def test_unknown_category(self):
+        response = self.client.get('/api/v1/products/categories/unknown/products/list')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 0)
+        self.assertEqual(self.client.get('/api/v1/products/categories/unknown/products/list',
+                                         HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class CatalogPaginationTestCase(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Catalog', slug='catalog')
+        for i, price in enumerate([300, None, 100, 300, None, 100, 200, 300]):
+            product = Product.objects.create(name='Silver ring %s' % ('x' * i), slug='ring-%s' % i, art=i,
+                                             price=price)
+            product.categories.add(category)
+        rebuild_products_listings()
+        rebuild_products_search()
+
+    def get_pages(self, url, params):
+        ids = []
+        params = dict(params, cursor='', size=2)
+        response = self.client.get(url, params)
+        # A repeated cursor would never end the pages
+        for _ in range(Product.objects.count()):
+            self.assertEqual(response.status_code, 200)
+            ids.extend(product['id'] for product in response.data['results'])
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+        return ids
+
+    def get_sorted_ids(self, descending):
+        products = Product.objects.values_list('price', 'id')
+        with_price = sorted((product for product in products if product[0] is not None), reverse=descending)
+        return [product_id for _, product_id in with_price] + sorted(
+            (product_id for price, product_id in products if price is None), reverse=descending
+        )
+
+    def test_pages(self):
+        url = '/api/v1/products/categories/catalog/products/list'
+        self.assertEqual(self.get_pages(url, {'sortby': 'price'}), self.get_sorted_ids(False))
+        self.assertEqual(self.get_pages(url, {'sortby': 'price', 'direction': 'desc'}), self.get_sorted_ids(True))
+
+    def test_search_pages(self):
+        # Products of the same similarity are ordered by the id in the direction of the similarity
+        with similarity_threshold():
+            expected = list(search_products(get_searchable_products(), 'silver ring').order_by(
+                '-similarity', '-id'
+            ).values_list('id', flat=True))
+        self.assertEqual(len(expected), 8)
+        self.assertEqual(self.get_pages('/api/v1/products/search/list', {'text': 'silver ring'}), expected)
+
+    @override_settings(PRODUCTS_FACET_INDEX=True, CACHE_RESPONSES=True)
+    def test_index_pages(self):
+        facet_index._index = FacetIndex()
+        facet_index._index.build()
+        self.addCleanup(setattr, facet_index, '_index', None)
+        url = '/api/v1/products/categories/catalog/products/list'
+        self.assertEqual(self.get_pages(url, {'sortby': 'price'}), self.get_sorted_ids(False))
+        self.assertEqual(self.get_pages(url, {'sortby': 'price', 'direction': 'desc'}), self.get_sorted_ids(True))
+
+        # Only the products of the page are fetched
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, {'sortby': 'price', 'direction': 'desc', 'size': 3, 'page': 2})
+        self.assertEqual(response.data['count'], 8)
+        prices = [Product.objects.get(id=product['id']).price for product in response.data['results']]
+        self.assertEqual(prices, [300, 300, 200])
+        products_query = [query['sql'] for query in context.captured_queries
+                          if query['sql'].startswith('SELECT "products_product"."id"') and ' IN (' in query['sql']]
+        self.assertEqual(products_query[0].split(' IN (')[1].split(')')[0].count(','), 2)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/v1/products/categories/catalog/products/list', {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHE_RESPONSES=True)
+class ProductAdminCsvTestCase(TransactionTestCase):
+    """
+    Updates of the uploaded files are committed, the listings and the search documents are updated on commit.
+    """
+
+    def setUp(self):
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        category = Category.objects.create(name='Catalog', slug='catalog')
+        special = Special.objects.create(name='Sale', slug='sale', deadline=timezone.now() + timedelta(days=1),
+                                         discount_amount=10, activity=True)
+        special.categories.add(category)
+        self.product = Product.objects.create(name='Ring', slug='ring', art=3491, price=100)
+        self.product.categories.add(category)
+
+    def upload(self, url, rows):
+        csv_file = SimpleUploadedFile('file.csv', '\n'.join(rows).encode('utf-8'))
+        return self.client.post(url, {'csv_file': csv_file})
+
+    def test_update_prices(self):
+        url = '/api/v1/products/categories/catalog/products/ring/detail'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(ProductListing.objects.get(product=self.product).special_price, 90)
+
+        last_change = ProductChange.objects.order_by('-id').values_list('id', flat=True).first()
+        response = self.upload('/admin/products/product/update-prices/', ['3491;5,00;200,00'])
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(ProductListing.objects.get(product=self.product).special_price, 180)
+        # Only the updated products are reloaded by the facet indexes
+        self.assertEqual(list(ProductChange.objects.filter(id__gt=last_change).values_list('product_id', flat=True)),
+                         [self.product.id])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_update_names(self):
+        response = self.upload('/admin/products/product/update-names/', ['art;name', '3491;Agate ring'])
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(ProductSearch.objects.get(product=self.product).name, 'Agate ring')
+
+
+class PropertiesFilterTestCase(APITestCase):
+    url = '/api/v1/products/categories/catalog/products/list'
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Catalog', slug='catalog')
+        metal = ProductProperty.objects.create(name='Metal', slug='metal', type=ProductProperty.TEXT)
+        weight = ProductProperty.objects.create(name='Weight', slug='weight', type=ProductProperty.FLOAT)
+        engraving = ProductProperty.objects.create(name='Engraving', slug='engraving', type=ProductProperty.BOOLEAN)
+        cls.products = []
+        for i, (metal_value, weight_value, engraving_value) in enumerate([
+                ('gold', 2.5, True), ('silver', 4, False), ('silver', None, True), ('white gold', 10, None)]):
+            product = Product.objects.create(name='Ring %s' % i, slug='ring-%s' % i, art=i)
+            product.categories.add(category)
+            ProductPropertyValue.objects.create(product=product, prop=metal, value_text=metal_value)
+            if weight_value is not None:
+                ProductPropertyValue.objects.create(product=product, prop=weight, value_float=weight_value)
+            if engraving_value is not None:
+                ProductPropertyValue.objects.create(product=product, prop=engraving, value_boolean=engraving_value)
+            cls.products.append(product)
+        Product.update_properties_documents([product.id for product in cls.products])
+
+    def get_products(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return {self.products.index(Product.objects.get(id=product['id'])) for product in response.data['results']}
+
+    def test_filters(self):
+        self.assertEqual(self.get_products({'engraving_b': 'true'}), {0, 2})
+        self.assertEqual(self.get_products({'engraving_b': 'false'}), {0, 1, 2, 3})
+        self.assertEqual(self.get_products({'metal_t': 'silver'}), {1, 2})
+        self.assertEqual(self.get_products({'metal_t': 'gold|;|white gold'}), {0, 3})
+        self.assertEqual(self.get_products({'weight_d': '3,10'}), {1, 3})
+        # Products without the value are taken as having 0
+        self.assertEqual(self.get_products({'weight_d': '0,3'}), {0, 2})
+        self.assertEqual(self.get_products({'metal_t': 'silver', 'weight_d': '0,5', 'engraving_b': 'true'}), {2})
+        self.assertEqual(self.get_products({'unknown_t': 'silver'}), set())
+
+    def test_malformed_range(self):
+        for value in ('3', '3,', 'a,b', '1,2,3'):
+            response = self.client.get(self.url, {'weight_d': value})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('weight_d', response.data)
+
+
+class PropertiesDocumentTestCase(TransactionTestCase):
+    """
+    Documents are updated on commit of the changes of the properties and of their values.
+    """
+
+    def setUp(self):
+        self.parent = Product.objects.create(name='Ring', slug='ring', art=1, kind=Product.PARENT)
+        self.child = Product.objects.create(name='17', slug='ring-17', art=2, kind=Product.CHILD, parent=self.parent)
+        self.metal = ProductProperty.objects.create(name='Metal', slug='metal', type=ProductProperty.TEXT)
+        self.size = ProductProperty.objects.create(name='Size', slug='size', type=ProductProperty.FLOAT)
+
+    def get_document(self, product):
+        product.refresh_from_db(fields=['properties_document'])
+        return product.properties_document
+
+    def test_values(self):
+        metal = ProductPropertyValue.objects.create(product=self.parent, prop=self.metal, value_text='gold')
+        size = ProductPropertyValue.objects.create(product=self.child, prop=self.size, value_float=17)
+        self.assertEqual(self.get_document(self.parent), {'metal': 'gold'})
+        self.assertEqual(self.get_document(self.child), {'metal': 'gold', 'size': 17})
+
+        metal.value_text = 'silver'
+        metal.save()
+        self.assertEqual(self.get_document(self.child), {'metal': 'silver', 'size': 17})
+
+        size.delete()
+        self.assertEqual(self.get_document(self.child), {'metal': 'silver'})
+        metal.delete()
+        self.assertEqual(self.get_document(self.parent), {})
+        self.assertEqual(self.get_document(self.child), {})
+
+    def test_property_slug(self):
+        ProductPropertyValue.objects.create(product=self.parent, prop=self.metal, value_text='gold')
+        self.metal.slug = 'material'
+        self.metal.save()
+        self.assertEqual(self.get_document(self.parent), {'material': 'gold'})
+        self.assertEqual(self.get_document(self.child), {'material': 'gold'})
+
+
+class FacetIndexTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Catalog', slug='catalog')
+        cls.color = ProductProperty.objects.create(name='Color', slug='color', type=ProductProperty.TEXT)
+        cls.weight = ProductProperty.objects.create(name='Weight', slug='weight', type=ProductProperty.FLOAT)
+        cls.products = []
+        for i, color in enumerate(['red', 'green', 'red']):
+            product = Product.objects.create(name='Product %s' % i, slug='product-%s' % i, art=i)
+            product.categories.add(cls.category)
+            ProductPropertyValue.objects.create(product=product, prop=cls.color, value_text=color)
+            ProductPropertyValue.objects.create(product=product, prop=cls.weight, value_float=i)
+            cls.products.append(product)
+
+    def get_products_ids(self, index, query_params):
+        bitmap = index.get_products_bitmap([Product.UNIQUE], categories_ids=[self.category.id])
+        return set(index.get_products_ids(index.filter_bitmap(bitmap, query_params)))
+
+    def test_filters_and_facets(self):
+        index = FacetIndex()
+        index.build()
+        first, second, third = [product.id for product in self.products]
+
+        self.assertEqual(self.get_products_ids(index, {'color_t': 'red'}), {first, third})
+        self.assertEqual(self.get_products_ids(index, {'weight_d': '1,2'}), {second, third})
+        self.assertEqual(self.get_products_ids(index, {'unknown_t': 'red'}), set())
+        self.assertEqual(index.get_facets(index.get_products_bitmap([Product.UNIQUE])), {
+            self.color.id: {'options': ['green', 'red'], 'counts': {'green': 1, 'red': 2}},
+            self.weight.id: {'min': 0, 'max': 2},
+        })
+
+    def test_refresh_reloads_changed_products(self):
+        index = FacetIndex()
+        index.build()
+        product = self.products[0]
+
+        ProductPropertyValue.objects.filter(product=product, prop=self.color).update(value_text='green')
+        product.categories.clear()
+        log_products_changes([product.id])
+        self.assertTrue(index.is_stale())
+        refreshed = index.copy()
+        refreshed.refresh()
+        self.assertFalse(refreshed.is_stale())
+
+        self.assertEqual(self.get_products_ids(refreshed, {'color_t': 'green'}), {self.products[1].id})
+        self.assertEqual(refreshed.get_facets(refreshed.get_products_bitmap([Product.UNIQUE]))[self.color.id]['counts'],
+                         {'green': 2, 'red': 1})
+        # The copied index is not changed by the refresh
+        self.assertEqual(index.get_facets(index.get_products_bitmap([Product.UNIQUE]))[self.color.id]['counts'],
+                         {'green': 1, 'red': 2})
+
+    @override_settings(PRODUCTS_FACET_INDEX=True)
+    def test_use_facet_index(self):
+        # The update is taken as running in background, no thread is started by the test
+        facet_index._index, facet_index._index_updating = None, True
+        self.addCleanup(setattr, facet_index, '_index', None)
+        self.addCleanup(setattr, facet_index, '_index_updating', False)
+        with facet_index.use_facet_index() as index:
+            self.assertIsNone(index)
+
+        facet_index._index = FacetIndex()
+        facet_index._index.build()
+        with facet_index.use_facet_index() as index:
+            self.assertIs(index, facet_index._index)
+
+        # Products are read from the database until the changes are loaded
+        log_products_changes([self.products[0].id])
+        with facet_index.use_facet_index() as index:
+            self.assertIsNone(index)
+
+
+class ProductSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rings = Category.objects.create(name='Rings', slug='rings')
+        cls.category = Category.objects.create(name='Silver', slug='silver', parent=rings)
+        cls.tag = Tag.objects.create(name='Wedding')
+        brand = Brand.objects.create(name='Klio', slug='klio')
+        cls.ring = Product.objects.create(name='Agate ring', slug='agate-ring', art=3491, kind=Product.PARENT,
+                                          brand=brand)
+        cls.ring.categories.add(cls.category)
+        cls.ring.tags.add(cls.tag)
+        cls.child = Product.objects.create(name='17', slug='agate-ring-17', art=3492, kind=Product.CHILD,
+                                           parent=cls.ring)
+        cls.brooch = Product.objects.create(name='Topaz brooch', slug='topaz-brooch', art=1200)
+        cls.brooch.categories.add(cls.category)
+
+    def search(self, text):
+        with similarity_threshold():
+            return list(search_products(get_searchable_products(), text).values_list('id', flat=True))
+
+    def test_search(self):
+        self.assertEqual(rebuild_products_search(), 3)
+        self.assertEqual(ProductSearch.objects.values_list('tags', 'brand', 'categories').get(product=self.child),
+                         ('Wedding', 'Klio', 'Rings Silver'))
+
+        self.assertEqual(self.search('topas brooch'), [self.brooch.id])
+        self.assertEqual(self.search('3492'), [self.child.id])
+        self.assertEqual(self.search('wedding'), [self.child.id])
+        self.assertEqual(self.search('rings'), [self.child.id, self.brooch.id])
+        with similarity_threshold():
+            self.assertEqual(list(search_products_by_art(get_searchable_products(), '1200', 0.7).values_list(
+                'id', flat=True)), [self.brooch.id])
+
+        self.tag.name = 'Engagement'
+        self.tag.save()
+        # Updated on commit, there's no commit in the test
+        self.assertEqual(self.search('engagement'), [])
+        rebuild_products_search()
+        self.assertEqual(self.search('engagement'), [self.child.id])
+
+
+class SuggestionIndexTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Кольца', slug='rings')
+        cls.tag = Tag.objects.create(name='Свадьба')
+        cls.ring = Product.objects.create(name='Кольцо с агатом', slug='agate-ring', art=3491, kind=Product.PARENT)
+        cls.child = Product.objects.create(name='17', slug='agate-ring-17', art=3492, kind=Product.CHILD,
+                                           parent=cls.ring)
+        cls.brooch = Product.objects.create(name='Брошь Topaz', slug='topaz-brooch', art=1200)
+
+    def suggest(self, index, text):
+        return [(suggestion['type'], suggestion['text']) for suggestion in index.suggest(text)]
+
+    def test_suggest(self):
+        index = SuggestionIndex()
+        index.build()
+
+        self.assertEqual(self.suggest(index, 'кол'), [('category', 'Кольца'), ('product', 'Кольцо с агатом')])
+        self.assertEqual(self.suggest(index, 'агат'), [('product', 'Кольцо с агатом')])
+        self.assertEqual(self.suggest(index, 'ко аг'), [('product', 'Кольцо с агатом')])
+        self.assertEqual(self.suggest(index, 'топаз'), [])
+        self.assertEqual(self.suggest(index, 'top'), [('product', 'Брошь Topaz')])
+        # Typed in the other layout
+        self.assertEqual(self.suggest(index, 'cdfl'), [('tag', 'Свадьба')])
+        self.assertEqual(self.suggest(index, 'ещз'), [('product', 'Брошь Topaz')])
+        self.assertEqual(index.suggest('349'), [
+            {'type': 'art', 'id': self.ring.id, 'text': '3491', 'name': 'Кольцо с агатом', 'slug': 'agate-ring'},
+            {'type': 'art', 'id': self.child.id, 'text': '3492', 'name': 'Кольцо с агатом 17', 'slug': 'agate-ring'},
+        ])
+
+    def test_refresh_reloads_changed_entries(self):
+        index = SuggestionIndex()
+        index.build()
+
+        Product.objects.filter(id=self.ring.id).update(name='Перстень с агатом')
+        Product.objects.filter(id=self.brooch.id).update(activity=False)
+        log_products_changes([self.ring.id, self.brooch.id])
+        self.tag.name = 'Помолвка'
+        self.tag.save()
+        index.refresh()
+
+        self.assertEqual(self.suggest(index, 'кол'), [('category', 'Кольца')])
+        self.assertEqual(self.suggest(index, 'п'), [('tag', 'Помолвка'), ('product', 'Перстень с агатом')])
+        self.assertEqual(self.suggest(index, 'top'), [])
+        self.assertEqual(index.suggest('3492')[0]['name'], 'Перстень с агатом 17')
+        keys = index.keys
+        index._index_entries()
+        self.assertEqual({group: group_keys for group, group_keys in keys.items() if group_keys}, index.keys)
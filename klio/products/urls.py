@@ -3,7 +3,8 @@ from django.urls import path
 from .views import (BrandListView, CategoryDetailView, CategoryListView, CategoryMainListView, CategoryFilterListView,
                     CategoryProductListView, BrandDetailView, BrandFilterListView, BrandProductListView,
                     NewFilterListView, NewProductListView, FavoriteCreateView, FavoriteDeleteView, FavoriteListView,
-                    ProductDetailView, ProductMainNewListView, ProductMainSpecialListView, SearchProductListView)
+                    ProductDetailView, ProductMainNewListView, ProductMainSpecialListView, SearchProductListView,
+                    SuggestionListView)
 
 
 urlpatterns = [
@@ -25,4 +26,5 @@ urlpatterns = [
     path('list/mainpage/new', ProductMainNewListView.as_view()),
     path('list/mainpage/special', ProductMainSpecialListView.as_view()),
     path('search/list', SearchProductListView.as_view(), name='search_products_list'),
+    path('search/suggestions', SuggestionListView.as_view(), name='search_suggestions'),
 ]
@@ -1,3 +1,4 @@
+from django.db import transaction
 from django.http import HttpResponse
 
 
@@ -22,3 +23,49 @@ def export_products_names_csv(modeladmin, request, queryset):
 
 
 export_products_names_csv.short_description = u"Экспорт наименований товаров (CSV)"
+
+
+class PendingUpdates(object):
+    """
+    Updates of the derived products data waiting for the transaction to be committed.
+    All the updates of one kind made in the transaction are collected into a single call.
+    """
+
+    def __init__(self):
+        self.updates = {}
+
+    def __call__(self):
+        for func, ids in self.updates.items():
+            if ids is None:
+                func()
+            else:
+                func(ids)
+
+    @classmethod
+    def get_current(cls):
+        for _, func in transaction.get_connection().run_on_commit:
+            if isinstance(func, cls):
+                return func
+        pending = cls()
+        transaction.on_commit(pending)
+        return pending
+
+
+def schedule_update(func, ids=None):
+    """
+    Calls `func(ids)` (or `func()` if no ids are given) after the current transaction is committed,
+    or immediately if there's no transaction. Ids of the same function are merged.
+    """
+    if ids is not None:
+        ids = set(ids)
+        if not ids:
+            return
+    if not transaction.get_connection().in_atomic_block:
+        return func() if ids is None else func(ids)
+
+    # No ids means the update of everything, which covers the updates of the ids
+    updates = PendingUpdates.get_current().updates
+    if ids is None:
+        updates[func] = None
+    elif updates.setdefault(func, set()) is not None:
+        updates[func].update(ids)
@@ -1,63 +1,127 @@
 from datetime import datetime, timedelta
-from django.contrib.postgres.search import TrigramSimilarity
-from django.db.models import CharField, Q
-from django.db.models.functions import Cast
+from django.db.models import Count, Q
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 
 from rest_framework.generics import CreateAPIView, DestroyAPIView, ListAPIView, RetrieveAPIView
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-
-from .models import Brand, Category, Product, ProductProperty, ProductPropertyValue, UserProduct
+from rest_framework.views import APIView
+
+from general.cache import CachedResponseMixin, ConditionalResponseMixin
+from sale.models import Special, SpecialProduct
+from tags.models import Tag
+from .facet_index import IndexedProducts, get_catalog_version, use_facet_index
+from .facets import get_products_facets
+from .filters import filter_products
+from .listing import NEW_PRODUCT_PERIOD, prefetch_products_listing
+from .models import (Brand, Category, Product, ProductImage, ProductProperty, ProductPropertyValue, Unit,
+                     UserProduct)
+from .pagination import CatalogPagination, get_sort_key
+from .search import get_searchable_products, search_products, search_products_by_art, similarity_threshold
 from .serializers import (BrandListSerializer, CategoryCatalogSerializer, CategorySerializer, CategoryListSerializer, FilterListSerializer,
                           ProductSerializer, ProductListSerializer)
+from .suggestions import MAX_SUGGESTIONS_LIMIT, SUGGESTIONS_LIMIT, get_suggestions
+
+
+# Models the products listings are calculated from
+PRODUCT_LIST_MODELS = (Product, ProductImage, Brand, Category, Special, SpecialProduct)
+
+# Models the product details are serialized from
+PRODUCT_MODELS = PRODUCT_LIST_MODELS + (ProductProperty, ProductPropertyValue, Tag, Unit)
+
 
+class CatalogResponseMixin(ConditionalResponseMixin):
+    def get_validator_versions(self):
+        # Bulk updates of the products send no signals and keep the modification time, they are only logged
+        return super(CatalogResponseMixin, self).get_validator_versions() + [get_catalog_version()]
 
-class DynamicPageNumberPagination(PageNumberPagination):
-    page_size_query_param = 'size'
-    max_page_size = 100
 
+class ProductListResponseMixin(CatalogResponseMixin):
+    cache_models = PRODUCT_LIST_MODELS
 
-class BrandListView(ListAPIView):
+    def get_validator_aggregates(self):
+        aggregates = super(ProductListResponseMixin, self).get_validator_aggregates()
+        # Calculated novelty of the products ends with time
+        aggregates['new'] = Count('pk', filter=Q(listing__new_until__gt=timezone.now()))
+        return aggregates
+
+    def get_validator_values(self):
+        queryset = self.get_validator_queryset()
+        if isinstance(queryset, IndexedProducts):
+            return queryset.get_validator_values()
+        return queryset.aggregate(**self.get_validator_aggregates())
+
+
+class BrandListView(CachedResponseMixin, ConditionalResponseMixin, ListAPIView):
+    cache_models = (Brand,)
     serializer_class = BrandListSerializer
     queryset = Brand.objects.filter(activity=True)
 
 
-class CategoryDetailView(RetrieveAPIView):
+class CategoryDetailView(ConditionalResponseMixin, RetrieveAPIView):
+    cache_models = (Category,)
     lookup_field = 'slug'
     serializer_class = CategorySerializer
     queryset = Category.objects.filter(activity=True)
 
 
-class CategoryListView(ListAPIView):
+class CategoryListView(CachedResponseMixin, ConditionalResponseMixin, ListAPIView):
+    cache_models = (Category,)
     serializer_class = CategoryCatalogSerializer
     queryset = Category.objects.filter(activity=True, parent__isnull=True)
 
 
-class CategoryMainListView(ListAPIView):
+class CategoryMainListView(CachedResponseMixin, ConditionalResponseMixin, ListAPIView):
+    cache_models = (Category,)
     serializer_class = CategoryListSerializer
     queryset = Category.objects.filter(activity=True, on_main=True)[:2]
 
 
-class CategoryFilterListView(ListAPIView):
+class ProductFilterListMixin(object):
+    """
+    Lists the filters of the products given by the view's `get_products_ids()`
+    or, with the facet index, by its `get_products_bitmap(index)`.
+    """
     serializer_class = FilterListSerializer
 
+    def get_products_bitmap(self, index):
+        """
+        Returns the bitmap of the products in the facet index, None if the view does not use the index.
+        """
+        return None
+
+    def get_queryset(self, products_ids=None):
+        queryset = ProductProperty.objects.filter(
+            values__product__in=products_ids, activity=True
+        ).select_related('units').distinct()
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        with use_facet_index() as index:
+            bitmap = self.get_products_bitmap(index) if index is not None else None
+            if bitmap is not None:
+                properties = ProductProperty.objects.filter(
+                    id__in=index.get_properties_ids(bitmap), activity=True
+                ).select_related('units')
+                serializer = self.serializer_class(properties, many=True,
+                                                   context={'request': self.request,
+                                                            'facets': index.get_facets(bitmap)})
+                return Response(serializer.data)
+
+        products_ids = self.get_products_ids()
+        serializer = self.serializer_class(self.get_queryset(products_ids), many=True,
+                                           context={'request': self.request,
+                                                    'facets': get_products_facets(products_ids)})
+        return Response(serializer.data)
+
+
+class CategoryFilterListView(ProductFilterListMixin, ListAPIView):
     def get_products_ids(self):
-        # Get the category id
-        categories_ids = list(Category.objects.filter(
-            slug=self.kwargs['slug'], activity=True
-        ).values_list('id', flat=True))
+        # Get the category and all nested categories ids
+        categories_ids = list(Category.get_active_descendants_ids(self.kwargs['slug']))
         if not categories_ids:
-            return None
-
-        # Get all nested categories ids
-        parents = categories_ids
-        children = True
-        while children:
-            children = list(Category.objects.filter(activity=True, parent_id__in=parents).values_list('id', flat=True))
-            categories_ids += children
-            parents = children
+            return Product.objects.none()
 
         # Get the products ids
         products_ids = Product.objects.filter(activity=True, kind__in=[Product.UNIQUE, Product.CHILD]).filter(
@@ -65,125 +129,40 @@ class CategoryFilterListView(ListAPIView):
         ).values_list('id', flat=True)
         return products_ids
 
-    def get_queryset(self):
-        queryset = ProductProperty.objects.filter(
-            values__product__in=self.get_products_ids(), activity=True
-        ).distinct()
-        return queryset
+    def get_products_bitmap(self, index):
+        categories_ids = list(Category.get_active_descendants_ids(self.kwargs['slug']))
+        return index.get_products_bitmap([Product.UNIQUE, Product.CHILD], categories_ids=categories_ids)
 
-    def list(self, request, *args, **kwargs):
-        serializer = self.serializer_class(self.get_queryset(), many=True,
-                                           context={'request': self.request, 'products_ids': self.get_products_ids()})
-        return Response(serializer.data)
 
-
-class CategoryProductListView(ListAPIView):
+class CategoryProductListView(ProductListResponseMixin, ListAPIView):
     serializer_class = ProductListSerializer
-    pagination_class = DynamicPageNumberPagination
+    pagination_class = CatalogPagination
 
     def get_queryset(self):
-        query_dict = self.request.query_params.copy()
-        sort_by = query_dict.get('sortby')
-        direction = query_dict.get('direction', None)
-        in_stock = query_dict.get('in_stock', None)
-        for k in ('sortby', 'direction', 'size', 'page', 'in_stock'):
-            query_dict.pop(k, None)
-        prop_filters = query_dict
-
-        # Get the category id
-        categories_ids = list(Category.objects.filter(
-            activity=True, slug=self.kwargs['slug']
-        ).values_list('id', flat=True))
+        # Get the category and all nested categories ids
+        categories_ids = list(Category.get_active_descendants_ids(self.kwargs['slug']))
         if not categories_ids:
-            return []
-
-        # Get all nested categories ids
-        parents = categories_ids
-        children = True
-        while children:
-            children = list(Category.objects.filter(activity=True, parent_id__in=parents).values_list('id', flat=True))
-            categories_ids += children
-            parents = children
+            return Product.objects.none()
 
-        if not categories_ids:
-            return []
+        with use_facet_index() as index:
+            if index is not None:
+                bitmap = index.get_products_bitmap([Product.UNIQUE, Product.PARENT], categories_ids=categories_ids)
+                return index.get_products(bitmap, self.request.query_params)
 
         queryset = Product.objects.filter(activity=True, kind__in=[Product.UNIQUE, Product.PARENT]).filter(
             Q(categories__in=categories_ids) | Q(parent__categories__in=categories_ids)
         )
-
-        if not queryset:
-            return []
-
-        # Filtering block
-        if in_stock:
-            queryset = queryset.filter(in_stock__gt=0)
-
-        for key, value in prop_filters.items():
-            [prop_name, prop_type] = key.split("_")
-
-            value = query_dict.get(key)
-            value = True if value == 'true' else False if value == 'false' else value.split("|;|")
-
-            # Filter by boolean type properties
-            if prop_type == 'b' and value:
-                pvs_ids = list(ProductPropertyValue.objects.filter(
-                    prop__slug=prop_name, value_boolean=value).values_list('id', flat=True))
-                queryset = queryset.filter(property_values__in=pvs_ids)
-
-                # ids = [product.id for product in queryset if
-                #        product.get_actual_value_by_property_slug(prop_name)]
-                # queryset = queryset.filter(id__in=ids)
-
-            # Filter by text (choices) type properties. Example: prop=['var1', 'var2', ...]
-            if prop_type == 't':
-                pvs_ids = list(ProductPropertyValue.objects.filter(
-                    prop__slug=prop_name, value_text__in=value).values_list('id', flat=True))
-                queryset = queryset.filter(property_values__in=pvs_ids)
-
-                # ids = [product.id for product in queryset if
-                #        product.get_actual_value_by_property_slug(prop_name) in value]
-                # queryset = queryset.filter(id__in=ids)
-
-            # Filter by digit (int/float) type properties. Example: prop=[100, 1090]
-            if prop_type == 'd' and isinstance(value, list):
-                value = value[0].split(',')
-                # pvs_ids = list(ProductPropertyValue.objects.filter(
-                #     Q(value_integer=value) | Q(value_float=value), prop__slug=prop_name).values_list('id', flat=True))
-                # queryset = queryset.filter(property_values__in=pvs_ids)
-                ids = [product.id for product in queryset if
-                       float(value[0]) <= product.get_actual_value_by_property_slug(prop_name) <= float(value[1])]
-                queryset = queryset.filter(id__in=ids)
-
-        # Sorting block
-        ordering = []
-        if sort_by == 'name':
-            if direction == 'asc':
-                # queryset = queryset.order_by('name')
-                ordering.append('name')
-            if direction == 'desc':
-                # queryset = queryset.order_by('-name')
-                ordering.append('-name')
-        if sort_by == 'price':
-            if direction == 'desc':
-                # queryset = queryset.order_by('-price')
-                ordering.append('-price')
-            else:
-                # queryset = queryset.order_by('price')
-                ordering.append('price')
-        ordering.append('order')
-        return queryset.order_by(*ordering)
+        return prefetch_products_listing(filter_products(queryset, self.request.query_params))
 
 
-class BrandDetailView(RetrieveAPIView):
+class BrandDetailView(ConditionalResponseMixin, RetrieveAPIView):
+    cache_models = (Brand,)
     lookup_field = 'slug'
     serializer_class = BrandListSerializer
     queryset = Brand.objects.filter(activity=True)
 
 
-class BrandFilterListView(ListAPIView):
-    serializer_class = FilterListSerializer
-
+class BrandFilterListView(ProductFilterListMixin, ListAPIView):
     def get_products_ids(self):
         # Get the products ids
         products_ids = Product.objects.filter(activity=True, kind__in=[Product.UNIQUE, Product.PARENT]).filter(
@@ -191,77 +170,31 @@ class BrandFilterListView(ListAPIView):
         ).values_list('id', flat=True)
         return products_ids
 
-    def get_queryset(self):
-        queryset = ProductProperty.objects.filter(
-            values__product__in=self.get_products_ids(), activity=True
-        ).distinct()
-        return queryset
-
-    def list(self, request, *args, **kwargs):
-        serializer = self.serializer_class(self.get_queryset(), many=True,
-                                           context={'request': self.request, 'products_ids': self.get_products_ids()})
-        return Response(serializer.data)
+    def get_products_bitmap(self, index):
+        brands_ids = list(Brand.objects.filter(activity=True, slug=self.kwargs['slug']).values_list('id', flat=True))
+        return index.get_products_bitmap([Product.UNIQUE, Product.PARENT], brands_ids=brands_ids)
 
 
-class BrandProductListView(ListAPIView):
+class BrandProductListView(ProductListResponseMixin, ListAPIView):
     serializer_class = ProductListSerializer
-    pagination_class = DynamicPageNumberPagination
+    pagination_class = CatalogPagination
 
     def get_queryset(self):
-        query_dict = self.request.query_params.copy()
-        sort_by = query_dict.get('sortby')
-        direction = query_dict.get('direction', None)
-        in_stock = query_dict.get('in_stock', None)
-        for k in ('sortby', 'direction', 'size', 'page', 'in_stock'):
-            query_dict.pop(k, None)
-        prop_filters = query_dict
+        with use_facet_index() as index:
+            if index is not None:
+                brands_ids = list(Brand.objects.filter(
+                    activity=True, slug=self.kwargs['slug']
+                ).values_list('id', flat=True))
+                bitmap = index.get_products_bitmap([Product.UNIQUE, Product.PARENT], brands_ids=brands_ids)
+                return index.get_products(bitmap, self.request.query_params)
+
         queryset = Product.objects.filter(activity=True, kind__in=[Product.UNIQUE, Product.PARENT]).filter(
             brand__activity=True, brand__slug=self.kwargs['slug']
         )
-        if not queryset:
-            return []
-        # Filtering block
-        if in_stock:
-            queryset = queryset.filter(in_stock__gt=0)
-        for key, value in prop_filters.items():
-            [prop_name, prop_type] = key.split("_")
-            value = query_dict.get(key)
-            value = True if value == 'true' else False if value == 'false' else value.split("|;|")
-            # Filter by boolean type properties
-            if prop_type == 'b' and value:
-                pvs_ids = list(ProductPropertyValue.objects.filter(
-                    prop__slug=prop_name, value_boolean=value).values_list('id', flat=True))
-                queryset = queryset.filter(property_values__in=pvs_ids)
-            # Filter by text (choices) type properties. Example: prop=['var1', 'var2', ...]
-            if prop_type == 't':
-                pvs_ids = list(ProductPropertyValue.objects.filter(
-                    prop__slug=prop_name, value_text__in=value).values_list('id', flat=True))
-                queryset = queryset.filter(property_values__in=pvs_ids)
-            # Filter by digit (int/float) type properties. Example: prop=[100, 1090]
-            if prop_type == 'd' and isinstance(value, list):
-                value = value[0].split(',')
-                ids = [product.id for product in queryset if
-                       float(value[0]) <= product.get_actual_value_by_property_slug(prop_name) <= float(value[1])]
-                queryset = queryset.filter(id__in=ids)
-        # Sorting block
-        ordering = []
-        if sort_by == 'name':
-            if direction == 'asc':
-                ordering.append('name')
-            if direction == 'desc':
-                ordering.append('-name')
-        if sort_by == 'price':
-            if direction == 'desc':
-                ordering.append('-price')
-            else:
-                ordering.append('price')
-        ordering.append('order')
-        return queryset.order_by(*ordering)
+        return prefetch_products_listing(filter_products(queryset, self.request.query_params))
 
 
-class NewFilterListView(ListAPIView):
-    serializer_class = FilterListSerializer
-
+class NewFilterListView(ProductFilterListMixin, ListAPIView):
     def get_products_ids(self):
         # Get the products ids
         products_ids = Product.objects.filter(activity=True, kind__in=[Product.UNIQUE, Product.PARENT]).filter(
@@ -269,72 +202,24 @@ class NewFilterListView(ListAPIView):
         ).values_list('id', flat=True)
         return products_ids
 
-    def get_queryset(self):
-        queryset = ProductProperty.objects.filter(
-            values__product__in=self.get_products_ids(), activity=True
-        ).distinct()
-        return queryset
-
-    def list(self, request, *args, **kwargs):
-        serializer = self.serializer_class(self.get_queryset(), many=True,
-                                           context={'request': self.request, 'products_ids': self.get_products_ids()})
-        return Response(serializer.data)
+    def get_products_bitmap(self, index):
+        return index.get_products_bitmap([Product.UNIQUE, Product.PARENT], new=True)
 
 
-class NewProductListView(ListAPIView):
+class NewProductListView(ProductListResponseMixin, ListAPIView):
     serializer_class = ProductListSerializer
-    pagination_class = DynamicPageNumberPagination
+    pagination_class = CatalogPagination
 
     def get_queryset(self):
-        query_dict = self.request.query_params.copy()
-        sort_by = query_dict.get('sortby')
-        direction = query_dict.get('direction', None)
-        in_stock = query_dict.get('in_stock', None)
-        for k in ('sortby', 'direction', 'size', 'page', 'in_stock'):
-            query_dict.pop(k, None)
-        prop_filters = query_dict
+        with use_facet_index() as index:
+            if index is not None:
+                bitmap = index.get_products_bitmap([Product.UNIQUE, Product.PARENT], new=True)
+                return index.get_products(bitmap, self.request.query_params)
+
         queryset = Product.objects.filter(activity=True, kind__in=[Product.UNIQUE, Product.PARENT]).filter(
             Q(is_new=Product.NEW) | Q(Q(is_new=Product.CALCULATED), Q(created__gte=datetime.now() - timedelta(days=60)))
         )
-        if not queryset:
-            return []
-        # Filtering block
-        if in_stock:
-            queryset = queryset.filter(in_stock__gt=0)
-        for key, value in prop_filters.items():
-            [prop_name, prop_type] = key.split("_")
-            value = query_dict.get(key)
-            value = True if value == 'true' else False if value == 'false' else value.split("|;|")
-            # Filter by boolean type properties
-            if prop_type == 'b' and value:
-                pvs_ids = list(ProductPropertyValue.objects.filter(
-                    prop__slug=prop_name, value_boolean=value).values_list('id', flat=True))
-                queryset = queryset.filter(property_values__in=pvs_ids)
-            # Filter by text (choices) type properties. Example: prop=['var1', 'var2', ...]
-            if prop_type == 't':
-                pvs_ids = list(ProductPropertyValue.objects.filter(
-                    prop__slug=prop_name, value_text__in=value).values_list('id', flat=True))
-                queryset = queryset.filter(property_values__in=pvs_ids)
-            # Filter by digit (int/float) type properties. Example: prop=[100, 1090]
-            if prop_type == 'd' and isinstance(value, list):
-                value = value[0].split(',')
-                ids = [product.id for product in queryset if
-                       float(value[0]) <= product.get_actual_value_by_property_slug(prop_name) <= float(value[1])]
-                queryset = queryset.filter(id__in=ids)
-        # Sorting block
-        ordering = []
-        if sort_by == 'name':
-            if direction == 'asc':
-                ordering.append('name')
-            if direction == 'desc':
-                ordering.append('-name')
-        if sort_by == 'price':
-            if direction == 'desc':
-                ordering.append('-price')
-            else:
-                ordering.append('price')
-        ordering.append('order')
-        return queryset.order_by(*ordering)
+        return prefetch_products_listing(filter_products(queryset, self.request.query_params))
 
 
 class FavoriteCreateView(CreateAPIView):
@@ -375,13 +260,19 @@ class FavoriteListView(ListAPIView):
     def get_queryset(self):
         queryset = Product.objects.filter(activity=True, kind__in=[Product.UNIQUE, Product.CHILD],
                                           selected_by__user=self.request.user)
-        return queryset
+        return prefetch_products_listing(queryset)
 
 
-class ProductDetailView(RetrieveAPIView):
+class ProductDetailView(CatalogResponseMixin, RetrieveAPIView):
+    cache_models = PRODUCT_MODELS
     lookup_field = 'slug'
     serializer_class = ProductSerializer
 
+    def get_validator_aggregates(self):
+        aggregates = super(ProductDetailView, self).get_validator_aggregates()
+        aggregates['new'] = Count('pk', filter=Q(created__gt=timezone.now() - NEW_PRODUCT_PERIOD))
+        return aggregates
+
     def get_queryset(self):
         return Product.objects.filter(activity=True, kind__in=[Product.UNIQUE, Product.CHILD])
 
@@ -393,7 +284,7 @@ class ProductDetailView(RetrieveAPIView):
         return Response(serializer.data)
 
 
-class ProductMainNewListView(ListAPIView):
+class ProductMainNewListView(ProductListResponseMixin, ListAPIView):
     serializer_class = ProductListSerializer
 
     # def list(self, request, *args, **kwargs):
@@ -401,22 +292,8 @@ class ProductMainNewListView(ListAPIView):
 
     def get_queryset(self):
 
-        # Get all active categories with only active parents ids
-        categories_ids = list(Category.objects.filter(
-            activity=True, parent__isnull=True
-        ).distinct().values_list('id', flat=True))
-        parents = categories_ids
-        children = True
-        while children:
-            children = list(Category.objects.filter(
-                activity=True, parent_id__in=parents
-            ).distinct().values_list('id', flat=True))
-            categories_ids += children
-            parents = children
-
-        active_child_categories_ids = list(Category.objects.filter(
-            id__in=categories_ids, children__isnull=True
-        ).distinct().values_list('id', flat=True))
+        # Get all active leaf categories with only active parents ids
+        active_child_categories_ids = list(Category.get_active_leaves_ids())
 
         new_product_period = datetime.today() - timedelta(days=60)
 
@@ -424,26 +301,16 @@ class ProductMainNewListView(ListAPIView):
             Q(is_new='new') | Q(is_new='calculated', created__gte=new_product_period),
             activity=True, kind__in=[Product.UNIQUE, Product.CHILD], categories__in=active_child_categories_ids
         ).distinct()
-        return queryset[:20]
+        return prefetch_products_listing(queryset)[:20]
 
 
-class ProductMainSpecialListView(ListAPIView):
+class ProductMainSpecialListView(ProductListResponseMixin, ListAPIView):
     serializer_class = ProductListSerializer
 
     def get_queryset(self):
 
-        # Get all active categories with only active parents ids
-        categories_ids = list(Category.objects.filter(activity=True, parent__isnull=True).values_list('id', flat=True))
-        parents = categories_ids
-        children = True
-        while children:
-            children = list(Category.objects.filter(activity=True, parent_id__in=parents).values_list('id', flat=True))
-            categories_ids += children
-            parents = children
-
-        active_child_categories_ids = list(Category.objects.filter(
-            id__in=categories_ids, children__isnull=True
-        ).values_list('id', flat=True))
+        # Get all active leaf categories with only active parents ids
+        active_child_categories_ids = list(Category.get_active_leaves_ids())
 
         queryset = Product.objects.filter(
             activity=True, kind__in=[Product.UNIQUE, Product.CHILD],
@@ -452,12 +319,23 @@ class ProductMainSpecialListView(ListAPIView):
         ).filter(
             Q(categories__in=active_child_categories_ids) | Q(parent__categories__in=active_child_categories_ids)
         ).distinct()
-        return queryset[:20]
+        return prefetch_products_listing(queryset)[:20]
 
 
 class SearchProductListView(ListAPIView):
     serializer_class = ProductListSerializer
-    pagination_class = DynamicPageNumberPagination
+    pagination_class = CatalogPagination
+
+    def get_sort_key(self):
+        query_params = self.request.query_params
+        if query_params.get('sortby') not in ('name', 'price') and (
+                query_params.get('text') or query_params.get('article')):
+            return 'similarity', True
+        return get_sort_key(query_params, default='name')
+
+    def list(self, request, *args, **kwargs):
+        with similarity_threshold():
+            return super(SearchProductListView, self).list(request, *args, **kwargs)
 
     def get_queryset(self):
         direction = self.request.query_params.get('direction')
@@ -466,39 +344,16 @@ class SearchProductListView(ListAPIView):
         article = self.request.query_params.get('article')
         sort_by = self.request.query_params.get('sortby')
 
-        # Get all active categories with only active parents ids
-        categories_ids = list(Category.objects.filter(activity=True, parent__isnull=True).values_list('id', flat=True))
-        parents = categories_ids
-        children = True
-        while children:
-            children = list(Category.objects.filter(activity=True, parent_id__in=parents).values_list('id', flat=True))
-            categories_ids += children
-            parents = children
-
-        active_child_categories_ids = list(Category.objects.filter(
-            id__in=categories_ids, children__isnull=True
-        ).values_list('id', flat=True))
-
-        queryset = Product.objects.filter(activity=True, kind__in=[Product.UNIQUE, Product.CHILD]).filter(
-            Q(categories__in=active_child_categories_ids) | Q(parent__categories__in=active_child_categories_ids)
-        ).distinct().order_by('name')
+        queryset = get_searchable_products().order_by('name')
 
         if text:
-            queryset_art = queryset.annotate(
-                similarity=TrigramSimilarity(Cast('art', CharField()), text)
-            ).filter(similarity__gt=0.3)
-            queryset_trgm = queryset.exclude(id__in=queryset_art.values_list('id', flat=True)).annotate(
-                similarity=TrigramSimilarity('name', text)
-            ).filter(similarity__gt=0.15)
-            queryset = (queryset_art | queryset_trgm).order_by('-similarity')
+            queryset = search_products(queryset, text)
 
         if tags:
             tags_list = tags.split(',')
-            queryset = queryset.filter(tags__name__in=tags_list)
+            queryset = queryset.filter(id__in=Product.objects.filter(tags__name__in=tags_list).values('id'))
         if article:
-            queryset = queryset.annotate(
-                similarity=TrigramSimilarity(Cast('art', CharField()), article)
-            ).filter(similarity__gt=0.7).order_by('-similarity')
+            queryset = search_products_by_art(queryset, article, 0.7)
         if sort_by == 'name':
             if direction == 'asc':
                 queryset = queryset.order_by('name')
@@ -509,4 +364,18 @@ class SearchProductListView(ListAPIView):
                 queryset = queryset.order_by('-price')
             else:
                 queryset = queryset.order_by('price')
-        return queryset
+        return prefetch_products_listing(queryset)
+
+
+class SuggestionListView(APIView):
+    """
+    Suggestions of the search as you type: categories, tags, products names and arts starting with the text.
+    """
+
+    def get(self, request):
+        text = request.query_params.get('text') or ''
+        try:
+            limit = min(max(int(request.query_params.get('limit')), 1), MAX_SUGGESTIONS_LIMIT)
+        except (TypeError, ValueError):
+            limit = SUGGESTIONS_LIMIT
+        return Response(get_suggestions(text, limit) if text.strip() else [])
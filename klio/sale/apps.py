@@ -5,3 +5,6 @@ from django.utils.translation import ugettext_lazy as _
 class SaleConfig(AppConfig):
     name = 'sale'
     verbose_name = _('Sale App')
+
+    def ready(self):
+        from . import signals  # noqa: F401
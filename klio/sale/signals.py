@@ -0,0 +1,56 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from products.listing import schedule_listings_specials_refresh
+from .models import Special, SpecialProduct
+from .utils import get_specials_products_ids
+
+
+@receiver(post_save, sender=Special)
+def refresh_special_listings(sender, instance, raw=False, **kwargs):
+    """
+    Only the listings of the products the special may apply to are checked.
+    """
+    if not raw:
+        schedule_listings_specials_refresh(get_specials_products_ids(specials_ids=[instance.id]))
+
+
+@receiver(pre_delete, sender=Special)
+def refresh_deleted_special_listings(sender, instance, **kwargs):
+    # Relations of the special are deleted with it, the products are found before
+    schedule_listings_specials_refresh(get_specials_products_ids(specials_ids=[instance.id]))
+
+
+@receiver(pre_save, sender=SpecialProduct)
+def refresh_moved_special_product_listing(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk:
+        schedule_listings_specials_refresh(
+            SpecialProduct.objects.filter(pk=instance.pk).exclude(product_id=instance.product_id).values_list(
+                'product_id', flat=True
+            )
+        )
+
+
+@receiver(post_save, sender=SpecialProduct)
+@receiver(post_delete, sender=SpecialProduct)
+def refresh_special_product_listing(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_listings_specials_refresh([instance.product_id])
+
+
+@receiver(m2m_changed, sender=Special.categories.through)
+@receiver(m2m_changed, sender=Special.tags.through)
+def refresh_special_members_listings(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Products of the added or removed categories (tags) are checked, the cleared ones are found before the clear.
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    name = 'categories' if sender is Special.categories.through else 'tags'
+    if reverse:
+        members_ids = [instance.pk]
+    elif action == 'pre_clear':
+        members_ids = getattr(instance, name).values_list('id', flat=True)
+    else:
+        members_ids = pk_set
+    schedule_listings_specials_refresh(get_specials_products_ids(**{name + '_ids': members_ids}))
@@ -0,0 +1,145 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from products.models import Category, Product, ProductListing
+from tags.models import Tag
+from .models import Special, SpecialProduct
+from .utils import SpecialPriceResolver
+
+
+class SpecialPriceResolverTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Rings', slug='rings')
+        cls.inactive_category = Category.objects.create(name='Archive', slug='archive', activity=False)
+        cls.tag = Tag.objects.create(name='Gifts')
+
+        cls.product = Product.objects.create(name='Ring', slug='ring', art=1, price=Decimal('200'))
+        cls.product.categories.add(cls.category)
+        cls.product.tags.add(cls.tag)
+        cls.parent = Product.objects.create(name='Chain', slug='chain', art=2, kind=Product.PARENT)
+        cls.parent.categories.add(cls.category)
+        cls.child = Product.objects.create(name='50', slug='chain-50', art=3, kind=Product.CHILD, parent=cls.parent,
+                                           price=Decimal('100'))
+        cls.tagged = Product.objects.create(name='Earrings', slug='earrings', art=4, price=Decimal('50'))
+        cls.tagged.categories.add(cls.inactive_category)
+        cls.tagged.tags.add(cls.tag)
+        cls.no_price = Product.objects.create(name='Brooch', slug='brooch', art=5)
+        cls.no_price.categories.add(cls.category)
+
+    def create_special(self, slug, discount_type=Special.PERCENT, discount_amount=None, activity=True, **kwargs):
+        return Special.objects.create(name=slug, slug=slug, deadline=timezone.now() + timedelta(days=7),
+                                      activity=activity, discount_type=discount_type,
+                                      discount_amount=discount_amount, **kwargs)
+
+    def test_product_relation(self):
+        special = self.create_special('rings', discount_amount=Decimal('10'))
+        special.categories.add(self.category)
+        own = self.create_special('own', discount_amount=Decimal('20'))
+        SpecialProduct.objects.create(special=own, product=self.product)
+        main = self.create_special('main', discount_type=Special.FIXED, discount_amount=Decimal('30'))
+        SpecialProduct.objects.create(special=main, product=self.product, on_main=True)
+
+        resolver = SpecialPriceResolver()
+        self.assertEqual(resolver.resolve(self.product), {'slug': 'main', 'threshold': 0, 'new_price': '170.00'})
+        self.assertEqual(resolver.resolve(self.child)['slug'], 'rings')
+
+    def test_relation_discount(self):
+        special = self.create_special('own', discount_amount=Decimal('50'), threshold=3)
+        SpecialProduct.objects.create(special=special, product=self.product, discount_amount=Decimal('15'))
+        self.assertEqual(SpecialPriceResolver().resolve(self.product),
+                         {'slug': 'own', 'threshold': 3, 'new_price': '185.00'})
+
+    def test_category(self):
+        tag_special = self.create_special('gifts', discount_amount=Decimal('50'))
+        tag_special.tags.add(self.tag)
+        first = self.create_special('first', discount_amount=Decimal('10'))
+        second = self.create_special('second', discount_amount=Decimal('20'))
+        for special in (second, first):
+            special.categories.add(self.category)
+        archive = self.create_special('archive', discount_amount=Decimal('30'))
+        archive.categories.add(self.inactive_category)
+
+        resolver = SpecialPriceResolver()
+        resolver.prepare([self.product, self.child, self.tagged])
+        self.assertEqual(resolver.resolve(self.product)['new_price'], '180.00')
+        # Children inherit the categories of their parents
+        self.assertEqual(resolver.resolve(self.child), {'slug': 'first', 'threshold': 0, 'new_price': '90.00'})
+        # Specials of the inactive categories are skipped
+        self.assertEqual(resolver.resolve(self.tagged), {'slug': 'gifts', 'threshold': 0, 'new_price': '25.00'})
+
+    def test_prices(self):
+        self.create_special('percent', discount_amount=Decimal('12.5')).categories.add(self.category)
+        resolver = SpecialPriceResolver()
+        self.assertEqual(resolver.resolve(self.product)['new_price'], '175.00')
+        self.assertEqual(resolver.resolve(self.no_price), {'slug': 'percent', 'threshold': 0})
+
+        Special.objects.update(discount_type=Special.FIXED)
+        self.assertEqual(SpecialPriceResolver().resolve(self.product)['new_price'], '187.50')
+
+        Special.objects.update(discount_amount=None)
+        self.assertEqual(SpecialPriceResolver().resolve(self.product), {'slug': 'percent', 'threshold': 0})
+
+    def test_inactive(self):
+        special = self.create_special('inactive', discount_amount=Decimal('10'), activity=False)
+        special.categories.add(self.category)
+        special.tags.add(self.tag)
+        SpecialProduct.objects.create(special=special, product=self.product, on_main=True)
+
+        resolver = SpecialPriceResolver()
+        for product in (self.product, self.child, self.tagged):
+            self.assertIsNone(resolver.resolve(product))
+
+
+class ListingsSpecialsTestCase(TransactionTestCase):
+    """
+    Specials of the listings are refreshed on commit for the products the changed special may apply to only.
+    """
+
+    def setUp(self):
+        self.category = Category.objects.create(name='Rings', slug='rings')
+        self.tag = Tag.objects.create(name='Gifts')
+        self.parent = Product.objects.create(name='Chain', slug='chain', art=1, kind=Product.PARENT)
+        self.parent.categories.add(self.category)
+        self.child = Product.objects.create(name='50', slug='chain-50', art=2, kind=Product.CHILD, parent=self.parent,
+                                            price=Decimal('100'))
+        self.tagged = Product.objects.create(name='Earrings', slug='earrings', art=3, price=Decimal('50'))
+        self.tagged.tags.add(self.tag)
+        self.other = Product.objects.create(name='Brooch', slug='brooch', art=4, price=Decimal('20'))
+        # Listings out of the reach of the specials are not checked
+        ProductListing.objects.filter(product=self.other).update(special_slug='stale')
+
+    def get_slugs(self):
+        return dict(ProductListing.objects.filter(
+            product__in=[self.child, self.tagged, self.other]
+        ).values_list('product__slug', 'special_slug'))
+
+    def test_refresh(self):
+        special = Special.objects.create(name='Sale', slug='sale', deadline=timezone.now() + timedelta(days=7),
+                                         activity=True, discount_amount=Decimal('10'))
+        special.categories.add(self.category)
+        self.assertEqual(self.get_slugs(), {'chain-50': 'sale', 'earrings': '', 'brooch': 'stale'})
+        self.assertEqual(ProductListing.objects.get(product=self.child).special_price, 90)
+
+        special.tags.add(self.tag)
+        special.categories.clear()
+        self.assertEqual(self.get_slugs(), {'chain-50': '', 'earrings': 'sale', 'brooch': 'stale'})
+
+        relation = SpecialProduct.objects.create(special=special, product=self.child)
+        self.assertEqual(self.get_slugs()['chain-50'], 'sale')
+        relation.product = self.parent
+        relation.save()
+        self.assertEqual(self.get_slugs()['chain-50'], '')
+
+        special.activity = False
+        special.save()
+        self.assertEqual(self.get_slugs(), {'chain-50': '', 'earrings': '', 'brooch': 'stale'})
+
+        special.activity = True
+        special.save()
+        self.assertEqual(self.get_slugs()['earrings'], 'sale')
+        special.delete()
+        self.assertEqual(self.get_slugs(), {'chain-50': '', 'earrings': '', 'brooch': 'stale'})
@@ -0,0 +1,145 @@
+from django.db.models import Q
+
+from products.models import Product
+from .models import Special, SpecialProduct
+
+
+def get_specials_products_ids(specials_ids=(), categories_ids=(), tags_ids=()):
+    """
+    Returns ids of the products the specials may apply to (by their products, categories and tags)
+    and of the products of the categories and of the tags. Children of the products are not included.
+    """
+    specials_ids, categories_ids, tags_ids = list(specials_ids), list(categories_ids), list(tags_ids)
+    products_ids = set(SpecialProduct.objects.filter(special_id__in=specials_ids).values_list('product_id', flat=True))
+    products_ids.update(Product.categories.through.objects.filter(
+        Q(category_id__in=categories_ids) |
+        Q(category_id__in=Special.categories.through.objects.filter(special_id__in=specials_ids).values('category_id'))
+    ).values_list('product_id', flat=True))
+    products_ids.update(Product.tags.through.objects.filter(
+        Q(tag_id__in=tags_ids) |
+        Q(tag_id__in=Special.tags.through.objects.filter(special_id__in=specials_ids).values('tag_id'))
+    ).values_list('product_id', flat=True))
+    return products_ids
+
+
+class SpecialPriceResolver(object):
+    """
+    Finds the special offer and the new price of products in memory.
+
+    All active specials with their products, categories and tags are loaded once
+    on creation. Categories and tags of the products are loaded in bulk by `prepare`,
+    so a whole page of products costs two more queries.
+
+    The special is chosen the same way for all serializers:
+    - the product's own special relation (the one shown on main page first);
+    - or a special of one of the active categories of the product (or of its parent);
+    - or a special of one of the active tags of the product.
+    """
+
+    def __init__(self):
+        self.specials = {
+            special.id: special for special in Special.objects.filter(activity=True).only(
+                'id', 'slug', 'threshold', 'discount_type', 'discount_amount'
+            ).order_by('id')
+        }
+
+        self.product_relations = {}
+        for relation in SpecialProduct.objects.filter(special__activity=True).order_by('-on_main', 'id'):
+            self.product_relations.setdefault(relation.product_id, relation)
+
+        self.category_specials = {}
+        for category_id, special_id in Special.categories.through.objects.filter(
+                special__activity=True).order_by('special_id').values_list('category_id', 'special_id'):
+            self.category_specials.setdefault(category_id, special_id)
+
+        self.tag_specials = {}
+        for tag_id, special_id in Special.tags.through.objects.filter(
+                special__activity=True).order_by('special_id').values_list('tag_id', 'special_id'):
+            self.tag_specials.setdefault(tag_id, special_id)
+
+        self.products_categories = {}
+        self.products_tags = {}
+
+    @classmethod
+    def for_context(cls, context):
+        """
+        Returns the resolver of the current request (or of the serializer context if there is no request).
+        """
+        holder = context.get('request')
+        if holder is None:
+            resolver = context.get('special_price_resolver')
+            if resolver is None:
+                resolver = context['special_price_resolver'] = cls()
+            return resolver
+
+        resolver = getattr(holder, '_special_price_resolver', None)
+        if resolver is None:
+            resolver = cls()
+            setattr(holder, '_special_price_resolver', resolver)
+        return resolver
+
+    def prepare(self, products):
+        """
+        Loads active categories and tags of the products which were not loaded yet.
+        """
+        products = [product for product in products if product.id not in self.products_categories]
+        if not products:
+            return
+
+        # Child products inherit categories of their parents
+        owners = {product.id: product.parent_id if product.is_child else product.id for product in products}
+        categories = {}
+        for product_id, category_id in Product.categories.through.objects.filter(
+                product_id__in=set(owners.values()), category__activity=True
+        ).order_by('category_id').values_list('product_id', 'category_id'):
+            categories.setdefault(product_id, []).append(category_id)
+
+        tags = {}
+        for product_id, tag_id in Product.tags.through.objects.filter(
+                product_id__in=owners.keys(), tag__activity=True
+        ).order_by('tag_id').values_list('product_id', 'tag_id'):
+            tags.setdefault(product_id, []).append(tag_id)
+
+        for product in products:
+            self.products_categories[product.id] = categories.get(owners[product.id], [])
+            self.products_tags[product.id] = tags.get(product.id, [])
+
+    def get_special(self, product):
+        """
+        Returns the special of the product and the product's own relation to it (if any).
+        """
+        relation = self.product_relations.get(product.id)
+        if relation:
+            return self.specials[relation.special_id], relation
+
+        self.prepare([product])
+        for memberships, specials in ((self.products_categories[product.id], self.category_specials),
+                                      (self.products_tags[product.id], self.tag_specials)):
+            specials_ids = [specials[member_id] for member_id in memberships if member_id in specials]
+            if specials_ids:
+                return self.specials[min(specials_ids)], None
+        return None, None
+
+    def resolve(self, product):
+        """
+        Returns the special data of the product: slug, threshold and the new price.
+        """
+        special, relation = self.get_special(product)
+        if special is None:
+            return None
+
+        result = {
+            'slug': special.slug,
+            'threshold': special.threshold if special.threshold else 0,
+        }
+        if product.price is None:
+            return result
+
+        if relation and relation.discount_amount:
+            result['new_price'] = str(round(product.price - relation.discount_amount, 2))
+        elif special.discount_amount is not None:
+            if special.discount_type == Special.PERCENT:
+                result['new_price'] = str(round(product.price * (1 - special.discount_amount / 100), 2))
+            elif special.discount_type == Special.FIXED:
+                result['new_price'] = str(round(product.price - special.discount_amount, 2))
+        return result
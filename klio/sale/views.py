@@ -2,9 +2,10 @@ from django.db.models import Q
 from django.utils import timezone
 from rest_framework import generics
 
+from products.listing import prefetch_products_listing
 from products.models import Product
+from products.pagination import CatalogPagination, get_sort_key
 from products.serializers import ProductListSerializer
-from products.views import DynamicPageNumberPagination
 from .models import Special
 from .serializers import SpecialDetailSerializer, SpecialListSerializer
 
@@ -28,7 +29,10 @@ class SpecialDetailView(generics.RetrieveUpdateDestroyAPIView):
 
 class SpecialProductListView(generics.ListAPIView):
     serializer_class = ProductListSerializer
-    pagination_class = DynamicPageNumberPagination
+    pagination_class = CatalogPagination
+
+    def get_sort_key(self):
+        return get_sort_key(self.request.query_params, default='name')
 
     def get_queryset(self):
         sort_by = self.request.query_params.get('sortby')
@@ -55,4 +59,4 @@ class SpecialProductListView(generics.ListAPIView):
                 queryset = queryset.order_by('-price')
             else:
                 queryset = queryset.order_by('price')
-        return queryset
+        return prefetch_products_listing(queryset)
@@ -1,10 +1,12 @@
 from rest_framework import generics
 
+from general.cache import CachedResponseMixin
 from .serializers import TagSerializer
 from .models import Tag
 
 
-class TagListView(generics.ListAPIView):
+class TagListView(CachedResponseMixin, generics.ListAPIView):
+    cache_models = (Tag,)
     serializer_class = TagSerializer
     queryset = Tag.objects.filter(activity=True)
 